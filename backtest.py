@@ -0,0 +1,210 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from candle_store import INTERVAL_MS, FIELDS, OPEN_TIME, HIGH, LOW, CLOSE
+from config import SYMBOLS, calc_sl_tp
+from exit_rules import reversal_flags, position_pnl
+from indicators import indicator_series
+from kline_cache import map_file
+from signals import FEATURES, decide_signals
+
+# Прогон исторических свечей через те же правила, что и в bot.py: голоса входа по 1m,
+# выход по развороту на 15m/1h и уровни SL/TP из calc_sl_tp.
+# Файлы: <data_dir>/<SYMBOL>_<interval>.csv или .parquet с колонками
+# open_time (мс или дата), open, high, low, close, volume, либо .bin из кэша свечей (kline_cache.py).
+# python backtest.py --data-dir data --mode scalp --stake 100 --leverage 5
+# python backtest.py --data-dir klines   # история, накопленная ботом / python kline_cache.py --days 30
+
+
+def load_candles_file(path):
+    if path.endswith(".bin"):
+        return map_file(path)
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    if "open_time" not in df.columns and "timestamp" in df.columns:
+        df = df.rename(columns={"timestamp": "open_time"})
+    open_time = df["open_time"]
+    if not pd.api.types.is_numeric_dtype(open_time):
+        open_time = pd.to_datetime(open_time).astype("int64") // 1_000_000
+    candles = np.empty((len(FIELDS), len(df)))
+    candles[OPEN_TIME] = open_time.to_numpy(dtype=np.float64)
+    for i, field in enumerate(FIELDS[1:], start=1):
+        candles[i] = df[field].to_numpy(dtype=np.float64)
+    order = np.argsort(candles[OPEN_TIME], kind="stable")
+    return candles[:, order]
+
+
+def find_candles_file(data_dir, symbol, interval):
+    for ext in (".parquet", ".csv", ".bin"):
+        path = os.path.join(data_dir, f"{symbol}_{interval}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def entry_features(candles):
+    # Индикаторы не зависят от порогов сигнала: при переборе параметров считаются один раз
+    values = indicator_series(candles)
+    return np.vstack([values[name] for name in FEATURES])
+
+
+def entry_signals(candles, params=None, features=None):
+    if features is None:
+        features = entry_features(candles)
+    return decide_signals(*features, params=params)
+
+
+def first_true(mask):
+    # Индекс первого True или None
+    if not len(mask):
+        return None
+    i = int(np.argmax(mask))
+    return i if mask[i] else None
+
+
+def backtest_symbol(symbol, entry_candles, exit_candles, stake=100.0, leverage=1.0,
+                    params=None, stop_loss_percent=None, take_profit_percent=None, features=None):
+    # Сделки по одной монете; в каждый момент не больше одной позиции, как в bot.py
+    signals = entry_signals(entry_candles, params, features)
+    signal_idx = np.flatnonzero(signals != None)  # noqa: E711 — поэлементное сравнение
+    exit_step = exit_candles[OPEN_TIME, 1] - exit_candles[OPEN_TIME, 0] if exit_candles.shape[1] > 1 else 0
+    exit_close_time = exit_candles[OPEN_TIME] + exit_step
+    exit_buy, exit_sell = reversal_flags(exit_candles)
+    exit_buy_idx = np.flatnonzero(exit_buy)
+    exit_sell_idx = np.flatnonzero(exit_sell)
+    entry_step = INTERVAL_MS["1m"]
+    entry_close_time = entry_candles[OPEN_TIME] + entry_step
+
+    trades = []
+    n = entry_candles.shape[1]
+    pos = 0
+    while True:
+        k = np.searchsorted(signal_idx, pos)
+        if k >= len(signal_idx):
+            break
+        i = signal_idx[k]
+        side = signals[i]
+        entry = entry_candles[CLOSE, i]
+        entry_time = entry_close_time[i]
+        stop_loss, take_profit = calc_sl_tp(side, entry, stop_loss_percent, take_profit_percent)
+
+        # Первая свеча таймфрейма выхода, закрывшаяся после входа и давшая разворот
+        first_exit_bar = np.searchsorted(exit_close_time, entry_time, side="right")
+        flagged = exit_buy_idx if side == "BUY" else exit_sell_idx
+        r = np.searchsorted(flagged, first_exit_bar)
+        if r < len(flagged):
+            j = flagged[r]
+            exit_time = exit_close_time[j]
+            exit_price = exit_candles[CLOSE, j]
+            reason = "reversal"
+            end = int(np.searchsorted(entry_close_time, exit_time, side="right"))
+        else:
+            j = None
+            end = n
+
+        # SL/TP по минутным свечам до разворота; если задеты оба в одной свече — считаем SL
+        lows = entry_candles[LOW, i + 1:end]
+        highs = entry_candles[HIGH, i + 1:end]
+        if side == "BUY":
+            sl_hit, tp_hit = first_true(lows <= stop_loss), first_true(highs >= take_profit)
+        else:
+            sl_hit, tp_hit = first_true(highs >= stop_loss), first_true(lows <= take_profit)
+        hit = min((h for h in (sl_hit, tp_hit) if h is not None), default=None)
+        if hit is not None:
+            exit_index = i + 1 + hit
+            exit_time = entry_close_time[exit_index]
+            if hit == sl_hit:
+                exit_price, reason = stop_loss, "stop_loss"
+            else:
+                exit_price, reason = take_profit, "take_profit"
+        elif j is None:
+            # Позиция не закрылась до конца данных
+            break
+        else:
+            exit_index = max(end - 1, i)
+
+        trades.append({
+            "coin": symbol,
+            "side": side,
+            "entry": entry,
+            "exit": exit_price,
+            "entry_time": int(entry_time),
+            "exit_time": int(exit_time),
+            "reason": reason,
+            "stake": stake,
+            "leverage": leverage,
+            "pnl": position_pnl(side, entry, exit_price, stake, leverage),
+        })
+        pos = exit_index + 1
+    return trades
+
+
+def summarize(trades, balance=1000.0):
+    if not trades:
+        return {"trades": 0, "pnl": 0.0, "win_rate": 0.0, "max_drawdown": 0.0, "final_balance": balance}
+    trades = sorted(trades, key=lambda t: t["exit_time"])
+    pnl = np.array([t["pnl"] for t in trades])
+    equity = balance + np.cumsum(pnl)
+    peak = np.maximum.accumulate(np.concatenate(([balance], equity)))[1:]
+    drawdown = (peak - equity) / peak
+    return {
+        "trades": len(trades),
+        "pnl": float(pnl.sum()),
+        "win_rate": float((pnl > 0).mean()),
+        "max_drawdown": float(drawdown.max()),
+        "final_balance": float(equity[-1]),
+    }
+
+
+def load_history(data_dir, symbols=SYMBOLS, mode="long"):
+    # {symbol: (свечи 1m, свечи таймфрейма выхода)}
+    exit_interval = "15m" if mode == "scalp" else "1h"
+    history = {}
+    for symbol in symbols:
+        entry_path = find_candles_file(data_dir, symbol, "1m")
+        exit_path = find_candles_file(data_dir, symbol, exit_interval)
+        if entry_path is None or exit_path is None:
+            print(f"Нет данных для {symbol} ({'1m' if entry_path is None else exit_interval}), пропускаем.")
+            continue
+        history[symbol] = (load_candles_file(entry_path), load_candles_file(exit_path))
+    return history
+
+
+def run_backtest(data_dir, symbols=SYMBOLS, mode="long", stake=100.0, leverage=1.0, params=None):
+    trades = []
+    for symbol, (entry_candles, exit_candles) in load_history(data_dir, symbols, mode).items():
+        trades.extend(backtest_symbol(symbol, entry_candles, exit_candles, stake, leverage, params))
+    return trades
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест правил входа и выхода bot.py")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--mode", choices=["long", "scalp"], default="long")
+    parser.add_argument("--symbols", nargs="*", default=SYMBOLS)
+    parser.add_argument("--stake", type=float, default=100.0)
+    parser.add_argument("--leverage", type=float, default=1.0)
+    parser.add_argument("--balance", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    trades = run_backtest(args.data_dir, args.symbols, args.mode, args.stake, args.leverage)
+    summary = summarize(trades, args.balance)
+    print(f"Сделок: {summary['trades']}, PnL: {summary['pnl']:+.2f} USDT, винрейт: {summary['win_rate']:.1%}, "
+          f"макс. просадка: {summary['max_drawdown']:.1%}, итоговый баланс: {summary['final_balance']:.2f} USDT")
+    for symbol in args.symbols:
+        symbol_pnl = sum(t["pnl"] for t in trades if t["coin"] == symbol)
+        count = sum(1 for t in trades if t["coin"] == symbol)
+        if count:
+            print(f"  {symbol}: {count} сделок, PnL {symbol_pnl:+.2f} USDT")
+    print(f"Время: {time.perf_counter() - started:.2f} c")
+
+
+if __name__ == "__main__":
+    main()
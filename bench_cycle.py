@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from candle_store import INTERVAL_MS
+from fake_binance import FakeClient
+from fake_telegram import FakeTelegramServer
+
+# Нагрузочный прогон цикла bot.py без сети: тысячи синтетических пользователей в user_data.json,
+# Binance и Telegram заменены локальными детерминированными заглушками с настраиваемой задержкой.
+# Каждая ячейка матрицы (пользователи × символы) считается в отдельном процессе, чтобы пик памяти
+# и состояние модулей не смешивались.
+# python bench_cycle.py --users 100,1000,5000 --symbols 3,9 --cycles 5 --kline-latency 0.02
+# С --universe --symbols — число пар на «бирже»: анализируются SYMBOLS и прошедшие отбор universe.py
+# python bench_cycle.py --users 1000 --symbols 9,300 --universe --kline-latency 0.02
+
+START_MS = 1_700_002_800_000  # ровно час: в первом цикле закрываются все интервалы
+SCHEDULE_INTERVALS = ["1m", "15m", "1h"]
+READ_METHODS = {"load_user_data", "load_cycle_data", "list_chat_ids", "get_balance", "load_positions", "load_trades",
+                "get_trading_mode", "get_trade_stats"}
+
+
+class CountingStorage:
+    # Обёртка хранилища: считает чтения и записи, сами вызовы передаёт как есть
+    def __init__(self, storage):
+        self._storage = storage
+        self.reads = 0
+        self.writes = 0
+
+    def __getattr__(self, name):
+        method = getattr(self._storage, name)
+        if not callable(method) or name.startswith("_"):
+            return method
+
+        def counted(*args, **kwargs):
+            if name in READ_METHODS:
+                self.reads += 1
+            else:
+                self.writes += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+def make_symbols(count):
+    from config import SYMBOLS
+    return (SYMBOLS + [f"SYN{i}USDT" for i in range(count)])[:count]
+
+
+def make_user_data(users, symbols, fake, seed=0, max_positions=3):
+    # Балансы, режимы и открытые позиции у цены заглушки (часть сразу попадает под SL/TP)
+    from config import calc_sl_tp
+    rnd = random.Random(seed)
+    data = {"balances": {}, "positions": {}, "trades": {}, "trading_modes": {}}
+    for i in range(users):
+        chat_id = str(100_000_000 + i)
+        data["balances"][chat_id] = 1000.0
+        data["trading_modes"][chat_id] = rnd.choice(["long", "scalp"])
+        positions = []
+        for coin in rnd.sample(symbols, rnd.randint(0, min(max_positions, len(symbols)))):
+            side = rnd.choice(["BUY", "SELL"])
+            entry = float(fake._price(coin)) * (1 + rnd.gauss(0, 0.01))
+            stop_loss, take_profit = calc_sl_tp(side, entry)
+            positions.append({
+                "coin": coin, "side": side, "entry": entry,
+                "stop_loss": stop_loss, "take_profit": take_profit,
+                "leverage": float(rnd.choice([1, 5, 10])), "stake": 100.0,
+            })
+        data["positions"][chat_id] = positions
+    return data
+
+
+def install_fake_binance(fake):
+    # Client внутри шлюза binance_api (и любые другие экземпляры) ходит в заглушку
+    from binance.client import Client
+    Client.ping = lambda self: fake.ping()
+    Client.get_klines = lambda self, **kwargs: fake.get_klines(**kwargs)
+    Client.get_symbol_ticker = lambda self, **kwargs: fake.get_symbol_ticker(**kwargs)
+    Client.get_all_tickers = lambda self, **kwargs: fake.get_all_tickers()
+    Client.get_ticker = lambda self, **kwargs: fake.get_ticker(**kwargs)
+    Client.get_exchange_info = lambda self, **kwargs: fake.get_exchange_info()
+
+
+def max_rss_mb():
+    # ru_maxrss на Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_cell(users, symbol_count, cycles, backend, kline_latency, telegram_latency, seed, workers=0,
+             dynamic_universe=False):
+    workdir = tempfile.mkdtemp(prefix="bench_cycle_")
+    # Воркеры shard_pool открывают хранилище сами, по путям по умолчанию относительно cwd
+    os.chdir(workdir)
+    os.environ["STORAGE_BACKEND"] = backend
+    fake = FakeClient(START_MS, seed=seed, latency=kline_latency)
+    install_fake_binance(fake)
+
+    import config
+    from storage import create_storage
+    symbols = make_symbols(symbol_count)
+    fake.symbols = symbols
+    json_path = os.path.join(workdir, config.USER_DATA_FILE)
+    with open(json_path, "w") as f:
+        json.dump(make_user_data(users, symbols, fake, seed), f)
+    storage = CountingStorage(create_storage(backend, json_path, os.path.join(workdir, config.USER_DATA_DB)))
+    config._storage = storage
+
+    import bot
+    from scheduler import closed_intervals
+    from shard_pool import ShardPool
+    from telegram_bot import NotificationDispatcher
+    from universe import SymbolUniverse
+    if dynamic_universe:
+        bot.universe = SymbolUniverse(bot.client)
+    else:
+        bot.SYMBOLS = symbols
+
+    server = FakeTelegramServer(latency=telegram_latency)
+    server.start()
+    # Лимиты Telegram в заглушке не действуют: измеряем сам бот, а не 30 сообщений/с
+    dispatcher = NotificationDispatcher(token="bench", base_url=server.url, global_rate=1e9, chat_rate=1e9)
+    dispatcher.start()
+    pool = ShardPool(workers, capacity=len(symbols)) if workers > 1 else None
+    baseline_rss = max_rss_mb()
+
+    rows = []
+    try:
+        for cycle in range(cycles):
+            boundary = START_MS + cycle * INTERVAL_MS["1m"]
+            fake.now_ms = boundary + 2_000
+            due = closed_intervals(boundary, SCHEDULE_INTERVALS)
+            fake.calls.clear()
+            storage.reads = storage.writes = 0
+            queued = dispatcher.stats()["queued"]
+
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                bot.run_cycle(dispatcher, due, closed_before=boundary, pool=pool)
+            wall = time.perf_counter() - started
+            dispatcher.flush()
+            delivered = time.perf_counter() - started
+
+            rows.append({
+                "users": users, "symbols": symbol_count, "analyzed": len(bot.SYMBOLS), "cycle": cycle + 1,
+                "due": ",".join(i for i in SCHEDULE_INTERVALS if i in due),
+                "wall_s": wall, "delivery_s": delivered, "api_calls": len(fake.calls),
+                "storage_reads": storage.reads, "storage_writes": storage.writes,
+                "messages": dispatcher.stats()["queued"] - queued,
+                "peak_rss_mb": max_rss_mb(), "baseline_rss_mb": baseline_rss,
+            })
+    finally:
+        if pool is not None:
+            pool.close()
+        dispatcher.stop(timeout=10)
+        server.stop()
+    return rows
+
+
+def parse_counts(text):
+    return [int(v) for v in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон цикла bot.py на заглушках Binance и Telegram")
+    parser.add_argument("--users", type=parse_counts, default=[100, 1000, 5000])
+    parser.add_argument("--symbols", type=parse_counts, default=[3, 9])
+    parser.add_argument("--cycles", type=int, default=3, help="первый цикл — все интервалы закрыты, дальше только 1m")
+    parser.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--kline-latency", type=float, default=0.0, help="задержка ответа Binance, секунды")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка ответа Telegram, секунды")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="процессов shard_pool; чтения и записи хранилища в воркерах не считаются")
+    parser.add_argument("--universe", action="store_true",
+                        help="динамический список монет: --symbols — сколько пар на бирже")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="сохранить строки результатов в JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'польз.':>7} {'симв.':>5} {'анализ':>6} {'цикл':>4} {'интервалы':>11} {'цикл, с':>8} {'доставка, с':>11} "
+          f"{'API':>5} {'чтений':>6} {'записей':>7} {'сообщ.':>6} {'RSS, МБ':>8}")
+    for users in args.users:
+        for symbol_count in args.symbols:
+            # Отдельный процесс на ячейку: чистые модули bot/config и честный пик RSS
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                rows = pool.submit(run_cell, users, symbol_count, args.cycles, args.backend,
+                                   args.kline_latency, args.telegram_latency, args.seed, args.workers,
+                                   args.universe).result()
+            for row in rows:
+                print(f"{row['users']:>7} {row['symbols']:>5} {row['analyzed']:>6} {row['cycle']:>4} {row['due']:>11} {row['wall_s']:>8.3f} "
+                      f"{row['delivery_s']:>11.3f} {row['api_calls']:>5} {row['storage_reads']:>6} "
+                      f"{row['storage_writes']:>7} {row['messages']:>6} {row['peak_rss_mb']:>8.1f}")
+            results.extend(rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Результаты: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
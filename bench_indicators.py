@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+
+from bot import apply_indicators, check_trade_signal_extended, check_trade_signal_values, ENTRY_LOOKBACK
+from candle_store import CandleBuffer, candles_to_frame
+from fake_binance import FakeClient
+from indicators import IndicatorEngine
+
+# Сравнение пересчёта индикаторов по всему окну (apply_indicators) с IndicatorEngine:
+# python bench_indicators.py
+
+SYMBOL = "BTCUSDT"
+START_MS = 1_700_000_000_000
+CYCLES = 500
+CHECKED = ("SMA_50", "SMA_200", "RSI", "ATR")
+
+
+def full_path(candles):
+    df = apply_indicators(candles_to_frame(candles))
+    return df, check_trade_signal_extended(df)
+
+
+def main():
+    client = FakeClient(START_MS)
+    buf = CandleBuffer("1m", capacity=1000)
+    buf.extend(client.get_klines(SYMBOL, "1m", limit=ENTRY_LOOKBACK))
+    engine = IndicatorEngine()
+    engine.update(SYMBOL, "1m", buf.view(ENTRY_LOOKBACK))
+
+    full_time = 0.0
+    engine_time = 0.0
+    max_error = 0.0
+    mismatches = 0
+    for cycle in range(1, CYCLES + 1):
+        client.now_ms = START_MS + cycle * 60_000
+        buf.extend(client.get_klines(SYMBOL, "1m", limit=2))
+        candles = buf.view(ENTRY_LOOKBACK)
+
+        t0 = time.perf_counter()
+        df, expected_signal = full_path(candles)
+        t1 = time.perf_counter()
+        latest = engine.update(SYMBOL, "1m", candles)
+        signal = check_trade_signal_values(latest)
+        t2 = time.perf_counter()
+        full_time += t1 - t0
+        engine_time += t2 - t1
+
+        mismatches += signal != expected_signal
+        row = df.iloc[-1]
+        for name in CHECKED:
+            if not np.isnan(row[name]):
+                max_error = max(max_error, abs(latest[name] - row[name]) / abs(row[name]))
+
+    print(f"Циклов: {CYCLES}, окно: {ENTRY_LOOKBACK} свечей")
+    print(f"apply_indicators + check_trade_signal_extended: {full_time / CYCLES * 1e6:.1f} мкс/цикл")
+    print(f"IndicatorEngine + check_trade_signal_values:    {engine_time / CYCLES * 1e6:.1f} мкс/цикл")
+    print(f"Ускорение: {full_time / engine_time:.1f}x")
+    print(f"Макс. относительное расхождение индикаторов: {max_error:.2e}, расхождений сигнала: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
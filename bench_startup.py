@@ -0,0 +1,187 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from bench_cycle import START_MS, install_fake_binance, make_symbols, make_user_data
+from candle_store import INTERVAL_MS
+from fake_binance import FakeClient
+from fake_telegram import FakeTelegramServer
+
+# Время запуска bot.py без сети: импорт модулей и путь до первого сигнала после перезапуска.
+# «Прошлый запуск» отрабатывает несколько циклов на заглушках и останавливается (кэш свечей и
+# снимок warm_state.py остаются в рабочем каталоге), затем каждый режим стартует в новом процессе:
+#   cold  — без кэша свечей и снимка: вся история из REST, индикаторы с нуля;
+#   cache — только кэш свечей (как до warm_state.py);
+#   warm  — кэш свечей и снимок.
+# ttfs — от импорта до поставленного в очередь сообщения первого цикла (ожидание границы минуты не входит).
+# python bench_startup.py --users 1000 --symbols 9,100 --kline-latency 0.02
+
+MODES = ("cold", "cache", "warm")
+# Сколько минут бот был остановлен между запусками
+DOWNTIME_MINUTES = 5
+
+
+def measure_import(module):
+    # Отдельный интерпретатор: модули бенчмарка не должны попасть в sys.modules заранее
+    code = (
+        "import sys, time, json\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "heavy = [name for name in ('pandas', 'ta', 'binance', 'telegram') if name in sys.modules]\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started, 'heavy': heavy}))\n"
+    )
+    env = dict(os.environ, KLINE_CACHE_DIR="", WARM_STATE_FILE="", PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        output = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, check=True,
+                                capture_output=True, text=True, timeout=120).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["module"] = module
+    return result
+
+
+def setup_cell(workdir, mode, kline_latency, seed):
+    os.chdir(workdir)
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["KLINE_CACHE_DIR"] = "" if mode == "cold" else os.path.join(workdir, "klines")
+    os.environ["WARM_STATE_FILE"] = os.path.join(workdir, "warm_state.npz") if mode == "warm" else ""
+    fake = FakeClient(START_MS, seed=seed, latency=kline_latency)
+    import config
+    from storage import create_storage
+    config._storage = create_storage("sqlite", config.USER_DATA_FILE, config.USER_DATA_DB)
+    return fake
+
+
+def previous_run(workdir, users, symbol_count, cycles, kline_latency, seed):
+    # Несколько циклов и остановка со снимком; пользователи и их notify_state остаются в хранилище
+    fake = setup_cell(workdir, "warm", kline_latency, seed)
+    install_fake_binance(fake)
+    import config
+    symbols = make_symbols(symbol_count)
+    fake.symbols = symbols
+    with open(config.USER_DATA_FILE, "w") as f:
+        json.dump(make_user_data(users, symbols, fake, seed), f)
+    import bot
+    bot.SYMBOLS = symbols
+    dispatcher = DroppingDispatcher()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for cycle in range(cycles):
+            boundary = START_MS + cycle * INTERVAL_MS["1m"]
+            fake.now_ms = boundary + 2_000
+            bot.run_cycle(dispatcher, None, closed_before=boundary)
+        bot.save_warm_state()
+    return os.path.getsize(config.WARM_STATE_FILE)
+
+
+class DroppingDispatcher:
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, message, chat_id):
+        self.sent += 1
+
+
+def restart(workdir, mode, symbol_count, cycles, kline_latency, seed):
+    # Новый процесс после простоя: импорт, снимок, прогрев, затем первый цикл на границе минуты
+    started = time.perf_counter()
+    fake = setup_cell(workdir, mode, kline_latency, seed)
+    import bot
+    import_s = time.perf_counter() - started
+    # Заглушка ставится после импорта: python-binance импортируется при первом запросе и
+    # входит во время прогрева, как у настоящего бота
+    install_start = time.perf_counter()
+    install_fake_binance(fake)
+    binance_import_s = time.perf_counter() - install_start
+    fake.symbols = make_symbols(symbol_count)
+    bot.SYMBOLS = fake.symbols
+    boundary = START_MS + (cycles - 1 + DOWNTIME_MINUTES) * INTERVAL_MS["1m"]
+    fake.now_ms = boundary - 30_000
+    fake.calls.clear()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        stage = time.perf_counter()
+        restored = bot.restore_warm_state()
+        restore_s = time.perf_counter() - stage
+        stage = time.perf_counter()
+        bot.warm_up(fake.now_ms)
+        warmup_s = time.perf_counter() - stage + binance_import_s
+        warmup_calls = len(fake.calls)
+
+        fake.now_ms = boundary + 2_000
+        fake.calls.clear()
+        server = FakeTelegramServer()
+        server.start()
+        from telegram_bot import NotificationDispatcher
+        dispatcher = NotificationDispatcher(token="bench", base_url=server.url, global_rate=1e9, chat_rate=1e9)
+        dispatcher.start()
+        try:
+            stage = time.perf_counter()
+            bot.run_cycle(dispatcher, {"1m"}, closed_before=boundary)
+            first_cycle_s = time.perf_counter() - stage
+            messages = dispatcher.stats()["queued"]
+        finally:
+            dispatcher.stop(timeout=10)
+            server.stop()
+    return {
+        "mode": mode, "symbols": symbol_count, "restored": restored,
+        "import_s": import_s, "restore_s": restore_s, "warmup_s": warmup_s, "warmup_calls": warmup_calls,
+        "first_cycle_s": first_cycle_s, "first_cycle_calls": len(fake.calls), "messages": messages,
+        "ttfs_s": import_s + restore_s + warmup_s + first_cycle_s,
+    }
+
+
+def run_in_process(function, *args):
+    # Отдельный процесс: чистые модули bot/config и честное время импорта
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(function, *args).result()
+
+
+def parse_counts(text):
+    return [int(v) for v in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время запуска bot.py и до первого сигнала на заглушках")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--symbols", type=parse_counts, default=[9, 100])
+    parser.add_argument("--cycles", type=int, default=3, help="циклов в прошлом запуске")
+    parser.add_argument("--kline-latency", type=float, default=0.02, help="задержка ответа Binance, секунды")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="сохранить строки результатов в JSON")
+    args = parser.parse_args()
+
+    imports = [measure_import(module) for module in ("bot", "telegram_commands")]
+    for result in imports:
+        heavy = ", ".join(result["heavy"]) or "нет"
+        print(f"import {result['module']}: {result['seconds']:.3f} c (тяжёлые модули: {heavy})")
+    print()
+
+    rows = []
+    print(f"{'режим':>6} {'симв.':>5} {'импорт, с':>9} {'снимок, с':>9} {'прогрев, с':>10} {'API':>5} "
+          f"{'цикл, с':>8} {'API':>5} {'сообщ.':>6} {'ttfs, с':>8}")
+    for symbol_count in args.symbols:
+        for mode in MODES:
+            with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+                run_in_process(previous_run, workdir, args.users, symbol_count, args.cycles,
+                               args.kline_latency, args.seed)
+                row = run_in_process(restart, workdir, mode, symbol_count, args.cycles, args.kline_latency,
+                                     args.seed)
+            print(f"{row['mode']:>6} {row['symbols']:>5} {row['import_s']:>9.3f} {row['restore_s']:>9.3f} "
+                  f"{row['warmup_s']:>10.3f} {row['warmup_calls']:>5} {row['first_cycle_s']:>8.3f} "
+                  f"{row['first_cycle_calls']:>5} {row['messages']:>6} {row['ttfs_s']:>8.3f}")
+            rows.append(row)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"imports": imports, "rows": rows}, f, indent=2)
+        print(f"Результаты: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
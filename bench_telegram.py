@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from bench_cycle import START_MS, install_fake_binance, parse_counts
+from fake_binance import FakeClient
+from fake_telegram import FakeTelegramServer
+
+# Нагрузочный прогон обработчиков telegram_commands.py без сети: сотни чатов одновременно шлют
+# сценарий из нескольких сообщений, ответы принимает локальная заглушка Telegram. Хранилищу и
+# Binance добавляется задержка, как у медленного диска и REST. Задержка обработчика — от постановки
+# апдейта в очередь до прихода ответа в заглушку. Режимы:
+#   ordered    — ChatOrderedUpdateProcessor (как в run_telegram_bot)
+#   sequential — апдейты по одному, как было до него (concurrent_updates выключен)
+# python bench_telegram.py --chats 100,500 --storage-latency 0.005 --binance-latency 0.05
+
+# Сценарий одного чата: на каждое сообщение ровно один ответ. Баланс во втором сообщении
+# проверяется в третьем ответе — так видно, что апдейты чата не переставились.
+SCRIPT = ["🚀 Установить баланс", "{balance}", "💰 Посмотреть баланс", "📈 Мои позиции", "📜 История сделок"]
+
+
+class SlowStorage:
+    # Обёртка хранилища: каждый вызов ждёт latency секунд (медленный диск, fsync, блокировка базы)
+    def __init__(self, storage, latency):
+        self._storage = storage
+        self.latency = latency
+
+    def __getattr__(self, name):
+        method = getattr(self._storage, name)
+        if not callable(method) or name.startswith("_") or name == "transaction":
+            return method
+
+        def slow(*args, **kwargs):
+            time.sleep(self.latency)
+            return method(*args, **kwargs)
+        return slow
+
+
+def make_update(bot, update_id, chat_id, text):
+    from telegram import Update
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+        },
+    }, bot)
+
+
+async def drive(chats, mode, server, io_threads, concurrent):
+    from telegram.ext import Application
+    import telegram_commands
+
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=io_threads))
+    builder = Application.builder().token("1:TEST").base_url(f"{server.url}/bot")
+    if mode == "ordered":
+        builder = builder.concurrent_updates(telegram_commands.ChatOrderedUpdateProcessor(concurrent))
+    app = builder.build()
+    telegram_commands.add_handlers(app)
+
+    expected = {}
+    sent_at = {}
+    update_id = 0
+    async with app:
+        await app.start()
+        # Все чаты пишут одновременно: k-е сообщения всех чатов, затем (k+1)-е
+        for step, template in enumerate(SCRIPT):
+            for chat_id in chats:
+                update_id += 1
+                text = template.format(balance=chat_id % 10_000 + 100)
+                sent_at.setdefault(str(chat_id), []).append(time.perf_counter())
+                await app.update_queue.put(make_update(app.bot, update_id, chat_id, text))
+        total = len(chats) * len(SCRIPT)
+        deadline = time.monotonic() + 300
+        while len(server.messages) < total and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        await app.stop()
+
+    latencies = []
+    received = {}
+    for (chat_id, text), at in zip(list(server.messages), list(server.received_at)):
+        received.setdefault(chat_id, []).append((at, text))
+    misordered = 0
+    for chat_id, replies in received.items():
+        for (at, _), start in zip(replies, sent_at[chat_id]):
+            latencies.append(at - start)
+        balance_reply = replies[2][1] if len(replies) > 2 else ""
+        if f"{int(chat_id) % 10_000 + 100:.2f}" not in balance_reply:
+            misordered += 1
+    return np.array(latencies), misordered, total
+
+
+def run_cell(chats, mode, backend, storage_latency, binance_latency, telegram_latency, io_threads, concurrent):
+    workdir = tempfile.mkdtemp(prefix="bench_telegram_")
+    os.chdir(workdir)
+    os.environ["STORAGE_BACKEND"] = backend
+    install_fake_binance(FakeClient(START_MS, latency=binance_latency))
+
+    import config
+    storage = config.get_storage()
+    chat_ids = [1_000_000 + i for i in range(chats)]
+    for chat_id in chat_ids:
+        storage.save_positions(chat_id, [{
+            "coin": "BTCUSDT", "side": "BUY", "entry": 100.0, "stop_loss": 98.0, "take_profit": 106.0,
+            "leverage": 2, "stake": 50.0,
+        }])
+    config._storage = SlowStorage(storage, storage_latency)
+
+    server = FakeTelegramServer(latency=telegram_latency)
+    server.start()
+    started = time.perf_counter()
+    try:
+        latencies, misordered, total = asyncio.run(drive(chat_ids, mode, server, io_threads, concurrent))
+    finally:
+        server.stop()
+    wall = time.perf_counter() - started
+    return {
+        "chats": chats, "mode": mode, "updates": total, "replies": len(latencies), "misordered": misordered,
+        "wall_s": wall,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99) * 1000) if len(latencies) else None,
+        "max_ms": float(latencies.max() * 1000) if len(latencies) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков Telegram на заглушках")
+    parser.add_argument("--chats", type=parse_counts, default=[100, 500])
+    parser.add_argument("--modes", default="ordered,sequential")
+    parser.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--storage-latency", type=float, default=0.005, help="задержка вызова хранилища, секунды")
+    parser.add_argument("--binance-latency", type=float, default=0.05, help="задержка ответа Binance, секунды")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка ответа Telegram, секунды")
+    parser.add_argument("--io-threads", type=int, default=16)
+    parser.add_argument("--concurrent", type=int, default=256)
+    parser.add_argument("--output", default=None, help="сохранить строки результатов в JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'чатов':>6} {'режим':>10} {'апдейтов':>8} {'ответов':>7} {'не по порядку':>13} {'всего, с':>8} "
+          f"{'p50, мс':>8} {'p99, мс':>8} {'макс, мс':>8}")
+    for chats in args.chats:
+        for mode in args.modes.split(","):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                row = pool.submit(run_cell, chats, mode, args.backend, args.storage_latency, args.binance_latency,
+                                  args.telegram_latency, args.io_threads, args.concurrent).result()
+            print(f"{row['chats']:>6} {row['mode']:>10} {row['updates']:>8} {row['replies']:>7} {row['misordered']:>13} "
+                  f"{row['wall_s']:>8.2f} {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+            results.append(row)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Результаты: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
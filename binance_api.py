@@ -0,0 +1,226 @@
+import random
+import threading
+import time
+
+import requests
+
+import metrics
+from config import API_KEY, API_SECRET, BINANCE_WEIGHT_LIMIT
+
+# Единая точка доступа к Binance для процесса: учёт веса запросов, объединение одинаковых
+# одновременных запросов и повторы временных ошибок с backoff
+
+# Вес запросов REST API (https://developers.binance.com/docs/binance-spot-api-docs/rest-api)
+WEIGHTS = {
+    "ping": 1,
+    "get_klines": 2,
+    "get_symbol_ticker": 2,
+    "get_all_tickers": 4,
+    # Без symbol: все пары одним запросом
+    "get_ticker": 80,
+    "get_exchange_info": 20,
+}
+
+# Доля лимита, после которой новые запросы ждут следующей минуты: остаток — запас
+# для второго процесса и для запросов, вес которых мы ещё не увидели в заголовке
+WEIGHT_SAFETY = 0.8
+MAX_RETRIES = 4
+MAX_BACKOFF = 30
+
+
+class _Pending:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class BinanceGateway:
+    # Обёртка над Client с теми же методами. Вес считается по минутному окну: своя оценка
+    # плюс X-MBX-USED-WEIGHT-1M из ответов (он общий на IP, поэтому учитывает и второй процесс).
+    # 429/418 останавливают все запросы процесса на Retry-After.
+    def __init__(self, client_factory, weight_limit=BINANCE_WEIGHT_LIMIT, max_retries=MAX_RETRIES,
+                 clock=time.time, sleep=time.sleep):
+        self._client_factory = client_factory
+        self._client = None
+        self.weight_limit = weight_limit
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        # Ответ последнего запроса этого потока (для заголовка веса)
+        self._local = threading.local()
+        self._inflight = {}
+        self._window = None
+        self._used_weight = 0
+        self._blocked_until = 0.0
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._client_factory()
+                    # client.response общий для всех потоков и может оказаться ответом параллельного
+                    # запроса: ответ запоминается хуком сессии в потоке, который его получил
+                    session = getattr(client, "session", None)
+                    if session is not None:
+                        session.hooks["response"].append(self._remember_response)
+                    self._client = client
+        return self._client
+
+    def _remember_response(self, response, *args, **kwargs):
+        self._local.response = response
+
+    def ping(self):
+        return self.call("ping")
+
+    def get_klines(self, **kwargs):
+        return self.call("get_klines", **kwargs)
+
+    def get_symbol_ticker(self, **kwargs):
+        return self.call("get_symbol_ticker", **kwargs)
+
+    def get_all_tickers(self):
+        return self.call("get_all_tickers")
+
+    def get_ticker(self, **kwargs):
+        # Статистика за 24 часа (объём, high/low, лучшие bid/ask)
+        return self.call("get_ticker", **kwargs)
+
+    def get_exchange_info(self):
+        return self.call("get_exchange_info")
+
+    def used_weight(self):
+        with self._lock:
+            return self._used_weight
+
+    def call(self, method, **kwargs):
+        # Одинаковый запрос, который уже выполняется в другом потоке, не отправляется повторно:
+        # ждём его и возвращаем тот же результат (или ту же ошибку)
+        key = (method, tuple(sorted(kwargs.items())))
+        with self._lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[key] = _Pending()
+        if not owner:
+            metrics.inc("binance_coalesced_total", endpoint=method)
+            return pending.wait()
+        try:
+            pending.result = self._request(method, kwargs)
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            pending.done.set()
+        return pending.result
+
+    def _request(self, method, kwargs):
+        from binance.exceptions import BinanceAPIException, BinanceRequestException
+        weight = WEIGHTS.get(method, 1)
+        for attempt in range(self.max_retries + 1):
+            self._reserve(weight)
+            self._local.response = None
+            try:
+                with metrics.span("binance_request_seconds", endpoint=method):
+                    result = getattr(self.client, method)(**kwargs)
+            except BinanceAPIException as e:
+                metrics.inc("binance_errors_total", endpoint=method, status=e.status_code)
+                if e.status_code in (418, 429):
+                    # 429 — лимит превышен, 418 — IP временно заблокирован: ждём сколько сказано
+                    pause = self._retry_after(e) or self._backoff(attempt)
+                    self._block(pause)
+                    print(f"Binance: HTTP {e.status_code} на {method}, пауза {pause:.0f} c.")
+                    # Саму паузу выдержит _reserve перед следующей попыткой
+                    delay = 0
+                elif e.status_code < 500:
+                    raise
+                else:
+                    delay = self._backoff(attempt)
+                last_error = e
+            except (BinanceRequestException, requests.RequestException) as e:
+                metrics.inc("binance_errors_total", endpoint=method, status="network")
+                delay = self._backoff(attempt)
+                print(f"Binance: ошибка сети на {method}: {e}. Повтор через {delay:.1f} c.")
+                last_error = e
+            else:
+                self._record(method)
+                return result
+            if attempt == self.max_retries:
+                # Повторы кончились: наружу — последняя ошибка Binance или сети
+                raise last_error
+            metrics.inc("binance_retries_total", endpoint=method)
+            if delay:
+                self.sleep(delay)
+
+    def _reserve(self, weight):
+        while True:
+            with self._lock:
+                now = self.clock()
+                minute = int(now // 60)
+                if minute != self._window:
+                    self._window = minute
+                    self._used_weight = 0
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._used_weight + weight > self.weight_limit * WEIGHT_SAFETY:
+                    wait = (minute + 1) * 60 - now
+                else:
+                    self._used_weight += weight
+                    return
+            metrics.inc("binance_throttled_total")
+            self.sleep(wait)
+
+    def _record(self, method):
+        metrics.inc("binance_requests_total", endpoint=method)
+        response = getattr(self._local, "response", None)
+        used_weight = response.headers.get("x-mbx-used-weight-1m") if response is not None else None
+        if used_weight is None:
+            return
+        with self._lock:
+            self._used_weight = max(self._used_weight, int(used_weight))
+            metrics.set_gauge("binance_used_weight_1m", self._used_weight)
+
+    def _block(self, delay):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self.clock() + delay)
+
+    @staticmethod
+    def _retry_after(error):
+        headers = getattr(error.response, "headers", None) or {}
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+# Один шлюз на процесс: торговый цикл, kline-поток, кэш цен и команды Telegram делят
+# и учёт веса, и соединение
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def _create_client():
+    # python-binance (с aiohttp и dateparser) импортируется около секунды: только при первом запросе
+    from binance.client import Client
+    return Client(API_KEY, API_SECRET, ping=False)
+
+def get_client():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = BinanceGateway(_create_client)
+    return _gateway
@@ -1,66 +1,153 @@
-import time
 import multiprocessing
-import pandas as pd
-import ta
-from binance.client import Client
+import re
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from config import (
-    API_KEY, API_SECRET, SYMBOLS,
-    STOP_LOSS_PERCENT, TAKE_PROFIT_PERCENT,
-    load_user_data, get_trading_mode, calc_sl_tp, set_balance, get_balance, load_positions, save_positions
+    SYMBOLS, SIGNAL_PARAMS,
+    KLINE_STREAM_ENABLED, KLINE_STREAM_URL, KLINE_STREAM_INTERVALS, METRICS_PORT, SHARD_WORKERS,
+    UNIVERSE_ENABLED, UNIVERSE_MAX_SYMBOLS, KLINE_FETCH_THREADS, PORTFOLIO_ALERTS, WARM_STATE_FILE,
+    STOP_LOSS_PERCENT, TAKE_PROFIT_PERCENT, NOTIFY_DELTA_ONLY, NOTIFY_HEARTBEAT_HOURS,
+    load_cycle_data, calc_sl_tp, apply_closes, log_signals, save_notify_states
+)
+from telegram_bot import NotificationDispatcher
+from binance_api import get_client
+from metrics import inc, span, start_metrics_server
+from notify_state import (
+    ENTRY_BUY, ENTRY_CODES, ENTRY_SELL, NO_ENTRY, POSITION_CLOSED, POSITION_OPEN, delta_lines,
+    has_active_entries, next_state
+)
+from kline_stream import KlineStream
+from indicators import IndicatorEngine
+from signals import decide_signals_from_values
+from candle_store import CandleStore, INTERVAL_MS, candles_to_frame, resample, OPEN_TIME
+from kline_cache import get_kline_cache
+from scheduler import CandleScheduler
+from shard_pool import ShardPool
+from universe import SymbolUniverse
+from portfolio import Portfolio
+from price_cache import PriceCache
+import warm_state
+from exit_rules import EXIT_LOOKBACK
+from exit_engine import (
+    EXIT_NONE, EXIT_REVERSAL, EXIT_STOP_LOSS, EXIT_TAKE_PROFIT, REASON_NAMES, build_position_index, evaluate_exits
 )
-from telegram_bot import send_telegram_message
-from telegram_commands import run_telegram_bot
 
-client = Client(API_KEY, API_SECRET)
+# Общий шлюз Binance: учёт веса, объединение одинаковых запросов и повторы
+client = get_client()
+
+# Глубина истории для сигнала входа (1m): хватает на SMA_200, и окно свечей для проверки выхода
+ENTRY_INTERVAL = "1m"
+ENTRY_LOOKBACK = 250
+CANDLE_CAPACITY = 500
+
+# Старшие таймфреймы собираются из 1m-свечей в памяти, без отдельных запросов к Binance
+RESAMPLED_INTERVALS = {"5m", "15m", "1h", "4h"}
+
+# Запускается в __main__, если включён KLINE_STREAM
+kline_stream = None
+
+# SYMBOLS из config анализируются всегда. С UNIVERSE (universe.py) SYMBOLS перед каждым циклом
+# заменяется на монеты, прошедшие отбор по 24h-тикерам, плюс монеты позиций пользователей
+PINNED_SYMBOLS = list(SYMBOLS)
+universe = None
+
+# Открытые позиции всех пользователей (portfolio.py): в __main__, если включён PORTFOLIO_ALERTS,
+# пересчитываются на каждое обновление цен и перечитываются из хранилища после цикла
+portfolio = None
+
+# Свечи монет цикла загружаются параллельно (кэш/REST ждут сеть), индикаторы — по очереди
+fetch_pool = ThreadPoolExecutor(max_workers=KLINE_FETCH_THREADS, thread_name_prefix="klines")
+
+# Без кэша свечей (KLINE_CACHE_DIR="") свечи из REST накапливаются в кольцевых буферах по (symbol, interval)
+candle_store = CandleStore(capacity=CANDLE_CAPACITY)
+
+# Индикаторы обновляются по новым закрытым свечам, а не пересчитываются по всему окну
+indicator_engine = IndicatorEngine()
+
+def load_candles(symbol, interval, lookback, until=None):
+    # Массив (6, lookback) с последними свечами: из kline-потока, если он запущен, иначе из локального
+    # кэша (у Binance запрашиваются только новые закрытые свечи) или из REST.
+    # until (мс) — граница закрытия: свеча, открытая в until или позже (ещё не закрытая), отбрасывается
+    if interval in RESAMPLED_INTERVALS:
+        factor = INTERVAL_MS[interval] // INTERVAL_MS[ENTRY_INTERVAL]
+        # +1 свеча: окно 1m обычно начинается с середины старшей свечи, её resample отбросит
+        minutes = (lookback + 1) * factor
+        if get_kline_cache() is not None or minutes <= CANDLE_CAPACITY:
+            with span("cycle_stage_seconds", stage="resample"):
+                return resample(load_candles(symbol, ENTRY_INTERVAL, minutes, until), interval, until)[:, -lookback:]
+    fetch = lookback + 1 if until is not None else lookback
+    candles = None
+    if kline_stream is not None:
+        candles = kline_stream.get_window(symbol, interval, fetch)
+    kline_cache = get_kline_cache()
+    if candles is None and kline_cache is not None:
+        # В кэше только закрытые свечи: незакрытая последняя сюда не попадает и без until
+        with span("kline_fetch_seconds", interval=interval):
+            return kline_cache.window(symbol, interval, lookback, until)
+    if candles is None:
+        with span("kline_fetch_seconds", interval=interval):
+            klines = client.get_klines(symbol=symbol, interval=interval, limit=fetch)
+        buf = candle_store.buffer(symbol, interval)
+        buf.extend(klines)
+        candles = buf.view(fetch)
+    if until is not None and candles.shape[1] and candles[OPEN_TIME, -1] >= until:
+        candles = candles[:, :-1]
+    return candles[:, -lookback:]
 
 def get_data(symbol, interval="1m", lookback=100):
-    klines = client.get_klines(symbol=symbol, interval=interval, limit=lookback)
-    df = pd.DataFrame(klines, columns=[
-        'timestamp', 'open', 'high', 'low', 'close', 'volume',
-        'close_time', 'quote_asset_volume', 'number_of_trades',
-        'taker_buy_base_volume', 'taker_buy_quote_volume', 'ignore'
-    ])
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-    df['open'] = df['open'].astype(float)
-    df['high'] = df['high'].astype(float)
-    df['low'] = df['low'].astype(float)
-    df['close'] = df['close'].astype(float)
-    df['volume'] = df['volume'].astype(float)
-    return df[['timestamp', 'open', 'high', 'low', 'close', 'volume']]
+    return candles_to_frame(load_candles(symbol, interval, lookback))
 
 def apply_indicators(df):
+    # ta (и pandas) — только для DataFrame-пути; цикл считает индикаторы в IndicatorEngine
+    import ta
     df['SMA_50'] = df['close'].rolling(window=50).mean()
     df['SMA_200'] = df['close'].rolling(window=200).mean()
     df['RSI'] = ta.momentum.RSIIndicator(df['close'], window=14).rsi()
     df['ATR'] = ta.volatility.AverageTrueRange(df['high'], df['low'], df['close'], window=14).average_true_range()
     return df
 
-def check_trade_signal_extended(df):
+def check_trade_signal_extended(df, params=None):
     latest = df.iloc[-1]
-    rsi_buy = latest['RSI'] < 30
-    rsi_sell = latest['RSI'] > 70
+    return check_trade_signal_values({
+        "close": latest['close'],
+        "volume": latest['volume'],
+        "SMA_50": latest['SMA_50'],
+        "SMA_200": latest['SMA_200'],
+        "RSI": latest['RSI'],
+        "ATR": df['ATR'].iloc[-1],
+        "volume_mean_20": df['volume'].rolling(window=20).mean().iloc[-1],
+        "close_max_20": df['close'].rolling(window=20).max().iloc[-1],
+    }, params)
+
+def check_trade_signal_values(latest, params=None):
+    # latest — значения индикаторов последней свечи (из DataFrame или IndicatorEngine)
+    params = {**SIGNAL_PARAMS, **(params or {})}
+    rsi_buy = latest['RSI'] < params["rsi_buy"]
+    rsi_sell = latest['RSI'] > params["rsi_sell"]
 
     sma50_buy = latest['close'] > latest['SMA_50']
     sma50_sell = latest['close'] < latest['SMA_50']
     sma200_buy = latest['close'] > latest['SMA_200']
     sma200_sell = latest['close'] < latest['SMA_200']
 
-    avg_volume = df['volume'].rolling(window=20).mean().iloc[-1]
-    volume_buy = latest['volume'] > 1.5 * avg_volume
-    volume_sell = latest['volume'] > 1.5 * avg_volume
+    avg_volume = latest['volume_mean_20']
+    volume_buy = latest['volume'] > params["volume_spike"] * avg_volume
+    volume_sell = latest['volume'] > params["volume_spike"] * avg_volume
 
-    recent_max = df['close'].rolling(window=20).max().iloc[-1]
-    resistance_buy = latest['close'] < 0.98 * recent_max
-    resistance_sell = latest['close'] > 0.98 * recent_max
+    recent_max = latest['close_max_20']
+    resistance_buy = latest['close'] < params["resistance_factor"] * recent_max
+    resistance_sell = latest['close'] > params["resistance_factor"] * recent_max
 
-    atr = df['ATR'].iloc[-1]
+    atr = latest['ATR']
     atr_ratio = atr / latest['close']
-    atr_threshold = 0.01
+    atr_threshold = params["atr_threshold"]
     atr_condition = (atr_ratio > atr_threshold)
 
     buy_conditions = sum([rsi_buy, sma50_buy, sma200_buy, volume_buy, resistance_buy, atr_condition])
     sell_conditions = sum([rsi_sell, sma50_sell, sma200_sell, volume_sell, resistance_sell, atr_condition])
-    required_confirmations = 3
+    required_confirmations = params["required_confirmations"]
 
     if buy_conditions >= required_confirmations:
         return "BUY"
@@ -70,118 +157,383 @@ def check_trade_signal_extended(df):
         return None
 
 def get_timeframe_data(symbol, timeframe, lookback=2):
-    klines = client.get_klines(symbol=symbol, interval=timeframe, limit=lookback)
-    df = pd.DataFrame(klines, columns=[
-        'timestamp','open','high','low','close','volume',
-        'close_time','quote_asset_volume','number_of_trades',
-        'taker_buy_base_volume','taker_buy_quote_volume','ignore'
-    ])
-    df['open'] = df['open'].astype(float)
-    df['high'] = df['high'].astype(float)
-    df['low'] = df['low'].astype(float)
-    df['close'] = df['close'].astype(float)
-    df['volume'] = df['volume'].astype(float)
-    return df
+    return candles_to_frame(load_candles(symbol, timeframe, lookback))
+
+class MarketSnapshot:
+    # Рыночные данные одного цикла анализа. Каждая тройка (symbol, interval, lookback)
+    # запрашивается у Binance не более одного раза, а сигнал входа считается один раз
+    # на монету и раздаётся всем пользователям. closed_before — граница, на которой
+    # сработал планировщик: оцениваются только свечи, закрытые к этому моменту.
+    def __init__(self, closed_before=None):
+        self.closed_before = closed_before
+        self._klines = {}
+        self._entry_signals = {}
+
+    def exit_candles(self, symbol, timeframe, lookback=EXIT_LOOKBACK):
+        # Копия, чтобы последующие записи в буфер не меняли данные этого цикла
+        key = (symbol, timeframe, lookback)
+        if key not in self._klines:
+            self._klines[key] = load_candles(symbol, timeframe, lookback, self.closed_before).copy()
+        return self._klines[key]
+
+    def compute_entry_signals(self, symbols):
+        # Индикаторы обновляются по каждой монете, а голоса и решения считаются одним проходом
+        symbols = [symbol for symbol in symbols if symbol not in self._entry_signals]
+        windows = fetch_pool.map(
+            lambda symbol: load_candles(symbol, ENTRY_INTERVAL, ENTRY_LOOKBACK, self.closed_before), symbols)
+        rows = []
+        for symbol, candles in zip(symbols, windows):
+            with span("cycle_stage_seconds", stage="indicators"):
+                rows.append(indicator_engine.update(symbol, ENTRY_INTERVAL, candles))
+        for symbol, row, signal in zip(symbols, rows, decide_signals_from_values(rows)):
+            self._entry_signals[symbol] = (signal, row["close"])
+
+    def has_entry_signals(self):
+        return any(signal for signal, _ in self._entry_signals.values())
+
+    def loaded_exit_candles(self):
+        # {(symbol, timeframe): свечи} уже загруженных окон выхода — для публикации воркерам
+        return {(symbol, timeframe): candles for (symbol, timeframe, lookback), candles in self._klines.items()
+                if lookback == EXIT_LOOKBACK}
+
+    def entry_signals(self):
+        return dict(self._entry_signals)
+
+    def entry_signal(self, symbol):
+        if symbol not in self._entry_signals:
+            self.compute_entry_signals([symbol])
+        return self._entry_signals[symbol]
+
+def exit_timeframe_for_mode(mode):
+    return "15m" if mode == "scalp" else "1h"
+
+def build_market_snapshot(data, due=None, closed_before=None):
+    # Сигналы входа считаются один раз на монету для всех пользователей, у кого по ней
+    # нет позиции; окна свечей для выходов подгружаются по запросу движка выходов.
+    snapshot = MarketSnapshot(closed_before)
+    if due is not None and ENTRY_INTERVAL not in due:
+        return snapshot
+    entry_symbols = set()
+    for chat_id in data.get("balances", {}).keys():
+        open_coins = {pos["coin"].upper() for pos in data["positions"].get(str(chat_id), [])}
+        entry_symbols.update(symbol for symbol in SYMBOLS if symbol.upper() not in open_coins)
+    snapshot.compute_entry_signals([symbol for symbol in SYMBOLS if symbol in entry_symbols])
+    return snapshot
+
+# Строка сигнала входа в сообщении пользователя (user_items) -> монета
+ENTRY_LINE = re.compile(r"^Вход: (\S+) –", re.MULTILINE)
+
+EXIT_REASON_TEXT = {
+    EXIT_REVERSAL: "",
+    EXIT_STOP_LOSS: " по стоп‑лоссу",
+    EXIT_TAKE_PROFIT: " по тейк‑профиту",
+}
+
+def process_exits(data, snapshot, due=None):
+    # Проверка выходов по всем позициям всех пользователей и одна запись в хранилище
+    # для всех закрытий. Возвращает {chat_id: {symbol: (код notify_state, строка сообщения)}}
+    # и {(chat_id, symbol): новый баланс} по закрытым в этом цикле позициям
+    position_index = build_position_index(data, SYMBOLS, exit_timeframe_for_mode, due)
+    results = evaluate_exits(position_index, snapshot.exit_candles)
+    # Закрытия применяются в порядке SYMBOLS — в том же, в каком строки идут в сообщении,
+    # поэтому «новый баланс» в каждой строке нарастает сверху вниз
+    order = {symbol: i for i, symbol in enumerate(SYMBOLS)}
+    closes = sorted(
+        ((chat_id, symbol, profit_loss, exit_price, REASON_NAMES[reason])
+         for chat_id, symbol, reason, exit_price, profit_loss in results if reason != EXIT_NONE),
+        key=lambda close: order[close[1]],
+    )
+    balances = apply_closes(closes) if closes else {}
+    lines = {}
+    for chat_id, symbol, reason, _, profit_loss in results:
+        if reason == EXIT_NONE:
+            code, line = POSITION_OPEN, f"Позиция на {symbol} стабильна."
+        elif balances.get((chat_id, symbol)) is None:
+            code, line = POSITION_CLOSED, f"Позиция на {symbol} уже закрыта."
+        else:
+            new_balance = balances[(chat_id, symbol)]
+            code, line = POSITION_CLOSED, f"Позиция на {symbol} закрыта{EXIT_REASON_TEXT[reason]}. Прибыль/убыток: {profit_loss:+.2f} USDT. Новый баланс: {new_balance:.2f} USDT."
+        lines.setdefault(chat_id, {})[symbol] = (code, line)
+    closed = {key: balance for key, balance in balances.items() if balance is not None}
+    return lines, closed
+
+def user_items(mode, positions, snapshot, due=None, exit_lines=None):
+    # [(symbol, код notify_state, строка)] по монетам, проверенным в этом цикле. exit_lines —
+    # результаты process_exits по позициям пользователя. Выход проверяется только на закрытии
+    # свечи его таймфрейма, вход — на закрытии ENTRY_INTERVAL.
+    exit_due = due is None or exit_timeframe_for_mode(mode) in due
+    entry_due = due is None or ENTRY_INTERVAL in due
+    exit_lines = exit_lines or {}
+    open_coins = {pos["coin"].upper() for pos in positions}
+    items = []
+    for symbol in SYMBOLS:
+        if symbol.upper() in open_coins:
+            if exit_due and symbol in exit_lines:
+                items.append((symbol, *exit_lines[symbol]))
+        elif entry_due:
+            signal, entry_price = snapshot.entry_signal(symbol)
+            if signal:
+                stop_loss, take_profit = calc_sl_tp(signal, entry_price)
+                line = f"Вход: {symbol} – {signal} сигнал.\nЦена входа: {entry_price:.2f}, SL: {stop_loss:.2f}, TP: {take_profit:.2f}."
+            else:
+                line = f"На монету {symbol} нет хороших входов в сделку."
+            items.append((symbol, ENTRY_CODES[signal], line))
+    return items
+
+def full_message(items, exit_due):
+    # Полная сводка по всем проверенным монетам; сводка «нет входов» отправляется на закрытии
+    # свечи выхода, а в остальные минуты — только настоящие сигналы. Монеты динамического
+    # списка попадают в сводку только с сигналом или позицией, иначе в ней были бы сотни строк
+    user_signals = [line for symbol, code, line in items if code != NO_ENTRY or symbol in PINNED_SYMBOLS]
+    # Если все сигналы содержат "нет хороших входов" или "стабильна", отправляем одно агрегированное сообщение
+    if all(("нет хороших входов" in s or "стабильна" in s) for s in user_signals):
+        if not exit_due:
+            return None
+        return "Сейчас нет хороших входов в сделку 😊"
+    return "\n".join(user_signals)
+
+def evaluate_user(chat_id, mode, positions, snapshot, due=None, exit_lines=None, state=None, now=None):
+    # (сообщение или None, новое состояние notify_state, полная сводка). Без прошлого состояния
+    # и для heartbeat отправляется полная сводка, иначе (NOTIFY_DELTA_ONLY) — только строки,
+    # которые изменились с прошлого раза
+    exit_due = due is None or exit_timeframe_for_mode(mode) in due
+    items = user_items(mode, positions, snapshot, due, exit_lines)
+    full = message = full_message(items, exit_due)
+    now = now if now is not None else int(time.time() * 1000)
+    heartbeat = (NOTIFY_HEARTBEAT_HOURS and exit_due and state is not None
+                 and now - state["t"] >= NOTIFY_HEARTBEAT_HOURS * 3_600_000)
+    if NOTIFY_DELTA_ONLY and state is not None and not heartbeat:
+        message = "\n".join(delta_lines(state, items)) or None
+    return message, next_state(state, items, now if message is not None else None), full
+
+def evaluate_users(data, snapshot, due=None, now=None):
+    # Выходы, закрытия в хранилище и тексты сообщений для пользователей из data. Возвращает
+    # ([(chat_id, сообщение)], {chat_id: изменившееся состояние notify_state}, счётчики подавленного,
+    # закрытия из process_exits); так же работает и воркер shard_pool со своей частью пользователей
+    with span("cycle_stage_seconds", stage="exits"):
+        exit_lines, closed = process_exits(data, snapshot, due)
+    now = now if now is not None else int(time.time() * 1000)
+    messages = []
+    states = {}
+    suppressed = {"messages": 0, "bytes": 0}
+    for chat_id in data.get("balances", {}).keys():
+        mode = data["trading_modes"].get(str(chat_id), "long")
+        state = data.get("notify_state", {}).get(str(chat_id))
+        exit_due = due is None or exit_timeframe_for_mode(mode) in due
+        if not exit_due and not snapshot.has_entry_signals() and not has_active_entries(state):
+            # Ни выхода, ни сигналов входа в эту минуту, ни пропавшего сигнала — пользователя пропускаем целиком
+            continue
+        message, new_state, full = evaluate_user(chat_id, mode, data["positions"].get(str(chat_id), []), snapshot, due,
+                                                 exit_lines.get(str(chat_id)), state, now)
+        if new_state != state:
+            states[str(chat_id)] = new_state
+        if message is not None:
+            messages.append((chat_id, message))
+        if full is not None and message != full:
+            # Сколько ушло бы без дельт: полная сводка по тем же монетам
+            suppressed["messages"] += message is None
+            suppressed["bytes"] += len(full.encode()) - len((message or "").encode())
+    return messages, states, suppressed, closed
+
+def required_symbols(data):
+    # Монеты открытых позиций и ещё активных сигналов входа (о пропаже сигнала нужно сообщить)
+    coins = {pos["coin"].upper() for positions in data.get("positions", {}).values() for pos in positions}
+    for state in data.get("notify_state", {}).values():
+        coins.update(symbol for symbol, code in state["c"].items() if code in (ENTRY_BUY, ENTRY_SELL))
+    return coins
+
+def exit_keys(data, due=None):
+    # (symbol, timeframe) открытых позиций, выход по которым проверяется в этом цикле
+    return set(build_position_index(data, SYMBOLS, exit_timeframe_for_mode, due))
+
+def record_signals(data, snapshot, messages, due=None, ts=None):
+    # Сигналы входа цикла — в журнал. Получатели — пользователи, в чьём сообщении этот вход
+    # есть (при дельтах повторный сигнал не отправляется и получателем не считается)
+    if due is not None and ENTRY_INTERVAL not in due:
+        return
+    signals = [(symbol, signal, close, *calc_sl_tp(signal, close))
+               for symbol, (signal, close) in snapshot.entry_signals().items() if signal]
+    if not signals:
+        return
+    recipients = {symbol: [] for symbol, *_ in signals}
+    # Строки входа разбираются один раз на сообщение: при сотнях монет поиск каждой монеты
+    # в каждом сообщении стоил бы (сообщения × сигналы)
+    for chat_id, message in messages:
+        for symbol in ENTRY_LINE.findall(message):
+            if symbol in recipients:
+                recipients[symbol].append(chat_id)
+    log_signals(signals, recipients, ts)
+
+def run_cycle(dispatcher, due=None, closed_before=None, pool=None):
+    # pool — ShardPool: пользователи делятся между процессами-воркерами, рынок считается здесь один раз
+    global SYMBOLS
+    with span("cycle_stage_seconds", stage="cycle"):
+        # Данные пользователей читаются один раз за цикл, без истории сделок
+        with span("cycle_stage_seconds", stage="load_user_data"):
+            data = load_cycle_data()
+        if portfolio is not None:
+            # Позиции, добавленные через Telegram с прошлого цикла
+            with span("cycle_stage_seconds", stage="portfolio"):
+                portfolio.load(data)
+        if universe is not None and (due is None or ENTRY_INTERVAL in due):
+            with span("cycle_stage_seconds", stage="universe"):
+                SYMBOLS = universe.refresh(required_symbols(data))
+        with span("cycle_stage_seconds", stage="entry_signals"):
+            snapshot = build_market_snapshot(data, due, closed_before)
+        now = int(time.time() * 1000)
+        if pool is None:
+            messages, states, suppressed, closed = evaluate_users(data, snapshot, due, now)
+        else:
+            with span("cycle_stage_seconds", stage="shards"):
+                for symbol, timeframe in exit_keys(data, due):
+                    snapshot.exit_candles(symbol, timeframe)
+                messages, states, suppressed, closed = pool.evaluate(data, snapshot, SYMBOLS, due, now)
+        with span("cycle_stage_seconds", stage="notify"):
+            for chat_id, message in messages:
+                dispatcher.send(message, chat_id)
+                print(f"Сообщение для chat_id {chat_id} поставлено в очередь:")
+                print(message)
+            # Состояние сохраняется после постановки в очередь: при падении до этого места
+            # следующий цикл повторит изменения, а не потеряет их
+            if states:
+                save_notify_states(states)
+            inc("notifications_suppressed_total", suppressed["messages"])
+            inc("notification_bytes_suppressed_total", suppressed["bytes"])
+            if suppressed["messages"] or suppressed["bytes"]:
+                print(f"DEBUG: без изменений не отправлено сообщений: {suppressed['messages']}, "
+                      f"сэкономлено {suppressed['bytes']} байт.")
+        with span("cycle_stage_seconds", stage="journal"):
+            record_signals(data, snapshot, messages, due, closed_before)
+        if portfolio is not None and closed:
+            # Закрытые в цикле позиции убираются из портфеля без повторного чтения хранилища
+            with span("cycle_stage_seconds", stage="portfolio"):
+                for chat_id, (balance, coins) in closes_by_user(data, closed).items():
+                    positions = [pos for pos in data["positions"].get(chat_id, []) if pos["coin"].upper() not in coins]
+                    portfolio.set_user(chat_id, balance, positions)
+
+def closes_by_user(data, closed):
+    # {(chat_id, symbol): новый баланс} -> {chat_id: (итоговый баланс, закрытые монеты)}; закрытия
+    # применялись по порядку, поэтому итоговый баланс — последний
+    users = {}
+    for (chat_id, symbol), balance in closed.items():
+        coins = users.get(chat_id, (None, set()))[1]
+        coins.add(symbol.upper())
+        users[chat_id] = (balance, coins)
+    return users
+
+def send_portfolio_alerts(dispatcher, prices):
+    for chat_id, message in portfolio.update_prices(prices):
+        dispatcher.send(message, chat_id)
+        print(f"Предупреждение для chat_id {chat_id}: {message}")
+
+def save_warm_state(path=WARM_STATE_FILE):
+    # При остановке: индикаторы, отметки предупреждений и текущий список монет
+    if not path:
+        return
+    size = warm_state.save(path, indicator_engine, portfolio, SYMBOLS if universe is not None else None)
+    print(f"DEBUG: снимок состояния сохранён в {path} ({size / 1024:.0f} КБ).")
+
+def restore_warm_state(path=WARM_STATE_FILE):
+    # При запуске, до первого цикла. True — снимок найден и применён
+    global SYMBOLS
+    arrays = warm_state.load(path) if path else None
+    if arrays is None:
+        return False
+    indicators = indicator_engine.restore_state(arrays)
+    if portfolio is not None:
+        portfolio.restore_alerts(arrays)
+    if universe is not None and "symbols" in arrays:
+        SYMBOLS = [str(symbol) for symbol in arrays["symbols"]]
+    age = time.time() - int(arrays["saved_at"]) / 1000
+    print(f"DEBUG: состояние восстановлено из {path} (снимок {age:.0f} c назад): индикаторов {indicators}.")
+    return True
+
+def warm_up(now=None):
+    # Сразу после запуска, не дожидаясь закрытия свечи: свечи догружаются до последней закрытой
+    # минуты, индикаторы доводятся до неё же — первый цикл на границе обработает одну новую свечу
+    now = now if now is not None else int(time.time() * 1000)
+    step = INTERVAL_MS[ENTRY_INTERVAL]
+    MarketSnapshot(closed_before=now // step * step).compute_entry_signals(SYMBOLS)
 
 def start_telegram_bot_in_process():
+    # python-telegram-bot импортирует только Telegram-процесс
+    from telegram_commands import run_telegram_bot
     run_telegram_bot()
 
 if __name__ == "__main__":
     print("DEBUG: bot.py запущен...")
+    # Telegram-процесс — первым: fork до запуска потоков, и он отвечает, пока бот прогревается
+    telegram_process = multiprocessing.Process(target=start_telegram_bot_in_process)
+    telegram_process.start()
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+        print(f"DEBUG: метрики на http://127.0.0.1:{METRICS_PORT}/metrics (Telegram-процесс — порт {METRICS_PORT + 1})")
     try:
         print("Ping to Binance:", client.ping())
     except Exception as e:
         print("Ошибка при ping:", e)
     
-    telegram_process = multiprocessing.Process(target=start_telegram_bot_in_process)
-    telegram_process.start()
-    
-    interval_seconds = 300  # 5 минут
-    from config import get_trading_mode
-    mode = get_trading_mode("dummy")  # В данном случае для глобального анализа можно передать dummy, или использовать индивидуальный режим в цикле ниже.
-    if mode == "scalp":
-        exit_timeframe = "15m"
-    else:
-        exit_timeframe = "1h"
-    print(f"DEBUG: Торговый режим: {mode}. Для входа анализ по 1m, для выхода по {exit_timeframe}. Интервал: {interval_seconds} секунд.")
+    if KLINE_STREAM_ENABLED:
+        kline_stream = KlineStream(client, SYMBOLS, KLINE_STREAM_INTERVALS, window=CANDLE_CAPACITY, url=KLINE_STREAM_URL)
+        kline_stream.start()
+        if kline_stream.wait_ready(timeout=60):
+            print("DEBUG: kline-поток подключён, свечи читаются из памяти.")
+        else:
+            print("DEBUG: kline-поток ещё не готов, пока используем REST.")
+
+    # Сообщения уходят в фоне, торговый цикл не ждёт ответов Telegram
+    dispatcher = NotificationDispatcher()
+    dispatcher.start()
+
+    if PORTFOLIO_ALERTS:
+        portfolio = Portfolio()
+        portfolio.load(load_cycle_data())
+        price_cache = PriceCache()
+        price_cache.add_listener(lambda prices: send_portfolio_alerts(dispatcher, prices))
+        price_cache.start()
+        print("DEBUG: портфель пересчитывается на каждое обновление цен, предупреждения о SL/TP/ликвидации включены.")
+
+    if UNIVERSE_ENABLED:
+        # Монеты вне kline-потока (он подписан только на SYMBOLS) читаются из кэша свечей
+        universe = SymbolUniverse(client)
+        print(f"DEBUG: динамический список монет: до {UNIVERSE_MAX_SYMBOLS} пар по 24h-тикерам плюс {len(SYMBOLS)} постоянных.")
+
+    restore_warm_state()
+    started = time.perf_counter()
+    try:
+        warm_up()
+        print(f"DEBUG: свечи и индикаторы прогреты за {time.perf_counter() - started:.1f} c.")
+    except Exception as e:
+        print(f"Ошибка прогрева: {e}. Свечи догрузит первый цикл.")
+
+    pool = None
+    if SHARD_WORKERS > 1:
+        pool = ShardPool(SHARD_WORKERS, capacity=len(SYMBOLS) + (UNIVERSE_MAX_SYMBOLS if UNIVERSE_ENABLED else 0))
+        print(f"DEBUG: пользователи оцениваются в {SHARD_WORKERS} процессах.")
     
-    while True:
-        print("DEBUG: Начало цикла анализа рынка для всех пользователей...")
-        data = load_user_data()
-        chat_ids = set(data.get("balances", {}).keys())
-        for chat_id in chat_ids:
-            user_signals = []
-            # Получаем торговый режим для пользователя
-            user_mode = get_trading_mode(chat_id)
-            if user_mode == "scalp":
-                timeframe = "15m"
-            else:
-                timeframe = "1h"
-            positions = load_positions(chat_id)
-            for symbol in SYMBOLS:
-                open_pos = None
-                for pos in positions:
-                    if pos["coin"].upper() == symbol.upper():
-                        open_pos = pos
-                        break
-                if open_pos:
-                    side = open_pos["side"].upper()
-                    df_exit = get_timeframe_data(symbol, timeframe, lookback=2)
-                    last_candle = df_exit.iloc[-1]
-                    open_price = last_candle["open"]
-                    close_price = last_candle["close"]
-                    diff = (close_price - open_price) / open_price
-                    reversal = False
-                    if side == "SELL" and diff > 0.003:
-                        reversal = True
-                    elif side == "BUY" and diff < -0.003:
-                        reversal = True
-                    df_recent = get_timeframe_data(symbol, timeframe, lookback=6)
-                    if side == "BUY":
-                        max_high = df_recent["high"].max()
-                        if (max_high - close_price) / max_high >= 0.003:
-                            reversal = True
-                    else:
-                        min_low = df_recent["low"].min()
-                        if (close_price - min_low) / min_low >= 0.003:
-                            reversal = True
-                    if reversal:
-                        stake = open_pos.get("stake", 0)
-                        entry = open_pos["entry"]
-                        leverage = open_pos.get("leverage", 1)
-                        if side == "BUY":
-                            pct = (close_price - entry) / entry
-                        else:
-                            pct = (entry - close_price) / entry
-                        profit_loss = stake * pct * leverage
-                        current_balance = get_balance(chat_id)
-                        new_balance = current_balance + profit_loss
-                        set_balance(chat_id, new_balance)
-                        positions = load_positions(chat_id)
-                        positions = [p for p in positions if p["coin"].upper() != symbol.upper()]
-                        save_positions(chat_id, positions)
-                        user_signals.append(f"Позиция на {symbol} закрыта. Прибыль/убыток: {profit_loss:+.2f} USDT. Новый баланс: {new_balance:.2f} USDT.")
-                    else:
-                        user_signals.append(f"Позиция на {symbol} стабильна.")
-                else:
-                    df_entry = get_data(symbol, interval="1m", lookback=100)
-                    df_entry = apply_indicators(df_entry)
-                    signal = check_trade_signal_extended(df_entry)
-                    if signal:
-                        entry_price = df_entry.iloc[-1]["close"]
-                        stop_loss, take_profit = calc_sl_tp(signal, entry_price)
-                        user_signals.append(
-                            f"Вход: {symbol} – {signal} сигнал.\nЦена входа: {entry_price:.2f}, SL: {stop_loss:.2f}, TP: {take_profit:.2f}."
-                        )
-                    else:
-                        user_signals.append(f"На монету {symbol} нет хороших входов в сделку.")
-            # Если все сигналы содержат "нет хороших входов" или "стабильна", отправляем одно агрегированное сообщение
-            if all(("нет хороших входов" in s or "стабильна" in s) for s in user_signals):
-                aggregated_message = "Сейчас нет хороших входов в сделку 😊"
-            else:
-                aggregated_message = "\n".join(user_signals)
-            send_telegram_message(aggregated_message, chat_id)
-            print(f"Отправлено сообщение для chat_id {chat_id}:")
-            print(aggregated_message)
-        time.sleep(interval_seconds)
-        print("Ping:", client.ping())
+    scheduler = CandleScheduler([ENTRY_INTERVAL, "15m", "1h"])
+    print(f"DEBUG: Вход анализируется на закрытии каждой {ENTRY_INTERVAL}-свечи, выход — на закрытии 15m (скальпинг) или 1h (дневной режим).")
+
+    # SIGTERM (systemd, docker stop) завершает так же, как Ctrl+C: через finally со снимком
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            boundary, due = scheduler.wait_next()
+            print(f"DEBUG: Закрылись свечи {sorted(due)}, анализ рынка для всех пользователей...")
+            try:
+                run_cycle(dispatcher, due, closed_before=boundary, pool=pool)
+            except Exception as e:
+                # Ошибка Binance после всех повторов не должна останавливать бота: ждём следующую свечу
+                print(f"Ошибка в цикле анализа: {e}")
+            print("DEBUG: Очередь уведомлений:", dispatcher.stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("DEBUG: остановка...")
+        save_warm_state()
+        # Уже поставленные в очередь сообщения досылаются, иначе после перезапуска их не будет
+        dispatcher.stop(timeout=10)
+        if pool is not None:
+            pool.close()
+        telegram_process.terminate()
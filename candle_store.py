@@ -0,0 +1,144 @@
+import numpy as np
+
+# Строки массива свечей: candles[CLOSE] — цены закрытия и т.д.
+OPEN_TIME, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+FIELDS = ("open_time", "open", "high", "low", "close", "volume")
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 180_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "1h": 3_600_000,
+    "2h": 7_200_000,
+    "4h": 14_400_000,
+    "1d": 86_400_000,
+}
+
+
+def klines_to_array(klines):
+    # Сырые свечи Binance -> массив (6, n) float64 за одно преобразование
+    if not klines:
+        return np.empty((len(FIELDS), 0))
+    return np.array([k[:6] for k in klines], dtype=np.float64).T
+
+
+class CandleBuffer:
+    # Кольцевой буфер свечей фиксированной ёмкости. Каждая свеча пишется дважды
+    # (в позицию i и i + capacity), поэтому последние n свечей всегда лежат в памяти
+    # подряд и отдаются срезом без копирования.
+    def __init__(self, interval, capacity=500):
+        self.interval = interval
+        self.step = INTERVAL_MS[interval]
+        self.capacity = capacity
+        self._data = np.full((len(FIELDS), 2 * capacity), np.nan)
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def last_open_time(self):
+        if not self._size:
+            return None
+        return int(self._data[OPEN_TIME, self._head + self.capacity - 1])
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+    def _write(self, slot, values):
+        self._data[:, slot] = values
+        self._data[:, slot + self.capacity] = values
+
+    def append(self, open_time, open_price, high, low, close, volume):
+        # Новая свеча добавляется за O(1); свеча с тем же open_time (незакрытая)
+        # перезаписывается на месте; устаревшие свечи игнорируются
+        values = (open_time, open_price, high, low, close, volume)
+        last = self.last_open_time()
+        if last is not None and open_time == last:
+            self._write((self._head - 1) % self.capacity, values)
+        elif last is None or open_time > last:
+            if last is not None and open_time > last + self.step:
+                # Разрыв в истории: окно должно оставаться непрерывным
+                self.clear()
+            self._write(self._head, values)
+            self._head = (self._head + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def extend(self, candles):
+        # candles — массив (6, n) или список сырых свечей Binance
+        if not isinstance(candles, np.ndarray):
+            candles = klines_to_array(candles)
+        for column in candles.T:
+            self.append(*column)
+
+    def view(self, n=None):
+        # Последние n свечей как срез (6, n) без копирования; валиден до следующей записи
+        n = self._size if n is None else min(n, self._size)
+        end = self._head + self.capacity
+        return self._data[:, end - n:end]
+
+
+class CandleStore:
+    # Буферы свечей по (symbol, interval), создаются при первом обращении
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self._buffers = {}
+
+    def buffer(self, symbol, interval):
+        key = (symbol.upper(), interval)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = CandleBuffer(interval, self.capacity)
+        return buf
+
+    def __contains__(self, key):
+        return (key[0].upper(), key[1]) in self._buffers
+
+    def keys(self):
+        return list(self._buffers)
+
+    def nbytes(self):
+        return sum(buf._data.nbytes for buf in self._buffers.values())
+
+
+def resample(candles, interval, until=None):
+    # Свечи 1m (6, n) -> свечи interval (6, m): open первой минуты, high/low — экстремумы,
+    # close последней, объём — сумма. Первая свеча отбрасывается, если окно начинается с её
+    # середины. Последняя, не закрытая к until (мс), тоже; без until остаётся как незакрытая.
+    step = INTERVAL_MS[interval]
+    n = candles.shape[1]
+    if not n:
+        return np.empty((len(FIELDS), 0))
+    open_times = candles[OPEN_TIME]
+    buckets = open_times // step * step
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.concatenate((starts[1:], [n])) - 1
+    bars = np.empty((len(FIELDS), len(starts)))
+    bars[OPEN_TIME] = buckets[starts]
+    bars[OPEN] = candles[OPEN, starts]
+    bars[HIGH] = np.maximum.reduceat(candles[HIGH], starts)
+    bars[LOW] = np.minimum.reduceat(candles[LOW], starts)
+    bars[CLOSE] = candles[CLOSE, ends]
+    bars[VOLUME] = np.add.reduceat(candles[VOLUME], starts)
+    if open_times[0] != buckets[0]:
+        bars = bars[:, 1:]
+    if until is not None and bars.shape[1] and bars[OPEN_TIME, -1] + step > until:
+        bars = bars[:, :-1]
+    return bars
+
+
+def candles_to_frame(candles):
+    # Адаптер для pandas/ta: только там, где нужен DataFrame. pandas импортируется при первом
+    # вызове — торговому циклу он не нужен, а импорт стоит около половины секунды
+    import pandas as pd
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(candles[OPEN_TIME].astype(np.int64), unit="ms"),
+        "open": candles[OPEN],
+        "high": candles[HIGH],
+        "low": candles[LOW],
+        "close": candles[CLOSE],
+        "volume": candles[VOLUME],
+    })
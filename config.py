@@ -1,6 +1,9 @@
 import os
-import json
+import time
 from dotenv import load_dotenv
+from storage import create_storage
+from signal_journal import SignalJournal
+from trade_ledger import format_trade, format_stats
 
 load_dotenv()  # Загружает переменные из .env, если он существует
 
@@ -8,86 +11,186 @@ load_dotenv()  # Загружает переменные из .env, если о
 API_KEY = os.getenv("API_KEY")
 API_SECRET = os.getenv("API_SECRET")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 # В многопользовательском режиме TELEGRAM_CHAT_ID не используется
 
 # Список монет для торговли
 SYMBOLS = ["BTCUSDT", "ETHUSDT", "BNBUSDT", "SOLUSDT", "XRPUSDT", "LTCUSDT", "DOTUSDT", "AAVEUSDT", "LINKUSDT"]
 
+# Динамический список монет (universe.py): все пары к UNIVERSE_QUOTE из exchangeInfo, каждый цикл
+# отбираемые одним запросом 24h-тикеров; SYMBOLS анализируются всегда. Пороги: оборот за 24 часа
+# (в UNIVERSE_QUOTE), размах (high - low) / цена за 24 часа, спред (ask - bid) / середина.
+UNIVERSE_ENABLED = os.getenv("UNIVERSE", "0") == "1"
+UNIVERSE_QUOTE = os.getenv("UNIVERSE_QUOTE", "USDT")
+UNIVERSE_MIN_QUOTE_VOLUME = float(os.getenv("UNIVERSE_MIN_QUOTE_VOLUME", "20000000"))
+UNIVERSE_MIN_RANGE = float(os.getenv("UNIVERSE_MIN_RANGE", "0.03"))
+UNIVERSE_MAX_SPREAD = float(os.getenv("UNIVERSE_MAX_SPREAD", "0.001"))
+UNIVERSE_MAX_SYMBOLS = int(os.getenv("UNIVERSE_MAX_SYMBOLS", "200"))
+UNIVERSE_EXCHANGE_INFO_HOURS = float(os.getenv("UNIVERSE_EXCHANGE_INFO_HOURS", "6"))
+# Сколько монет одновременно загружают свечи (кэш/REST) в цикле анализа
+KLINE_FETCH_THREADS = int(os.getenv("KLINE_FETCH_THREADS", "8"))
+
+# Потоковое получение свечей через WebSocket вместо опроса REST
+KLINE_STREAM_ENABLED = os.getenv("KLINE_STREAM", "0") == "1"
+KLINE_STREAM_URL = os.getenv("KLINE_STREAM_URL", "wss://stream.binance.com:9443/stream")
+KLINE_STREAM_INTERVALS = ["1m"]  # 15m/1h собираются из 1m (resample в candle_store.py)
+
+# Метрики в формате Prometheus: торговый цикл отдаёт их на METRICS_PORT, Telegram-процесс — на
+# METRICS_PORT + 1 (http://127.0.0.1:<порт>/metrics). 0 — метрики выключены и почти ничего не стоят.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Число процессов для оценки пользователей (shard_pool.py); 0 — всё в главном процессе
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+
+# Локальный кэш закрытых свечей (kline_cache.py); пустая строка — без кэша, свечи каждый раз из REST
+KLINE_CACHE_DIR = os.getenv("KLINE_CACHE_DIR", "klines")
+
+# Снимок состояния (warm_state.py): пишется при остановке bot.py и читается при запуске;
+# пустая строка — без снимка
+WARM_STATE_FILE = os.getenv("WARM_STATE_FILE", "warm_state.npz")
+
+# Уведомления: только изменения по сравнению с прошлым сообщением (новые сигналы, закрытия,
+# смена состояния); повторы «стабильна» / «нет входов» не отправляются. NOTIFY_HEARTBEAT_HOURS > 0 —
+# полная сводка, если пользователю столько часов ничего не уходило
+NOTIFY_DELTA_ONLY = os.getenv("NOTIFY_DELTA_ONLY", "1") == "1"
+NOTIFY_HEARTBEAT_HOURS = float(os.getenv("NOTIFY_HEARTBEAT_HOURS", "0"))
+
+# Telegram-процесс: сколько апдейтов обрабатывается одновременно (апдейты одного чата — по очереди)
+# и сколько потоков у пула для вызовов хранилища и Binance из обработчиков
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "256"))
+TELEGRAM_IO_THREADS = int(os.getenv("TELEGRAM_IO_THREADS", "16"))
+
+# Лимит веса запросов Binance в минуту на IP (общий для бота и Telegram-процесса)
+BINANCE_WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", "6000"))
+
 # Параметры риск-менеджмента
 STOP_LOSS_PERCENT = 2      # 2%
 TAKE_PROFIT_PERCENT = 6    # 6%
 
+# Портфель (portfolio.py): бот пересчитывает PnL всех открытых позиций на каждое обновление цен
+# и предупреждает, когда до SL, TP или ликвидации осталось меньше PORTFOLIO_ALERT_PERCENT % цены.
+# Новый вид сообщений пользователям, поэтому включается явно: PORTFOLIO_ALERTS=1
+PORTFOLIO_ALERTS = os.getenv("PORTFOLIO_ALERTS", "0") == "1"
+PORTFOLIO_ALERT_PERCENT = float(os.getenv("PORTFOLIO_ALERT_PERCENT", "0.5"))
+
+# Пороги сигнала входа (check_trade_signal_extended); sweep.py подбирает их по истории
+SIGNAL_PARAMS = {
+    "rsi_buy": 30,                  # RSI ниже — голос за BUY
+    "rsi_sell": 70,                 # RSI выше — голос за SELL
+    "volume_spike": 1.5,            # объём больше среднего за 20 свечей во столько раз
+    "resistance_factor": 0.98,      # цена относительно максимума за 20 свечей
+    "atr_threshold": 0.01,          # ATR / цена
+    "required_confirmations": 3,    # сколько голосов нужно для сигнала
+}
+
 # Файл для хранения данных пользователей
 USER_DATA_FILE = "user_data.json"
 
+# Хранилище: "sqlite" (WAL, безопасно для бота и Telegram-процесса одновременно) или "json".
+# При первом запуске с sqlite данные переносятся из USER_DATA_FILE.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+USER_DATA_DB = os.getenv("USER_DATA_DB", "user_data.db")
+
+# Журнал сигналов входа (signal_journal.py): сегменты по SIGNAL_SEGMENT_BYTES, хранится SIGNAL_SEGMENTS_KEPT последних
+SIGNALS_DIR = os.getenv("SIGNALS_DIR", "signals")
+SIGNAL_SEGMENT_BYTES = int(os.getenv("SIGNAL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+SIGNAL_SEGMENTS_KEPT = int(os.getenv("SIGNAL_SEGMENTS_KEPT", "50"))
+
+_storage = None
+_signal_journal = None
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = create_storage(STORAGE_BACKEND, USER_DATA_FILE, USER_DATA_DB)
+    return _storage
+
 def load_user_data():
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, "r") as f:
-            try:
-                data = json.load(f)
-            except Exception:
-                data = {}
-    else:
-        data = {}
-    # Обеспечиваем наличие необходимых разделов
-    if "balances" not in data:
-        data["balances"] = {}
-    if "positions" not in data:
-        data["positions"] = {}
-    if "trades" not in data:
-        data["trades"] = {}
-    if "trading_modes" not in data:
-        data["trading_modes"] = {}
-    return data
+    return get_storage().load_user_data()
+
+def load_cycle_data():
+    # Как load_user_data, но без trades и trade_stats (торговому циклу они не нужны)
+    return get_storage().load_cycle_data()
 
 def save_user_data(data):
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    get_storage().save_user_data(data)
+
+def list_chat_ids():
+    return get_storage().list_chat_ids()
 
 def get_balance(chat_id):
-    data = load_user_data()
-    return data["balances"].get(str(chat_id), 0)
+    return get_storage().get_balance(chat_id)
 
 def set_balance(chat_id, amount):
-    data = load_user_data()
-    data["balances"][str(chat_id)] = amount
-    save_user_data(data)
+    get_storage().set_balance(chat_id, amount)
 
 def load_positions(chat_id):
-    data = load_user_data()
-    return data["positions"].get(str(chat_id), [])
+    return get_storage().load_positions(chat_id)
 
 def save_positions(chat_id, positions):
-    data = load_user_data()
-    data["positions"][str(chat_id)] = positions
-    save_user_data(data)
+    get_storage().save_positions(chat_id, positions)
+
+# Добавление и удаление позиции одной транзакцией: между чтением и записью списка
+# торговый цикл мог закрыть другую позицию этого пользователя
+def append_position(chat_id, position):
+    get_storage().append_position(chat_id, position)
+
+def remove_position(chat_id, index):
+    return get_storage().remove_position(chat_id, index)
 
-def load_trades(chat_id):
-    data = load_user_data()
-    return data["trades"].get(str(chat_id), [])
+def close_position(chat_id, coin, profit_loss, exit_price=None, reason="manual"):
+    # Атомарно: убрать позицию по монете, добавить profit_loss к балансу и записать сделку
+    return get_storage().close_position(chat_id, coin, profit_loss, exit_price, reason)
+
+def apply_closes(closes):
+    # Все закрытия цикла [(chat_id, coin, profit_loss, exit_price, reason)] одной записью в хранилище
+    return get_storage().apply_closes(closes)
+
+def save_notify_states(states):
+    get_storage().save_notify_states(states)
+
+def load_trades(chat_id, limit=None):
+    # limit — только последние limit сделок (в хронологическом порядке)
+    return get_storage().load_trades(chat_id, limit)
 
 def save_trade(chat_id, trade):
-    data = load_user_data()
-    if str(chat_id) not in data["trades"]:
-        data["trades"][str(chat_id)] = []
-    data["trades"][str(chat_id)].append(trade)
-    save_user_data(data)
-
-def get_signals_history():
-    SIGNALS_FILE = "signals.txt"
-    if os.path.exists(SIGNALS_FILE):
-        with open(SIGNALS_FILE, "r") as f:
-            lines = f.readlines()
-        if lines:
-            return "".join(lines[-10:])
+    get_storage().save_trade(chat_id, trade)
+
+def add_trade(chat_id, trade):
+    return get_storage().add_trade(chat_id, trade)
+
+def get_trade_stats(chat_id):
+    return get_storage().get_trade_stats(chat_id)
+
+def get_signal_journal():
+    global _signal_journal
+    if _signal_journal is None:
+        _signal_journal = SignalJournal(SIGNALS_DIR, SIGNAL_SEGMENT_BYTES, SIGNAL_SEGMENTS_KEPT)
+    return _signal_journal
+
+def log_signals(signals, recipients=None, ts=None):
+    return get_signal_journal().append(signals, recipients, ts)
+
+def format_signal(record):
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["ts"] / 1000))
+    return (f"{when} {record['symbol']} {record['side']}: вход {record['entry']:.2f}, "
+            f"SL {record['stop_loss']:.2f}, TP {record['take_profit']:.2f}")
+
+def get_signals_history(chat_id=None, symbol=None, limit=10):
+    records = get_signal_journal().tail(limit, chat_id=chat_id, symbol=symbol)
+    if records:
+        return "\n".join(format_signal(record) for record in records)
     return "История сигналов пуста."
 
-def get_trades_history(chat_id):
-    trades = load_trades(chat_id)
+def get_trades_history(chat_id, limit=10):
+    trades = load_trades(chat_id, limit)
     if trades:
-        return "\n".join(trades[-10:])
+        return "\n".join(format_trade(trade) for trade in trades)
     return "История сделок пуста."
 
+def get_trade_stats_text(chat_id):
+    return format_stats(get_trade_stats(chat_id))
+
 def enable_signals():
     SIGNALS_ENABLED_FILE = "signals_enabled.txt"
     with open(SIGNALS_ENABLED_FILE, "w") as f:
@@ -97,22 +200,23 @@ def is_signals_enabled():
     SIGNALS_ENABLED_FILE = "signals_enabled.txt"
     return os.path.exists(SIGNALS_ENABLED_FILE)
 
-def calc_sl_tp(side, entry):
+def calc_sl_tp(side, entry, stop_loss_percent=None, take_profit_percent=None):
+    if stop_loss_percent is None:
+        stop_loss_percent = STOP_LOSS_PERCENT
+    if take_profit_percent is None:
+        take_profit_percent = TAKE_PROFIT_PERCENT
     if side.upper() == "BUY":
-        stop_loss = entry * (1 - STOP_LOSS_PERCENT / 100)
-        take_profit = entry * (1 + TAKE_PROFIT_PERCENT / 100)
+        stop_loss = entry * (1 - stop_loss_percent / 100)
+        take_profit = entry * (1 + take_profit_percent / 100)
     else:
-        stop_loss = entry * (1 + STOP_LOSS_PERCENT / 100)
-        take_profit = entry * (1 - TAKE_PROFIT_PERCENT / 100)
+        stop_loss = entry * (1 + stop_loss_percent / 100)
+        take_profit = entry * (1 - take_profit_percent / 100)
     return stop_loss, take_profit
 
 def get_trading_mode(chat_id):
-    data = load_user_data()
-    return data["trading_modes"].get(str(chat_id), "long")
+    return get_storage().get_trading_mode(chat_id)
 
 def set_trading_mode(chat_id, mode):
     if mode not in ["long", "scalp"]:
         return
-    data = load_user_data()
-    data["trading_modes"][str(chat_id)] = mode
-    save_user_data(data)
+    get_storage().set_trading_mode(chat_id, mode)
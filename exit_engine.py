@@ -0,0 +1,104 @@
+import numpy as np
+
+from candle_store import OPEN_TIME, HIGH, LOW, CLOSE
+from exit_rules import reversal_flags
+
+# Выходы по всем открытым позициям всех пользователей: позиции сгруппированы по
+# (symbol, timeframe), окно свечей берётся один раз на группу, а разворот, стоп-лосс
+# и тейк-профит проверяются для всей группы одной векторной операцией.
+
+EXIT_NONE, EXIT_REVERSAL, EXIT_STOP_LOSS, EXIT_TAKE_PROFIT = range(4)
+# Названия причин в журнале сделок (те же, что в backtest.py)
+REASON_NAMES = {EXIT_REVERSAL: "reversal", EXIT_STOP_LOSS: "stop_loss", EXIT_TAKE_PROFIT: "take_profit"}
+
+
+class PositionGroup:
+    # Колонки позиций одной пары (symbol, timeframe)
+    def __init__(self, symbol, timeframe):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.chat_ids = []
+        self._rows = []
+
+    def add(self, chat_id, pos):
+        self.chat_ids.append(str(chat_id))
+        self._rows.append((
+            1 if pos["side"].upper() == "BUY" else -1,
+            pos["entry"],
+            pos.get("stop_loss", np.nan),
+            pos.get("take_profit", np.nan),
+            pos.get("stake", 0),
+            pos.get("leverage", 1),
+            # У позиций, открытых до появления opened_at, время неизвестно — считаем давним
+            pos.get("opened_at") or 0,
+        ))
+
+    def freeze(self):
+        columns = np.array(self._rows, dtype=np.float64).reshape(-1, 7).T
+        self.side, self.entry, self.stop_loss, self.take_profit, self.stake, self.leverage, self.opened_at = columns
+        del self._rows
+        return self
+
+    def __len__(self):
+        return len(self.chat_ids)
+
+
+def build_position_index(data, symbols, timeframe_for_mode, due=None):
+    # {(symbol, timeframe): PositionGroup} только для таймфреймов, свеча которых закрылась
+    tracked = {symbol.upper(): symbol for symbol in symbols}
+    groups = {}
+    for chat_id, positions in data["positions"].items():
+        if chat_id not in data["balances"]:
+            continue
+        timeframe = timeframe_for_mode(data["trading_modes"].get(chat_id, "long"))
+        if due is not None and timeframe not in due:
+            continue
+        for pos in positions:
+            symbol = tracked.get(pos["coin"].upper())
+            if symbol is None:
+                continue
+            key = (symbol, timeframe)
+            if key not in groups:
+                groups[key] = PositionGroup(symbol, timeframe)
+            groups[key].add(chat_id, pos)
+    return {key: group.freeze() for key, group in groups.items()}
+
+
+def evaluate_group(group, candles):
+    # -> (причина выхода, цена выхода, прибыль/убыток) для каждой позиции группы.
+    # SL/TP проверяются по диапазону последней свечи и важнее разворота: они срабатывают внутри свечи.
+    # Для позиции, открытой посреди этой свечи, high/low могли быть до входа — её уровни
+    # сравниваются только с ценой закрытия
+    exit_buy, exit_sell = reversal_flags(candles)
+    high, low, close = candles[HIGH, -1], candles[LOW, -1], candles[CLOSE, -1]
+    opened_inside = group.opened_at > candles[OPEN_TIME, -1]
+    high = np.where(opened_inside, close, high)
+    low = np.where(opened_inside, close, low)
+    is_buy = group.side > 0
+    reversal = np.where(is_buy, exit_buy[-1], exit_sell[-1])
+    stop_hit = np.where(is_buy, low <= group.stop_loss, high >= group.stop_loss)
+    take_hit = np.where(is_buy, high >= group.take_profit, low <= group.take_profit)
+
+    reason = np.full(len(group), EXIT_NONE, dtype=np.int8)
+    reason[reversal] = EXIT_REVERSAL
+    reason[take_hit] = EXIT_TAKE_PROFIT
+    reason[stop_hit] = EXIT_STOP_LOSS
+    exit_price = np.select(
+        [reason == EXIT_STOP_LOSS, reason == EXIT_TAKE_PROFIT],
+        [group.stop_loss, group.take_profit],
+        default=close,
+    )
+    pct = group.side * (exit_price - group.entry) / group.entry
+    profit_loss = group.stake * pct * group.leverage
+    return reason, exit_price, profit_loss
+
+
+def evaluate_exits(groups, candles_for):
+    # candles_for(symbol, timeframe) -> окно свечей. Возвращает список
+    # (chat_id, symbol, reason, exit_price, profit_loss) по всем позициям
+    results = []
+    for (symbol, timeframe), group in groups.items():
+        reason, exit_price, profit_loss = evaluate_group(group, candles_for(symbol, timeframe))
+        for i, chat_id in enumerate(group.chat_ids):
+            results.append((chat_id, symbol, int(reason[i]), float(exit_price[i]), float(profit_loss[i])))
+    return results
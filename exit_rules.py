@@ -0,0 +1,37 @@
+import numpy as np
+
+from candle_store import OPEN, HIGH, LOW, CLOSE
+
+# Правило выхода по развороту: свеча таймфрейма выхода против позиции больше чем на 0.3%
+# или откат на 0.3% от экстремума последних EXIT_LOOKBACK свечей
+REVERSAL_THRESHOLD = 0.003
+EXIT_LOOKBACK = 6
+
+
+def _rolling(values, window, reduce):
+    # Экстремум последних window значений (в начале — сколько есть), как rolling(min_periods=1):
+    # начало дополняется первым значением, на экстремум это не влияет
+    if not len(values):
+        return values.copy()
+    padded = np.concatenate((np.full(window - 1, values[0]), values))
+    return reduce(np.lib.stride_tricks.sliding_window_view(padded, window), axis=1)
+
+
+def reversal_flags(candles, lookback=EXIT_LOOKBACK, threshold=REVERSAL_THRESHOLD):
+    # Для каждой свечи: нужно ли закрыть BUY и нужно ли закрыть SELL, если эта свеча последняя
+    open_price = candles[OPEN]
+    close = candles[CLOSE]
+    diff = (close - open_price) / open_price
+    max_high = _rolling(candles[HIGH], lookback, np.max)
+    min_low = _rolling(candles[LOW], lookback, np.min)
+    exit_buy = (diff < -threshold) | ((max_high - close) / max_high >= threshold)
+    exit_sell = (diff > threshold) | ((close - min_low) / min_low >= threshold)
+    return exit_buy, exit_sell
+
+
+def position_pnl(side, entry, price, stake, leverage):
+    if side == "BUY":
+        pct = (price - entry) / entry
+    else:
+        pct = (entry - price) / entry
+    return stake * pct * leverage
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+from websockets.asyncio.server import serve
+
+from candle_store import INTERVAL_MS
+
+# Локальные заглушки Binance для проверки без сети
+
+
+def make_kline(open_time, interval, open_price, close_price, volume=1.0):
+    high = max(open_price, close_price)
+    low = min(open_price, close_price)
+    return [
+        open_time, f"{open_price:.8f}", f"{high:.8f}", f"{low:.8f}", f"{close_price:.8f}", f"{volume:.8f}",
+        open_time + INTERVAL_MS[interval] - 1, "0", 1, "0", "0", "0",
+    ]
+
+
+class FakeClient:
+    # Детерминированная замена binance.client.Client: случайное блуждание цены,
+    # одинаковое для одного и того же символа и интервала. latency — задержка каждого вызова (секунды)
+    def __init__(self, now_ms, seed=0, symbols=("BTCUSDT", "ETHUSDT", "SOLUSDT"), latency=0.0):
+        self.now_ms = now_ms
+        self.seed = seed
+        self.symbols = list(symbols)
+        self.latency = latency
+        self.calls = []
+
+    def _call(self, *call):
+        self.calls.append(call)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def ping(self):
+        return {}
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None, **kwargs):
+        self._call("get_klines", symbol, interval, limit)
+        step = INTERVAL_MS[interval]
+        last_open = self.now_ms // step * step
+        first_open = last_open - (limit - 1) * step
+        if startTime is not None:
+            first_open = -(-startTime // step) * step
+        rows = []
+        open_time = first_open
+        while open_time <= last_open and len(rows) < limit:
+            rows.append(self._kline(symbol, interval, open_time))
+            open_time += step
+        return rows
+
+    def get_all_tickers(self):
+        self._call("get_all_tickers")
+        return [{"symbol": symbol, "price": self._price(symbol)} for symbol in self.symbols]
+
+    def get_ticker(self, **kwargs):
+        # 24h-статистика по всем парам: оборот, размах и спред свои у каждой пары и не меняются
+        self._call("get_ticker")
+        tickers = []
+        for symbol in self.symbols:
+            rnd = random.Random(f"{self.seed}:{symbol}:24h")
+            last = float(self._price(symbol))
+            price_range = rnd.uniform(0.005, 0.15)
+            spread = rnd.choice([0.0001, 0.0002, 0.0005, 0.002, 0.01])
+            tickers.append({
+                "symbol": symbol, "lastPrice": f"{last:.8f}",
+                "highPrice": f"{last * (1 + price_range / 2):.8f}", "lowPrice": f"{last * (1 - price_range / 2):.8f}",
+                "bidPrice": f"{last * (1 - spread / 2):.8f}", "askPrice": f"{last * (1 + spread / 2):.8f}",
+                "quoteVolume": f"{10 ** rnd.uniform(5, 9):.2f}",
+            })
+        return tickers
+
+    def get_exchange_info(self):
+        self._call("get_exchange_info")
+        return {"symbols": [
+            {"symbol": symbol, "status": "TRADING", "baseAsset": symbol[:-4], "quoteAsset": "USDT",
+             "isSpotTradingAllowed": True}
+            for symbol in self.symbols
+        ]}
+
+    def get_symbol_ticker(self, symbol, **kwargs):
+        self._call("get_symbol_ticker", symbol)
+        return {"symbol": symbol, "price": self._price(symbol)}
+
+    def _price(self, symbol):
+        open_time = self.now_ms // INTERVAL_MS["1m"] * INTERVAL_MS["1m"]
+        return self._kline(symbol, "1m", open_time)[4]
+
+    def _kline(self, symbol, interval, open_time):
+        rnd = random.Random(f"{self.seed}:{symbol}:{interval}:{open_time}")
+        open_price = 100 + rnd.uniform(-5, 5)
+        close_price = open_price * (1 + rnd.gauss(0, 0.004))
+        return make_kline(open_time, interval, open_price, close_price, rnd.uniform(10, 100))
+
+
+class FakeKlineServer:
+    # Локальный WebSocket-сервер в формате комбинированных потоков Binance
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._server = None
+        self._connections = set()
+        self._thread = None
+        self._started = threading.Event()
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/stream"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_thread, name="fake-kline-server", daemon=True)
+        self._thread.start()
+        self._started.wait(5)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._thread.join(timeout=5)
+
+    def push(self, symbol, interval, row, closed=False):
+        k = {
+            "t": row[0], "T": row[6], "s": symbol.upper(), "i": interval,
+            "o": row[1], "h": row[2], "l": row[3], "c": row[4], "v": row[5],
+            "n": row[8], "x": closed, "q": row[7], "V": row[9], "Q": row[10], "B": row[11],
+        }
+        message = json.dumps({
+            "stream": f"{symbol.lower()}@kline_{interval}",
+            "data": {"e": "kline", "E": row[0], "s": symbol.upper(), "k": k},
+        })
+        asyncio.run_coroutine_threadsafe(self._broadcast(message), self._loop).result(5)
+
+    def drop_connections(self):
+        # Имитация обрыва связи со стороны биржи
+        asyncio.run_coroutine_threadsafe(self._close_all(), self._loop).result(5)
+
+    def connection_count(self):
+        return len(self._connections)
+
+    async def _broadcast(self, message):
+        for ws in list(self._connections):
+            await ws.send(message)
+
+    async def _close_all(self):
+        for ws in list(self._connections):
+            await ws.close()
+
+    async def _handler(self, ws):
+        self._connections.add(ws)
+        try:
+            await ws.wait_closed()
+        finally:
+            self._connections.discard(ws)
+
+    def _run_thread(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        self._loop.close()
+
+    async def _serve(self):
+        async with serve(self._handler, self.host, self.port) as server:
+            self._server = server
+            self.port = server.sockets[0].getsockname()[1]
+            self._started.set()
+            await server.wait_closed()
@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Локальная замена Telegram Bot API (sendMessage и getMe) для проверки без сети
+
+
+class FakeTelegramServer:
+    # latency — задержка ответа в секундах; rate_limit_every — каждый N-й запрос получает 429
+    # с retry_after; fail_chat_ids — чаты, для которых всегда отвечаем 403
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, rate_limit_every=0, retry_after=1, fail_chat_ids=()):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.fail_chat_ids = {str(chat_id) for chat_id in fail_chat_ids}
+        self.messages = []
+        self.received_at = []
+        self.rate_limited_at = []
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _respond(self, chat_id, text):
+        with self._lock:
+            self.requests += 1
+            number = self.requests
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_limit_every and number % self.rate_limit_every == 0:
+            with self._lock:
+                self.rate_limited_at.append(time.perf_counter())
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                         "parameters": {"retry_after": self.retry_after}}
+        if chat_id in self.fail_chat_ids:
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        with self._lock:
+            self.messages.append((chat_id, text))
+            self.received_at.append(time.perf_counter())
+        # Полный Message: python-telegram-bot разбирает ответ sendMessage
+        return 200, {"ok": True, "result": {"message_id": number, "date": int(time.time()),
+                                            "chat": {"id": int(chat_id), "type": "private"}, "text": text}}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                if self.path.endswith("/getMe"):
+                    status, body = 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}}
+                elif not self.path.endswith("/sendMessage"):
+                    status, body = 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+                else:
+                    status, body = fake._respond(form.get("chat_id", [""])[0], form.get("text", [""])[0])
+                raw = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
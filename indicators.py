@@ -0,0 +1,274 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from candle_store import INTERVAL_MS, OPEN_TIME, HIGH, LOW, CLOSE, VOLUME
+
+SMA_FAST = 50
+SMA_SLOW = 200
+RSI_WINDOW = 14
+ATR_WINDOW = 14
+VOLUME_WINDOW = 20
+RESISTANCE_WINDOW = 20
+
+# Сколько закрытых свечей нужно, чтобы все индикаторы были определены
+WARMUP_BARS = SMA_SLOW
+
+# Раз в столько обновлений скользящие суммы пересчитываются заново, чтобы не копилась ошибка
+RESYNC_EVERY = 1000
+
+# Снимок состояния (warm_state.py): скаляры IndicatorState по столбцам и окна скользящих сумм
+STATE_SCALARS = ("last_open_time", "count", "prev_close", "avg_up", "avg_down", "tr_sum", "atr", "close_max_index")
+STATE_WINDOWS = ("sma_fast", "sma_slow", "volume")
+
+
+class RollingSum:
+    # Сумма последних size значений за O(1) на обновление
+    def __init__(self, size):
+        self.size = size
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self._updates = 0
+
+    def push(self, value):
+        if len(self.values) == self.size:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        self._updates += 1
+        if self._updates % RESYNC_EVERY == 0:
+            self.total = math.fsum(self.values)
+
+
+class RollingMax:
+    # Максимум последних size значений: монотонная очередь, O(1) амортизированно
+    def __init__(self, size):
+        self.size = size
+        self._items = deque()
+        self._index = 0
+
+    def push(self, value):
+        while self._items and self._items[-1][1] <= value:
+            self._items.pop()
+        self._items.append((self._index, value))
+        self._index += 1
+        while self._items[0][0] <= self._index - 1 - self.size:
+            self._items.popleft()
+
+    def max(self):
+        return self._items[0][1] if self._items else -math.inf
+
+    def __len__(self):
+        return min(self._index, self.size)
+
+
+class IndicatorState:
+    # Состояние индикаторов по закрытым свечам одной пары (symbol, interval).
+    # Последняя свеча окна (обычно незакрытая) в состояние не записывается:
+    # значения для неё считаются поверх состояния при каждом запросе.
+    def __init__(self, interval):
+        self.step = INTERVAL_MS[interval]
+        self.last_open_time = None
+        self.count = 0
+        # Окна на одну свечу короче: вторую часть окна даёт последняя свеча
+        self.sma_fast = RollingSum(SMA_FAST - 1)
+        self.sma_slow = RollingSum(SMA_SLOW - 1)
+        self.volume = RollingSum(VOLUME_WINDOW - 1)
+        self.close_max = RollingMax(RESISTANCE_WINDOW - 1)
+        self.prev_close = None
+        self.avg_up = 0.0
+        self.avg_down = 0.0
+        self.tr_sum = 0.0
+        self.atr = 0.0
+
+    def _true_range(self, high, low):
+        if self.prev_close is None:
+            return high - low
+        return max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+    def _rsi_step(self, close):
+        # Как в ta: ewm(alpha=1/window, adjust=False), первая разность считается нулевой
+        alpha = 1 / RSI_WINDOW
+        diff = 0.0 if self.prev_close is None else close - self.prev_close
+        up = diff if diff > 0 else 0.0
+        down = -diff if diff < 0 else 0.0
+        if self.count == 0:
+            return up, down
+        return (1 - alpha) * self.avg_up + alpha * up, (1 - alpha) * self.avg_down + alpha * down
+
+    def _atr_step(self, true_range):
+        # Как в ta: первое значение — среднее первых window TR, дальше сглаживание Уайлдера,
+        # до этого ATR равен 0
+        n = self.count + 1
+        tr_sum = self.tr_sum + true_range if n <= ATR_WINDOW else self.tr_sum
+        if n < ATR_WINDOW:
+            return tr_sum, 0.0
+        if n == ATR_WINDOW:
+            return tr_sum, tr_sum / ATR_WINDOW
+        return tr_sum, (self.atr * (ATR_WINDOW - 1) + true_range) / ATR_WINDOW
+
+    def commit(self, open_time, high, low, close, volume):
+        true_range = self._true_range(high, low)
+        self.avg_up, self.avg_down = self._rsi_step(close)
+        self.tr_sum, self.atr = self._atr_step(true_range)
+        self.sma_fast.push(close)
+        self.sma_slow.push(close)
+        self.volume.push(volume)
+        self.close_max.push(close)
+        self.prev_close = close
+        self.last_open_time = open_time
+        self.count += 1
+
+    def values(self, high, low, close, volume):
+        # Индикаторы для свечи, идущей следом за последней закрытой
+        n = self.count + 1
+        avg_up, avg_down = self._rsi_step(close)
+        if n < RSI_WINDOW:
+            rsi = math.nan
+        elif avg_down == 0:
+            rsi = 100.0
+        else:
+            rsi = 100 - 100 / (1 + avg_up / avg_down)
+        _, atr = self._atr_step(self._true_range(high, low))
+        return {
+            "close": close,
+            "volume": volume,
+            "SMA_50": self._window_mean(self.sma_fast, close, SMA_FAST),
+            "SMA_200": self._window_mean(self.sma_slow, close, SMA_SLOW),
+            "RSI": rsi,
+            "ATR": atr,
+            "volume_mean_20": self._window_mean(self.volume, volume, VOLUME_WINDOW),
+            "close_max_20": max(self.close_max.max(), close) if len(self.close_max) == RESISTANCE_WINDOW - 1 else math.nan,
+        }
+
+    @staticmethod
+    def _window_mean(rolling, value, window):
+        if len(rolling.values) < window - 1:
+            return math.nan
+        return (rolling.total + value) / window
+
+
+class IndicatorEngine:
+    # Инкрементальные индикаторы по всем (symbol, interval). При первом обращении состояние
+    # прогревается по всей доступной истории, дальше на каждую новую закрытую свечу — O(1).
+    def __init__(self):
+        self._states = {}
+
+    def update(self, symbol, interval, candles):
+        # candles — массив (6, n) из candle_store, последняя свеча может быть незакрытой
+        key = (symbol.upper(), interval)
+        state = self._states.get(key)
+        open_times = candles[OPEN_TIME]
+        if state is not None and state.last_open_time is not None:
+            first_new = state.last_open_time + state.step
+            if len(open_times) and (open_times[0] > first_new or open_times[-1] < state.last_open_time):
+                # История не стыкуется с состоянием (разрыв или сброс буфера) — прогреваемся заново
+                state = None
+        if state is None:
+            state = self._states[key] = IndicatorState(interval)
+        start = 0
+        if state.last_open_time is not None:
+            start = int(np.searchsorted(open_times, state.last_open_time, side="right"))
+        for i in range(start, len(open_times) - 1):
+            state.commit(int(open_times[i]), candles[HIGH, i], candles[LOW, i], candles[CLOSE, i], candles[VOLUME, i])
+        return state.values(candles[HIGH, -1], candles[LOW, -1], candles[CLOSE, -1], candles[VOLUME, -1])
+
+    def reset(self, symbol=None, interval=None):
+        if symbol is None:
+            self._states.clear()
+        else:
+            self._states.pop((symbol.upper(), interval), None)
+
+    def export_state(self):
+        # Состояние всех пар массивами для np.savez: значения не пересчитываются, поэтому после
+        # восстановления RSI и ATR продолжаются с того же места, а не с нового прогрева
+        keys = list(self._states)
+        states = [self._states[key] for key in keys]
+        scalars = np.array([[
+            np.nan if state.last_open_time is None else state.last_open_time, state.count,
+            np.nan if state.prev_close is None else state.prev_close,
+            state.avg_up, state.avg_down, state.tr_sum, state.atr, state.close_max._index,
+        ] for state in states], dtype=np.float64).reshape(-1, len(STATE_SCALARS))
+        arrays = {
+            "indicator_symbols": np.array([symbol for symbol, _ in keys], dtype=str),
+            "indicator_intervals": np.array([interval for _, interval in keys], dtype=str),
+            "indicator_scalars": scalars,
+        }
+        for name in STATE_WINDOWS:
+            rolling = [getattr(state, name) for state in states]
+            arrays[f"indicator_{name}"] = np.array([v for r in rolling for v in r.values], dtype=np.float64)
+            arrays[f"indicator_{name}_lengths"] = np.array([len(r.values) for r in rolling], dtype=np.int64)
+            # total и счётчик обновлений — как есть: сумма с накопленной ошибкой даёт те же значения
+            arrays[f"indicator_{name}_totals"] = np.array([[r.total, r._updates] for r in rolling],
+                                                         dtype=np.float64).reshape(-1, 2)
+        items = [state.close_max._items for state in states]
+        arrays["indicator_close_max"] = np.array([item for q in items for item in q], dtype=np.float64).reshape(-1, 2)
+        arrays["indicator_close_max_lengths"] = np.array([len(q) for q in items], dtype=np.int64)
+        return arrays
+
+    def restore_state(self, arrays):
+        # Обратное к export_state; пары, которые уже обновлялись в этом процессе, не трогаются
+        if "indicator_scalars" not in arrays:
+            return 0
+        offsets = {name: np.concatenate(([0], np.cumsum(arrays[f"indicator_{name}_lengths"])))
+                   for name in (*STATE_WINDOWS, "close_max")}
+        restored = 0
+        for i, (symbol, interval) in enumerate(zip(arrays["indicator_symbols"], arrays["indicator_intervals"])):
+            key = (str(symbol), str(interval))
+            if key in self._states:
+                continue
+            state = IndicatorState(key[1])
+            last_open_time, count, prev_close, state.avg_up, state.avg_down, state.tr_sum, state.atr, index = \
+                arrays["indicator_scalars"][i].tolist()
+            state.last_open_time = None if math.isnan(last_open_time) else int(last_open_time)
+            state.count = int(count)
+            state.prev_close = None if math.isnan(prev_close) else prev_close
+            for name in STATE_WINDOWS:
+                rolling = getattr(state, name)
+                rolling.values.extend(arrays[f"indicator_{name}"][offsets[name][i]:offsets[name][i + 1]].tolist())
+                total, updates = arrays[f"indicator_{name}_totals"][i].tolist()
+                rolling.total, rolling._updates = total, int(updates)
+            state.close_max._index = int(index)
+            state.close_max._items.extend(
+                (int(j), value) for j, value in arrays["indicator_close_max"][offsets["close_max"][i]:offsets["close_max"][i + 1]].tolist())
+            self._states[key] = state
+            restored += 1
+        return restored
+
+
+def indicator_series(candles):
+    # Индикаторы по всей истории сразу (для бэктеста): те же формулы, что в apply_indicators
+    # и ta, но ATR считается через ewm, без цикла Python по свечам
+    import pandas as pd
+    close = pd.Series(candles[CLOSE])
+    high = pd.Series(candles[HIGH])
+    low = pd.Series(candles[LOW])
+    volume = pd.Series(candles[VOLUME])
+
+    diff = close.diff(1)
+    up = diff.where(diff > 0, 0.0)
+    down = -diff.where(diff < 0, 0.0)
+    avg_up = up.ewm(alpha=1 / RSI_WINDOW, min_periods=RSI_WINDOW, adjust=False).mean()
+    avg_down = down.ewm(alpha=1 / RSI_WINDOW, min_periods=RSI_WINDOW, adjust=False).mean()
+    rsi = np.where(avg_down == 0, 100, 100 - 100 / (1 + avg_up / avg_down))
+
+    prev_close = close.shift(1)
+    true_range = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+    atr = np.zeros(len(close))
+    if len(close) >= ATR_WINDOW:
+        # Уайлдер = ewm(alpha=1/window, adjust=False), начиная со среднего первых window значений
+        seeded = true_range.iloc[ATR_WINDOW - 1:].copy()
+        seeded.iloc[0] = true_range.iloc[:ATR_WINDOW].mean()
+        atr[ATR_WINDOW - 1:] = seeded.ewm(alpha=1 / ATR_WINDOW, adjust=False).mean().to_numpy()
+
+    return {
+        "close": candles[CLOSE],
+        "volume": candles[VOLUME],
+        "SMA_50": close.rolling(window=SMA_FAST).mean().to_numpy(),
+        "SMA_200": close.rolling(window=SMA_SLOW).mean().to_numpy(),
+        "RSI": rsi,
+        "ATR": atr,
+        "volume_mean_20": volume.rolling(window=VOLUME_WINDOW).mean().to_numpy(),
+        "close_max_20": close.rolling(window=RESISTANCE_WINDOW).max().to_numpy(),
+    }
@@ -0,0 +1,260 @@
+import argparse
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import metrics
+from candle_store import FIELDS, INTERVAL_MS, OPEN_TIME, klines_to_array
+from config import KLINE_CACHE_DIR, SYMBOLS
+
+# Локальный кэш закрытых свечей: файл <SYMBOL>_<interval>.bin на пару, записи фиксированной ширины
+# (6 x float64 little-endian: open_time, open, high, low, close, volume) в порядке open_time.
+# Чтение — через np.memmap без копирования; у Binance запрашиваются только свечи новее последней
+# сохранённой. Файл только дописывается (под flock на <файл>.lock), поэтому бот и Telegram-процесс
+# делят один кэш, а читатель видит только целые записи.
+# python kline_cache.py --intervals 1m 15m 1h --days 30      # догрузить историю для backtest.py
+# python kline_cache.py --verify                             # проверить разрывы и дубли
+
+RECORD = np.dtype("<f8")
+RECORD_SIZE = len(FIELDS) * RECORD.itemsize
+PAGE_LIMIT = 1000
+# Если бот долго не работал, в живом цикле догружаем не больше стольких свечей, остальное —
+# разрыв в кэше (его закроет python kline_cache.py --days N)
+MAX_CATCHUP_BARS = 5000
+
+
+@contextmanager
+def _locked(path):
+    # Блокировка на отдельном файле: сам файл свечей fill() может заменить через os.replace
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _last_open_time(f):
+    size = os.fstat(f.fileno()).st_size // RECORD_SIZE
+    if not size:
+        return None
+    return int(np.frombuffer(os.pread(f.fileno(), RECORD.itemsize, (size - 1) * RECORD_SIZE), dtype=RECORD)[0])
+
+
+def _append(f, candles):
+    # Неполная запись в конце (процесс упал посреди write) обрезается, иначе сдвинутся все следующие
+    size = os.fstat(f.fileno()).st_size
+    if size % RECORD_SIZE:
+        f.truncate(size - size % RECORD_SIZE)
+    f.seek(0, os.SEEK_END)
+    f.write(np.ascontiguousarray(candles.T, dtype=RECORD).tobytes())
+    f.flush()
+
+
+def map_file(path):
+    # Файл кэша целиком как (6, n) без копирования (для backtest.py и sweep.py)
+    count = os.path.getsize(path) // RECORD_SIZE
+    if not count:
+        return np.empty((len(FIELDS), 0))
+    return np.memmap(path, dtype=RECORD, mode="r", shape=(count, len(FIELDS))).T
+
+
+class KlineCache:
+    # client — шлюз binance_api (или None: только чтение, например в backtest.py)
+    def __init__(self, directory, client=None, clock=time.time, max_catchup=MAX_CATCHUP_BARS):
+        self.directory = directory
+        self.client = client
+        self.clock = clock
+        self.max_catchup = max_catchup
+        self._lock = threading.Lock()
+        self._maps = {}
+        # Самое раннее начало окна, которое уже догружалось назад: раньше биржа может
+        # не иметь свечей (новая пара), повторять запрос каждый цикл незачем
+        self._backfilled = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, symbol, interval):
+        return os.path.join(self.directory, f"{symbol.upper()}_{interval}.bin")
+
+    def history(self, symbol, interval):
+        # Все сохранённые свечи (6, n) — вид на memmap без копирования
+        path = self.path(symbol, interval)
+        try:
+            count = os.path.getsize(path) // RECORD_SIZE
+        except FileNotFoundError:
+            return np.empty((len(FIELDS), 0))
+        key = (symbol.upper(), interval)
+        with self._lock:
+            mapped = self._maps.get(key)
+            # Отображение фиксированного размера: файл вырос — отображаем заново. Старые виды
+            # остаются валидными, файл никогда не укорачивается на целые записи.
+            if mapped is None or mapped.shape[0] != count:
+                if not count:
+                    return np.empty((len(FIELDS), 0))
+                mapped = self._maps[key] = np.memmap(path, dtype=RECORD, mode="r", shape=(count, len(FIELDS)))
+        return mapped.T
+
+    def window(self, symbol, interval, lookback, until=None):
+        # Последние lookback свечей, закрытых к until (мс; по умолчанию — сейчас)
+        self.sync(symbol, interval, until, lookback)
+        candles = self.history(symbol, interval)
+        if until is not None:
+            end = int(np.searchsorted(candles[OPEN_TIME], until - INTERVAL_MS[interval], side="right"))
+            candles = candles[:, :end]
+        return candles[:, -lookback:]
+
+    def sync(self, symbol, interval, until=None, lookback=PAGE_LIMIT):
+        # Догружает свечи, закрытые к until, и недостающее начало окна из lookback свечей.
+        # Возвращает число новых свечей; если всё окно уже в кэше, к Binance не обращается.
+        step = INTERVAL_MS[interval]
+        now = int(until if until is not None else self.clock() * 1000)
+        newest = now // step * step - step
+        oldest = newest - (lookback - 1) * step
+        candles = self.history(symbol, interval)
+        key = (symbol.upper(), interval)
+        if candles.shape[1] and candles[OPEN_TIME, 0] > oldest and oldest < self._backfilled.get(key, np.inf):
+            # Кэш начинается позже окна (например, первая загрузка была для меньшего lookback)
+            self._backfilled[key] = oldest
+            return self.fill(symbol, interval, oldest, until)
+        if candles.shape[1] and candles[OPEN_TIME, -1] >= newest:
+            metrics.inc("kline_cache_hits_total", interval=interval)
+            return 0
+        path = self.path(symbol, interval)
+        with _locked(path), open(path, "a+b") as f:
+            # Пока ждали блокировку, другой процесс мог уже дописать
+            last = _last_open_time(f)
+            if last is None or last < newest - self.max_catchup * step:
+                if last is not None:
+                    print(f"Кэш свечей {symbol} {interval}: пропуск с {last} больше {self.max_catchup} свечей, "
+                          f"догружаем только последние {lookback}.")
+                start = newest - (lookback - 1) * step
+            else:
+                start = last + step
+            return self._fetch(f, symbol, interval, start, newest, last)
+
+    def fill(self, symbol, interval, start_ms, until=None):
+        # Для офлайн-инструментов: история с start_ms. Если кэш начинается позже, недостающее
+        # начало скачивается и файл пересобирается (os.replace: уже открытые memmap не ломаются).
+        step = INTERVAL_MS[interval]
+        newest = int(until if until is not None else self.clock() * 1000) // step * step - step
+        start_ms = -(-int(start_ms) // step) * step
+        path = self.path(symbol, interval)
+        added = 0
+        with _locked(path):
+            candles = self.history(symbol, interval)
+            if candles.shape[1] and start_ms < candles[OPEN_TIME, 0]:
+                first = int(candles[OPEN_TIME, 0])
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as tmp:
+                    added = self._fetch(tmp, symbol, interval, start_ms, first - step, None)
+                    _append(tmp, np.asarray(candles))
+                    os.fsync(tmp.fileno())
+                os.replace(tmp_path, path)
+                with self._lock:
+                    self._maps.pop((symbol.upper(), interval), None)
+            with open(path, "a+b") as f:
+                last = _last_open_time(f)
+                return added + self._fetch(f, symbol, interval, start_ms if last is None else last + step, newest, last)
+
+    def _fetch(self, f, symbol, interval, start, newest, last):
+        # Постранично от start до newest (включительно), только закрытые свечи, без дублей
+        step = INTERVAL_MS[interval]
+        added = 0
+        while start <= newest:
+            rows = self.client.get_klines(symbol=symbol, interval=interval, startTime=start, limit=PAGE_LIMIT)
+            candles = klines_to_array(rows)
+            if not candles.shape[1]:
+                break
+            open_times = candles[OPEN_TIME]
+            keep = open_times <= newest
+            if last is not None:
+                keep &= open_times > last
+            # Порядок и уникальность: каждая свеча позже всех предыдущих
+            keep &= open_times > np.maximum.accumulate(np.concatenate(([-np.inf], open_times[:-1])))
+            duplicates = int(len(open_times) - keep.sum() - (open_times > newest).sum())
+            if duplicates:
+                metrics.inc("kline_cache_duplicates_total", duplicates, interval=interval)
+            candles = candles[:, keep]
+            if candles.shape[1]:
+                times = candles[OPEN_TIME]
+                previous = np.concatenate(([last if last is not None else times[0] - step], times[:-1]))
+                gaps = int((times - previous > step).sum())
+                if gaps:
+                    # Биржа не отдала свечи (техработы) — в кэше остаётся разрыв
+                    metrics.inc("kline_cache_gaps_total", gaps, interval=interval)
+                    print(f"Кэш свечей {symbol} {interval}: {gaps} разрыв(ов) в истории.")
+                _append(f, candles)
+                added += candles.shape[1]
+                last = int(times[-1])
+            if len(rows) < PAGE_LIMIT or open_times[-1] >= newest:
+                break
+            start = int(open_times[-1]) + step
+        metrics.inc("kline_cache_fetched_total", added, interval=interval)
+        return added
+
+    def verify(self, symbol, interval):
+        # Разрывы (шаг больше интервала) и нарушения порядка/дубли в файле
+        open_times = self.history(symbol, interval)[OPEN_TIME]
+        diffs = np.diff(open_times)
+        gap_at = np.flatnonzero(diffs > INTERVAL_MS[interval])
+        return {
+            "bars": len(open_times),
+            "first": int(open_times[0]) if len(open_times) else None,
+            "last": int(open_times[-1]) if len(open_times) else None,
+            "unordered": int((diffs <= 0).sum()),
+            "gaps": [(int(open_times[i]), int(open_times[i + 1])) for i in gap_at],
+        }
+
+
+# Один кэш на процесс: торговый цикл, команды Telegram и инструменты читают одни и те же файлы
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_kline_cache():
+    global _cache
+    if not KLINE_CACHE_DIR:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from binance_api import get_client
+                _cache = KlineCache(KLINE_CACHE_DIR, get_client())
+    return _cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка и проверка локального кэша свечей")
+    parser.add_argument("--cache-dir", default=KLINE_CACHE_DIR or "klines")
+    parser.add_argument("--symbols", nargs="*", default=SYMBOLS)
+    parser.add_argument("--intervals", nargs="*", default=["1m", "15m", "1h"])
+    parser.add_argument("--days", type=float, default=0, help="догрузить историю за столько дней")
+    parser.add_argument("--verify", action="store_true", help="только проверить файлы, без запросов")
+    args = parser.parse_args()
+
+    client = None
+    if not args.verify:
+        from binance_api import get_client
+        client = get_client()
+    cache = KlineCache(args.cache_dir, client)
+    for symbol in args.symbols:
+        for interval in args.intervals:
+            if not args.verify:
+                started = time.perf_counter()
+                if args.days:
+                    added = cache.fill(symbol, interval, time.time() * 1000 - args.days * 86_400_000)
+                else:
+                    added = cache.sync(symbol, interval)
+                print(f"{symbol} {interval}: +{added} свечей за {time.perf_counter() - started:.1f} c")
+            report = cache.verify(symbol, interval)
+            print(f"{symbol} {interval}: {report['bars']} свечей, разрывов: {len(report['gaps'])}, "
+                  f"нарушений порядка: {report['unordered']}")
+            for start, end in report["gaps"][:5]:
+                print(f"  разрыв: {start} -> {end}")
+
+
+if __name__ == "__main__":
+    main()
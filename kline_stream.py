@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+
+import websockets
+
+from candle_store import CandleStore
+
+STREAM_URL = "wss://stream.binance.com:9443/stream"
+
+# Параметры переподключения (секунды)
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+class KlineStream:
+    # Подписка на комбинированные kline-потоки Binance. Для каждой пары (symbol, interval)
+    # держит скользящее окно последних свечей; последняя свеча может быть незакрытой.
+    # При старте и после каждого переподключения пропущенные свечи догружаются через REST.
+    def __init__(self, client, symbols, intervals, window=500, url=STREAM_URL):
+        self.client = client
+        self.symbols = [s.upper() for s in symbols]
+        self.intervals = list(intervals)
+        self.window = window
+        self.url = url
+        self.store = CandleStore(capacity=window)
+        for symbol in self.symbols:
+            for interval in self.intervals:
+                self.store.buffer(symbol, interval)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._loop = None
+        self._ws = None
+        self.reconnects = 0
+
+    def stream_names(self):
+        return [f"{s.lower()}@kline_{i}" for s in self.symbols for i in self.intervals]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_thread, name="kline-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        if self._loop is not None and self._ws is not None:
+            asyncio.run_coroutine_threadsafe(self._ws.close(), self._loop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def get_window(self, symbol, interval, lookback):
+        # Копия последних lookback свечей (6, lookback) или None, если данных ещё нет
+        # или их меньше запрошенного, — тогда вызывающий код идёт в REST
+        if not self._ready.is_set():
+            return None
+        key = (symbol.upper(), interval)
+        if key not in self.store:
+            return None
+        with self._lock:
+            buf = self.store.buffer(symbol, interval)
+            if len(buf) < lookback:
+                return None
+            return buf.view(lookback).copy()
+
+    def apply_kline(self, symbol, interval, open_time, open_price, high, low, close, volume):
+        with self._lock:
+            self.store.buffer(symbol, interval).append(open_time, open_price, high, low, close, volume)
+
+    def backfill(self):
+        # Догружаем всё, что могло быть пропущено, начиная с последней известной свечи
+        for symbol, interval in self.store.keys():
+            with self._lock:
+                last_open = self.store.buffer(symbol, interval).last_open_time()
+            if last_open is None:
+                rows = self.client.get_klines(symbol=symbol, interval=interval, limit=self.window)
+            else:
+                rows = self.client.get_klines(symbol=symbol, interval=interval, startTime=last_open, limit=1000)
+            with self._lock:
+                self.store.buffer(symbol, interval).extend(rows)
+
+    def _handle_message(self, raw):
+        message = json.loads(raw)
+        data = message.get("data", message)
+        if data.get("e") != "kline":
+            return
+        k = data["k"]
+        self.apply_kline(k["s"], k["i"], k["t"], float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"]))
+
+    def _run_thread(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._run())
+        finally:
+            self._loop.close()
+
+    async def _run(self):
+        delay = RECONNECT_DELAY
+        url = f"{self.url}?streams={'/'.join(self.stream_names())}"
+        while not self._stopping:
+            try:
+                async with websockets.connect(url) as ws:
+                    self._ws = ws
+                    # Сообщения, пришедшие во время догрузки, буферизуются сокетом
+                    # и применяются после неё; повторы одной свечи просто перезаписываются
+                    await self._loop.run_in_executor(None, self.backfill)
+                    self._ready.set()
+                    delay = RECONNECT_DELAY
+                    async for raw in ws:
+                        self._handle_message(raw)
+            except Exception as e:
+                if self._stopping:
+                    break
+                print(f"Ошибка kline-потока: {e}. Переподключение через {delay} c.")
+            finally:
+                self._ws = None
+            if self._stopping:
+                break
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
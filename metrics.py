@@ -0,0 +1,150 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Счётчики, gauge и гистограммы времени в формате Prometheus (text exposition 0.0.4).
+# Пока start_metrics_server не вызван, все функции сразу возвращаются и ничего не пишут.
+
+PREFIX = "cryptobot_"
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_server = None
+
+
+def enabled():
+    return _enabled
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+@contextmanager
+def _timed(name, labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **labels):
+    # with span("cycle_stage_seconds", stage="exits"): ... — время блока в гистограмму name
+    if not _enabled:
+        return _NO_SPAN
+    return _timed(name, labels)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: ([*h[0]], h[1], h[2]) for key, h in _histograms.items()}
+    lines = []
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        typed = set()
+        for (name, labels), value in sorted(values.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    typed = set()
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            typed.add(name)
+        for bound, bucket in zip(BUCKETS, buckets):
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    # Включает сбор метрик в этом процессе и отдаёт их на http://host:port/metrics.
+    # Значения, унаследованные от родителя при fork, сбрасываются: у каждого процесса свои метрики.
+    global _enabled, _server
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    _enabled = True
+    return _server
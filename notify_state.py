@@ -0,0 +1,44 @@
+# Что пользователь уже знает: компактное состояние по монетам, с которым сравнивается
+# результат цикла. Отправляются только изменения — новый сигнал входа, его исчезновение,
+# закрытие позиции, новая позиция под наблюдением; повторы «стабильна» и «нет входов» — нет.
+# Состояние: {"c": {монета: код}, "t": время последней отправки, мс}; NO_ENTRY не хранится.
+
+ENTRY_BUY = "B"
+ENTRY_SELL = "S"
+NO_ENTRY = "-"
+POSITION_OPEN = "o"
+POSITION_CLOSED = "x"
+
+ENTRY_CODES = {"BUY": ENTRY_BUY, "SELL": ENTRY_SELL, None: NO_ENTRY}
+
+
+def is_change(before, code):
+    if code == POSITION_CLOSED:
+        return True
+    if code in (ENTRY_BUY, ENTRY_SELL, POSITION_OPEN):
+        return code != before
+    # Сигнал пропал; после позиции или её закрытия «нет входов» не новость
+    return before in (ENTRY_BUY, ENTRY_SELL)
+
+
+def has_active_entries(state):
+    # Был ли у пользователя сигнал входа, об исчезновении которого нужно будет сообщить
+    return bool(state) and any(code in (ENTRY_BUY, ENTRY_SELL) for code in state["c"].values())
+
+
+def delta_lines(state, items):
+    # items — [(монета, код, строка)] проверенных в цикле монет
+    codes = state["c"] if state else {}
+    return [line for symbol, code, line in items if is_change(codes.get(symbol, NO_ENTRY), code)]
+
+
+def next_state(state, items, sent_at=None):
+    # sent_at — время отправки, если пользователю что-то ушло в этом цикле
+    codes = dict(state["c"]) if state else {}
+    for symbol, code, _ in items:
+        if code in (NO_ENTRY, POSITION_CLOSED):
+            codes.pop(symbol, None)
+        else:
+            codes[symbol] = code
+    last_sent = sent_at if sent_at is not None else (state["t"] if state else 0)
+    return {"c": codes, "t": last_sent}
@@ -0,0 +1,341 @@
+import threading
+
+import numpy as np
+
+from config import PORTFOLIO_ALERT_PERCENT
+
+# Открытые позиции всех пользователей в колонках (как PositionGroup в exit_engine.py): на каждое
+# обновление цен нереализованный PnL, эквити и расстояния до SL/TP/ликвидации пересчитываются
+# для всех позиций одной векторной операцией, итоги по пользователю — в массивах по его строке.
+# Изменение позиций одного пользователя (set_user) не пересобирает колонки: его старые строки
+# помечаются удалёнными, новые дописываются в конец, а пересчитываются только они. Удалённые
+# строки вычищаются полной пересборкой, когда их становится больше живых.
+
+# Поддерживающая маржа изолированной позиции (доля от объёма) — для оценки цены ликвидации
+MAINTENANCE_MARGIN = 0.005
+
+# Виды предупреждений по возрастанию важности: (значок, текст, колонка уровня)
+ALERTS = (
+    ("🎯", "тейк‑профита", "take_profit"),
+    ("⚠️", "стоп‑лосса", "stop_loss"),
+    ("🚨", "ликвидации", "liquidation"),
+)
+
+# Колонки позиций: место выделяется с запасом, используются первые size строк
+COLUMNS = (
+    ("user", np.intp), ("symbol", np.intp), ("side", np.float64), ("entry", np.float64),
+    ("stop_loss", np.float64), ("take_profit", np.float64), ("stake", np.float64), ("leverage", np.float64),
+    ("liquidation", np.float64), ("live", bool), ("alerted", np.uint8),
+    # Пересчитываются по ценам в _mark
+    ("price", np.float64), ("change", np.float64), ("pnl", np.float64),
+    ("to_stop_loss", np.float64), ("to_take_profit", np.float64), ("to_liquidation", np.float64),
+)
+
+# Удалённых строк меньше — колонки не пересобираются
+COMPACT_MIN_ROWS = 1024
+
+
+def _position_key(chat_id, pos):
+    return str(chat_id), pos["coin"].upper(), pos["side"].upper(), float(pos["entry"])
+
+
+class Portfolio:
+    # alert_percent — расстояние до уровня (в % от цены), с которого отправляется предупреждение;
+    # повторно по тому же уровню — только после того, как цена отойдёт дальше двойного расстояния
+    def __init__(self, alert_percent=PORTFOLIO_ALERT_PERCENT):
+        self.alert_distance = alert_percent / 100
+        self._lock = threading.Lock()
+        self._balances = {}
+        self._positions = {}
+        self._prices = {}
+        self._build({})
+        self._mark()
+
+    def load(self, data):
+        # Все пользователи из load_cycle_data(): позиции без баланса не учитываются, как в exit_engine
+        with self._lock:
+            self._balances = {str(chat_id): float(balance) for chat_id, balance in data.get("balances", {}).items()}
+            self._positions = {chat_id: list(data.get("positions", {}).get(chat_id, [])) for chat_id in self._balances}
+            self._rebuild()
+
+    def set_user(self, chat_id, balance, positions):
+        # Свежие данные одного пользователя (из хранилища): пересчитываются только его строки
+        chat_id = str(chat_id)
+        balance = float(balance or 0)
+        with self._lock:
+            if self._balances.get(chat_id) == balance and self._positions.get(chat_id) == positions:
+                return
+            self._balances[chat_id] = balance
+            self._positions[chat_id] = list(positions)
+            row = self._rows.get(chat_id)
+            if row is None:
+                row = self._add_user(chat_id)
+            self.balance[row] = balance
+            old = self._user_rows[row]
+            # Отметки предупреждений переносятся на те же позиции
+            alerted = {self._keys[i]: int(self.alerted[i]) for i in old}
+            self.live[old] = False
+            self.alerted[old] = 0
+            for i in old:
+                self._keys[i] = None
+            self._dead += len(old)
+            self._user_rows[row] = []
+            self._append(*self._position_rows(row, chat_id), alerted)
+            if self._dead >= COMPACT_MIN_ROWS and self._dead > self.size - self._dead:
+                self._rebuild()
+                return
+            self._mark(np.array(self._user_rows[row], dtype=np.intp))
+            self._total_user(row)
+
+    def _rebuild(self):
+        # Полная пересборка колонок без удалённых строк; отметки предупреждений сохраняются
+        alerted = {key: mark for key, mark in zip(self._keys, self.alerted.tolist()) if key is not None}
+        self._build(alerted)
+        self._mark()
+
+    def _build(self, alerted):
+        self.chat_ids = list(self._balances)
+        self._rows = {chat_id: i for i, chat_id in enumerate(self.chat_ids)}
+        self.balance = np.array([self._balances[chat_id] for chat_id in self.chat_ids], dtype=np.float64)
+        self.symbols = []
+        self._symbol_index = {}
+        self._keys = []
+        # Строки позиций пользователя u — _user_rows[u], в порядке его списка
+        self._user_rows = [[] for _ in self.chat_ids]
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+        self.size = 0
+        self._dead = 0
+        keys, rows = [], []
+        for user, chat_id in enumerate(self.chat_ids):
+            user_keys, user_rows = self._position_rows(user, chat_id)
+            keys.extend(user_keys)
+            rows.extend(user_rows)
+        self._append(keys, rows, alerted)
+
+    def _add_user(self, chat_id):
+        row = len(self.chat_ids)
+        self.chat_ids.append(chat_id)
+        self._rows[chat_id] = row
+        self._user_rows.append([])
+        self.balance = np.append(self.balance, 0.0)
+        self.unrealized = np.append(self.unrealized, 0.0)
+        self.exposure = np.append(self.exposure, 0.0)
+        self.unpriced = np.append(self.unpriced, 0)
+        self.equity = np.append(self.equity, 0.0)
+        return row
+
+    def _position_rows(self, user, chat_id):
+        keys, rows = [], []
+        for pos in self._positions.get(chat_id, []):
+            key = _position_key(chat_id, pos)
+            keys.append(key)
+            rows.append((
+                user,
+                self._symbol_index.setdefault(key[1], len(self._symbol_index)),
+                1 if key[2] == "BUY" else -1,
+                key[3],
+                pos.get("stop_loss", np.nan),
+                pos.get("take_profit", np.nan),
+                pos.get("stake", 0),
+                pos.get("leverage", 1),
+            ))
+        self.symbols = list(self._symbol_index)
+        return keys, rows
+
+    def _append(self, keys, rows, alerted):
+        start, end = self.size, self.size + len(rows)
+        capacity = len(self._columns["user"])
+        if end > capacity:
+            # Запас вдвое: дописывание строк по одному пользователю в среднем O(его позиций)
+            capacity = max(end, 2 * capacity, 64)
+            for name, dtype in COLUMNS:
+                column = np.empty(capacity, dtype=dtype)
+                column[:start] = self._columns[name][:start]
+                self._columns[name] = column
+        self.size = end
+        for name, _ in COLUMNS:
+            setattr(self, name, self._columns[name][:end])
+        new = slice(start, end)
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 8).T
+        self.user[new] = columns[0]
+        self.symbol[new] = columns[1]
+        for name, values in zip(("side", "entry", "stop_loss", "take_profit", "stake", "leverage"), columns[2:]):
+            getattr(self, name)[new] = values
+        # Цена ликвидации изолированной позиции: маржа (stake) минус поддерживающая маржа съедена
+        leverage = np.maximum(self.leverage[new], 1)
+        self.liquidation[new] = self.entry[new] * (1 - self.side[new] * (1 / leverage - MAINTENANCE_MARGIN))
+        self.live[new] = True
+        # Битовая маска: бит k — предупреждение ALERTS[k] отправлено и ещё действует
+        self.alerted[new] = [alerted.get(key, 0) for key in keys]
+        self._keys.extend(keys)
+        for i, user in enumerate(columns[0].astype(np.intp).tolist(), start=start):
+            self._user_rows[user].append(i)
+
+    def _mark(self, rows=None):
+        # Пересчёт по последним известным ценам: всех позиций одним проходом (с итогами по
+        # пользователям) или только строк rows — итоги их владельца считает _total_user
+        if rows is None:
+            rows = slice(0, self.size)
+        by_symbol = np.array([self._prices.get(symbol, np.nan) for symbol in self.symbols], dtype=np.float64)
+        price = by_symbol[self.symbol[rows]]
+        side = self.side[rows]
+        self.price[rows] = price
+        self.change[rows] = change = side * (price - self.entry[rows]) / self.entry[rows]
+        self.pnl[rows] = self.stake[rows] * self.leverage[rows] * change
+        # Расстояние в долях цены; отрицательное — уровень уже пройден
+        self.to_stop_loss[rows] = side * (price - self.stop_loss[rows]) / price
+        self.to_take_profit[rows] = side * (self.take_profit[rows] - price) / price
+        self.to_liquidation[rows] = side * (price - self.liquidation[rows]) / price
+        if isinstance(rows, slice):
+            self._totals()
+
+    def _totals(self):
+        n_users = len(self.chat_ids)
+        priced = self.live & ~np.isnan(self.price)
+        self.unrealized = np.bincount(self.user, np.where(priced, self.pnl, 0), minlength=n_users)
+        self.exposure = np.bincount(self.user, np.where(self.live, self.stake * self.leverage, 0), minlength=n_users)
+        self.unpriced = np.bincount(self.user, self.live & ~priced, minlength=n_users)
+        self.equity = self.balance + self.unrealized
+
+    def _total_user(self, row):
+        rows = self._user_rows[row]
+        priced = ~np.isnan(self.price[rows])
+        self.unrealized[row] = self.pnl[rows][priced].sum()
+        self.exposure[row] = (self.stake[rows] * self.leverage[rows]).sum()
+        self.unpriced[row] = np.count_nonzero(~priced)
+        self.equity[row] = self.balance[row] + self.unrealized[row]
+
+    def update_prices(self, prices):
+        # prices — {symbol: цена} (PriceCache). Возвращает новые предупреждения [(chat_id, текст)]
+        with self._lock:
+            self._prices = prices
+            self._mark()
+            return self._alerts()
+
+    def set_prices(self, prices):
+        # Только запомнить цены: пересчёт — в summary по строкам запрошенного пользователя
+        with self._lock:
+            self._prices = prices
+
+    def _alerts(self):
+        d = self.alert_distance
+        near = np.zeros(self.size, dtype=np.uint8)
+        far = np.zeros(self.size, dtype=np.uint8)
+        for k, (_, _, field) in enumerate(ALERTS):
+            # NaN (нет цены или уровня) — ни близко, ни далеко: отметка не меняется
+            distance = getattr(self, f"to_{field}")
+            near |= (distance <= d).astype(np.uint8) << k
+            far |= (distance > 2 * d).astype(np.uint8) << k
+        near[~self.live] = 0
+        new = near & ~self.alerted
+        self.alerted[:] = (self.alerted | near) & ~far
+        alerts = []
+        for i in np.flatnonzero(new):
+            # Из одновременно сработавших — самое важное
+            k = int(new[i]).bit_length() - 1
+            icon, name, field = ALERTS[k]
+            chat_id = self.chat_ids[self.user[i]]
+            alerts.append((chat_id, (
+                f"{icon} {self.symbols[self.symbol[i]]} {'BUY' if self.side[i] > 0 else 'SELL'}: до {name} "
+                f"{getattr(self, f'to_{field}')[i] * 100:.2f}% (цена {self.price[i]:.2f}, уровень {getattr(self, field)[i]:.2f}). "
+                f"Нереализованный PnL: {self.pnl[i]:+.2f} USDT, эквити: {self.equity[self.user[i]]:.2f} USDT."
+            )))
+        return alerts
+
+    def export_alerts(self):
+        # Действующие отметки предупреждений (для снимка warm_state.py): после перезапуска
+        # те же предупреждения не отправляются повторно
+        with self._lock:
+            marked = np.flatnonzero(self.alerted)
+            keys = [self._keys[i] for i in marked]
+            return {
+                "alert_chat_ids": np.array([key[0] for key in keys], dtype=str),
+                "alert_coins": np.array([key[1] for key in keys], dtype=str),
+                "alert_sides": np.array([key[2] for key in keys], dtype=str),
+                "alert_entries": np.array([key[3] for key in keys], dtype=np.float64),
+                "alert_marks": self.alerted[marked],
+            }
+
+    def restore_alerts(self, arrays):
+        if "alert_marks" not in arrays:
+            return
+        marks = {
+            (str(chat_id), str(coin), str(side), float(entry)): int(mark)
+            for chat_id, coin, side, entry, mark in zip(arrays["alert_chat_ids"], arrays["alert_coins"],
+                                                        arrays["alert_sides"], arrays["alert_entries"],
+                                                        arrays["alert_marks"])
+        }
+        with self._lock:
+            self.alerted[:] = [marks.get(key, mark) if key is not None else 0
+                               for key, mark in zip(self._keys, self.alerted.tolist())]
+
+    def summary(self, chat_id):
+        # Итоги пользователя и его позиции по последним известным ценам; None — пользователя нет
+        with self._lock:
+            row = self._rows.get(str(chat_id))
+            if row is None:
+                return None
+            self._mark(np.array(self._user_rows[row], dtype=np.intp))
+            self._total_user(row)
+            return {
+                "balance": float(self.balance[row]),
+                "unrealized": float(self.unrealized[row]),
+                "equity": float(self.equity[row]),
+                "exposure": float(self.exposure[row]),
+                "unpriced": int(self.unpriced[row]),
+                "positions": [{
+                    "coin": self.symbols[self.symbol[i]],
+                    "side": "BUY" if self.side[i] > 0 else "SELL",
+                    "entry": float(self.entry[i]),
+                    "price": None if np.isnan(self.price[i]) else float(self.price[i]),
+                    "change": float(self.change[i]),
+                    "pnl": float(self.pnl[i]),
+                    "stop_loss": float(self.stop_loss[i]),
+                    "take_profit": float(self.take_profit[i]),
+                    "liquidation": float(self.liquidation[i]),
+                    "to_stop_loss": float(self.to_stop_loss[i]),
+                    "to_take_profit": float(self.to_take_profit[i]),
+                    "to_liquidation": float(self.to_liquidation[i]),
+                    "leverage": float(self.leverage[i]),
+                    "stake": float(self.stake[i]),
+                } for i in self._user_rows[row]],
+            }
+
+
+def format_summary(summary):
+    msg = "📈 Ваши позиции:\n"
+    for i, pos in enumerate(summary["positions"], start=1):
+        if pos["price"] is None:
+            msg += f"{i}. {pos['coin']}: Ошибка получения цены\n"
+            continue
+        msg += (
+            f"{i}. {pos['coin']} ({pos['side']})\n"
+            f"   Цена входа: {pos['entry']:.2f}\n"
+            f"   Текущая цена: {pos['price']:.2f}\n"
+            f"   Изменение: {pos['change'] * 100:+.1f}%, PnL: {pos['pnl']:+.2f} USDT\n"
+            f"   До SL: {pos['to_stop_loss'] * 100:.1f}%, до TP: {pos['to_take_profit'] * 100:.1f}%, "
+            f"до ликвидации: {pos['to_liquidation'] * 100:.1f}%\n"
+            f"   (Плечо: {pos['leverage']:g}x, Сумма: {pos['stake']:.2f} USDT, SL: {pos['stop_loss']:.2f}, TP: {pos['take_profit']:.2f})\n"
+        )
+    msg += (f"\nБаланс: {summary['balance']:.2f} USDT, нереализованный PnL: {summary['unrealized']:+.2f} USDT, "
+            f"эквити: {summary['equity']:.2f} USDT")
+    if summary["unpriced"]:
+        msg += f" (позиций без цены: {summary['unpriced']})"
+    return msg
+
+
+# Портфель Telegram-процесса: PriceCache только передаёт ему цены, а позиции пользователя
+# сверяются с хранилищем и пересчитываются при запросе (предупреждения отправляет бот)
+_portfolio = None
+_portfolio_lock = threading.Lock()
+
+def get_portfolio():
+    global _portfolio
+    if _portfolio is None:
+        with _portfolio_lock:
+            if _portfolio is None:
+                from price_cache import get_price_cache
+                portfolio = Portfolio()
+                get_price_cache().add_listener(portfolio.set_prices)
+                _portfolio = portfolio
+    return _portfolio
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from binance_api import get_client
+
+# Цены всех символов одним запросом ticker/price; обработчики читают их из памяти
+
+PRICE_TTL = 5
+
+
+class PriceCache:
+    def __init__(self, ttl=PRICE_TTL, client_factory=get_client):
+        self.ttl = ttl
+        self.client_factory = client_factory
+        self._prices = {}
+        self._updated = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        # callback(prices) после каждого обновления, в потоке, который обновил цены
+        self._listeners.append(callback)
+        if self._updated:
+            callback(self._prices)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="price-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def refresh(self):
+        # Один bulk-запрос на все символы; параллельные вызовы не дублируют запрос
+        with self._refresh_lock:
+            if time.monotonic() - self._updated < self.ttl / 2:
+                return
+            tickers = self.client_factory().get_all_tickers()
+            prices = {t["symbol"]: float(t["price"]) for t in tickers}
+            with self._lock:
+                self._prices = prices
+                self._updated = time.monotonic()
+            for callback in self._listeners:
+                callback(prices)
+
+    def age(self):
+        if not self._updated:
+            return None
+        return time.monotonic() - self._updated
+
+    def is_fresh(self):
+        age = self.age()
+        return age is not None and age <= self.ttl * 3
+
+    def get_price(self, symbol):
+        # Не блокирует: последняя известная цена или None
+        with self._lock:
+            return self._prices.get(symbol.upper())
+
+    def get_prices(self, symbols):
+        with self._lock:
+            return {symbol: self._prices.get(symbol.upper()) for symbol in symbols}
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Ошибка обновления цен: {e}")
+            self._stopping.wait(self.ttl)
+
+
+_price_cache = None
+
+def get_price_cache():
+    global _price_cache
+    if _price_cache is None:
+        _price_cache = PriceCache()
+        _price_cache.start()
+    return _price_cache
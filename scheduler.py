@@ -0,0 +1,43 @@
+import time
+
+from candle_store import INTERVAL_MS
+
+# Задержка после закрытия свечи, чтобы биржа успела её финализировать (секунды)
+CLOSE_DELAY = 2
+
+
+def closed_intervals(boundary_ms, intervals):
+    # Интервалы, свеча которых закрылась ровно на этой границе
+    return {interval for interval in intervals if boundary_ms % INTERVAL_MS[interval] == 0}
+
+
+class CandleScheduler:
+    # Срабатывает на границах закрытия свечей самого короткого интервала и сообщает,
+    # какие интервалы закрылись. Между границами поток просто спит.
+    def __init__(self, intervals, delay=CLOSE_DELAY, clock=time.time, sleep=time.sleep):
+        self.intervals = list(intervals)
+        self.step = min(INTERVAL_MS[interval] for interval in self.intervals)
+        self.delay = delay
+        self.clock = clock
+        self.sleep = sleep
+        self._last_boundary = None
+
+    def next_boundary(self, now_ms):
+        return (int(now_ms) // self.step + 1) * self.step
+
+    def wait_next(self):
+        # -> (граница в мс, множество закрывшихся интервалов)
+        boundary = self.next_boundary(self.clock() * 1000)
+        if self._last_boundary is not None and boundary <= self._last_boundary:
+            boundary = self._last_boundary + self.step
+        wait = boundary / 1000 + self.delay - self.clock()
+        if wait > 0:
+            self.sleep(wait)
+        due = closed_intervals(boundary, self.intervals)
+        if self._last_boundary is not None:
+            # Цикл затянулся дольше шага: закрытия пропущенных границ (15m, 1h) переходят
+            # в эту, иначе выходы по ним не проверялись бы до следующего закрытия
+            for skipped in range(self._last_boundary + self.step, boundary, self.step):
+                due |= closed_intervals(skipped, self.intervals)
+        self._last_boundary = boundary
+        return boundary, due
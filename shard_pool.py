@@ -0,0 +1,172 @@
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from candle_store import FIELDS
+from exit_rules import EXIT_LOOKBACK
+
+# Шардированная оценка пользователей: главный процесс один раз строит рыночный снимок
+# (сигналы входа и окна свечей для выходов) и кладёт его в общую память, а воркеры
+# обрабатывают каждый свою часть chat_id — выходы, закрытия в хранилище и тексты
+# сообщений — и возвращают сообщения главному процессу для отправки.
+
+EXIT_TIMEFRAMES = ("15m", "1h")
+SIGNAL_CODES = {None: 0, "BUY": 1, "SELL": -1}
+SIGNAL_NAMES = {code: name for name, code in SIGNAL_CODES.items()}
+
+# Массивы снимка в воркере: {"candles", "lengths", "entries"}
+_worker_arrays = None
+_worker_segments = []
+
+
+def snapshot_shapes(capacity):
+    return {
+        # Окна выхода, выровненные по правому краю; lengths — сколько свечей в окне (-1 — не загружено)
+        "candles": ((capacity, len(EXIT_TIMEFRAMES), len(FIELDS), EXIT_LOOKBACK), np.float64),
+        "lengths": ((capacity, len(EXIT_TIMEFRAMES)), np.int64),
+        # Сигнал входа (код SIGNAL_CODES, NaN — не считался) и цена закрытия
+        "entries": ((capacity, 2), np.float64),
+    }
+
+
+def attach_array(name, shape, dtype):
+    # Воркеры, запущенные через spawn, делят resource_tracker с главным процессом: повторная
+    # регистрация сегмента ничего не меняет, а удаляет его только ShardPool.close()
+    segment = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+    array.flags.writeable = False
+    return segment, array
+
+
+def init_worker(names, capacity):
+    global _worker_arrays
+    # Импорт bot (pandas, ta, telegram) — секунды; платим при старте пула, а не в первом цикле
+    import bot  # noqa: F401
+    _worker_arrays = {}
+    for key, (shape, dtype) in snapshot_shapes(capacity).items():
+        segment, array = attach_array(names[key], shape, dtype)
+        _worker_segments.append(segment)
+        _worker_arrays[key] = array
+
+
+class SharedSnapshot:
+    # Тот же интерфейс, что у bot.MarketSnapshot, но данные читаются из общей памяти
+    def __init__(self, symbols, arrays):
+        self.index = {symbol: i for i, symbol in enumerate(symbols)}
+        self.candles = arrays["candles"]
+        self.lengths = arrays["lengths"]
+        self.entries = arrays["entries"][:len(symbols)]
+
+    def exit_candles(self, symbol, timeframe, lookback=EXIT_LOOKBACK):
+        i, j = self.index[symbol], EXIT_TIMEFRAMES.index(timeframe)
+        n = self.lengths[i, j]
+        if n < 0:
+            raise KeyError(f"Окно {symbol} {timeframe} не опубликовано в снимке")
+        return self.candles[i, j, :, EXIT_LOOKBACK - min(n, lookback):]
+
+    def has_entry_signals(self):
+        codes = self.entries[:, 0]
+        return bool(np.any(codes[~np.isnan(codes)] != 0))
+
+    def entry_signal(self, symbol):
+        code, close = self.entries[self.index[symbol]]
+        if np.isnan(code):
+            return None, close
+        return SIGNAL_NAMES[int(code)], close
+
+
+def evaluate_shard(data, symbols, due, now):
+    import bot
+    bot.SYMBOLS = symbols
+    return bot.evaluate_users(data, SharedSnapshot(symbols, _worker_arrays), due, now)
+
+
+def shard_of(chat_id, shards):
+    # Стабильно между циклами и процессами (в отличие от hash() строк)
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+def split_user_data(data, shards):
+    sections = ("positions", "trading_modes", "notify_state")
+    parts = [{"balances": {}, **{section: {} for section in sections}} for _ in range(shards)]
+    for chat_id, balance in data.get("balances", {}).items():
+        part = parts[shard_of(chat_id, shards)]
+        part["balances"][chat_id] = balance
+        for section in sections:
+            if chat_id in data.get(section, {}):
+                part[section][chat_id] = data[section][chat_id]
+    return parts
+
+
+class ShardPool:
+    # workers процессов и сегменты общей памяти на capacity монет. Если список монет
+    # вырос сверх capacity, пул пересоздаётся с большими сегментами.
+    def __init__(self, workers, capacity):
+        self.workers = workers
+        self.capacity = 0
+        self._executor = None
+        self._segments = {}
+        self._arrays = {}
+        self._start(capacity)
+
+    def _start(self, capacity):
+        self.close()
+        self.capacity = capacity
+        for key, (shape, dtype) in snapshot_shapes(capacity).items():
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self._segments[key] = segment
+            self._arrays[key] = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        names = {key: segment.name for key, segment in self._segments.items()}
+        # spawn: воркеры не наследуют потоки главного процесса (отправка сообщений, kline-поток)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"),
+                                             initializer=init_worker, initargs=(names, capacity))
+        # Процессы создаются по мере отправки задач: запускаем все сразу
+        for future in [self._executor.submit(int) for _ in range(self.workers)]:
+            future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for segment in self._segments.values():
+            segment.close()
+            segment.unlink()
+        self._segments = {}
+        self._arrays = {}
+
+    def publish(self, snapshot, symbols):
+        if len(symbols) > self.capacity:
+            self._start(max(len(symbols), self.capacity * 2))
+        index = {symbol: i for i, symbol in enumerate(symbols)}
+        candles, lengths, entries = self._arrays["candles"], self._arrays["lengths"], self._arrays["entries"]
+        lengths[...] = -1
+        entries[...] = np.nan
+        for (symbol, timeframe), window in snapshot.loaded_exit_candles().items():
+            if symbol not in index or timeframe not in EXIT_TIMEFRAMES:
+                continue
+            i, j = index[symbol], EXIT_TIMEFRAMES.index(timeframe)
+            n = window.shape[1]
+            candles[i, j, :, EXIT_LOOKBACK - n:] = window
+            lengths[i, j] = n
+        for symbol, (signal, close) in snapshot.entry_signals().items():
+            if symbol in index:
+                entries[index[symbol]] = (SIGNAL_CODES[signal], close)
+
+    def evaluate(self, data, snapshot, symbols, due=None, now=None):
+        # Снимок публикуется до отправки задач и не меняется, пока воркеры не ответят.
+        # Результат — как у bot.evaluate_users, собранный по всем шардам
+        self.publish(snapshot, symbols)
+        futures = [self._executor.submit(evaluate_shard, part, list(symbols), due, now)
+                   for part in split_user_data(data, self.workers) if part["balances"]]
+        messages, states, suppressed, closed = [], {}, {"messages": 0, "bytes": 0}, {}
+        for future in futures:
+            shard_messages, shard_states, shard_suppressed, shard_closed = future.result()
+            messages.extend(shard_messages)
+            states.update(shard_states)
+            closed.update(shard_closed)
+            for key, value in shard_suppressed.items():
+                suppressed[key] += value
+        return messages, states, suppressed, closed
@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+
+# Журнал сигналов входа с ротацией по размеру. Каждый сегмент — каталог segment-NNNNNN с записями
+# JSON-строками в signals.log и бинарными индексами фиксированной ширины рядом с ними; при ротации
+# старый сегмент удаляется целиком вместе со своими индексами. Последние N записей (всех, по монете
+# или по пользователю) читаются с конца индексов от новых сегментов к старым, без чтения истории целиком.
+#   records.idx            — (номер записи, смещение в signals.log) для каждой записи сегмента
+#   symbol-<SYMBOL>.idx    — смещения записей по монете
+#   users-NN.idx           — (chat_id, смещение) для получателей, по корзинам crc32(chat_id)
+# Пишет только торговый цикл; Telegram-процесс читает. Сначала пишется запись, потом индексы,
+# поэтому индекс никогда не указывает на недописанную запись.
+
+LOCATION = struct.Struct("<qq")
+OFFSET = struct.Struct("<q")
+USER_ENTRY = struct.Struct("<qq")
+USER_BUCKETS = 64
+READ_BLOCK = 256
+
+
+def _iter_from_end(path, entry):
+    # Записи индекса с конца файла блоками по READ_BLOCK (новые первыми)
+    # Индекса может не быть: в сегменте нет записей по монете или сегмент только что удалён ротацией
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        # Хвост, который писатель ещё не дописал, отбрасываем
+        end = os.fstat(f.fileno()).st_size // entry.size
+        while end > 0:
+            start = max(0, end - READ_BLOCK)
+            f.seek(start * entry.size)
+            block = f.read((end - start) * entry.size)
+            yield from reversed(list(entry.iter_unpack(block)))
+            end = start
+
+
+def _append_entries(path, entries, entry):
+    # Неполная запись в конце (писатель упал посреди write) обрезается, иначе сместится всё дальнейшее
+    with open(path, "ab") as f:
+        size = f.tell()
+        if size % entry.size:
+            f.truncate(size - size % entry.size)
+            f.seek(0, os.SEEK_END)
+        f.write(b"".join(entries))
+
+
+def _user_bucket(chat_id):
+    return zlib.crc32(str(chat_id).encode()) % USER_BUCKETS
+
+
+class SignalJournal:
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, keep_segments=50):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_dir(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}")
+
+    def _segment_file(self, segment, name):
+        return os.path.join(self._segment_dir(segment), name)
+
+    def _segments(self):
+        return sorted(int(name[8:]) for name in os.listdir(self.directory)
+                      if name.startswith("segment-") and name[8:].isdigit())
+
+    def _user_index(self, segment, chat_id):
+        return self._segment_file(segment, f"users-{_user_bucket(chat_id):02d}.idx")
+
+    def _symbol_index(self, segment, symbol):
+        return self._segment_file(segment, f"symbol-{symbol.upper()}.idx")
+
+    def _next_seq(self, segments):
+        # Номер после последней записи; новый сегмент может быть ещё пуст (упали сразу после ротации)
+        for segment in reversed(segments):
+            for seq, _ in _iter_from_end(self._segment_file(segment, "records.idx"), LOCATION):
+                return seq + 1
+        return 0
+
+    def append(self, signals, recipients=None, ts=None):
+        # signals — [(symbol, side, entry, stop_loss, take_profit)];
+        # recipients — {symbol: [chat_id, ...]}, кому этот сигнал был отправлен
+        if not signals:
+            return []
+        recipients = recipients or {}
+        ts = int(ts if ts is not None else time.time() * 1000)
+        with self._lock:
+            segments = self._segments()
+            seq = self._next_seq(segments)
+            segment = segments[-1] if segments else 1
+            path = self._segment_file(segment, "signals.log")
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                segment += 1
+                path = self._segment_file(segment, "signals.log")
+                # От старых к новым: читатель, не нашедший сегмент, считает, что дальше назад истории нет
+                for old in segments[:max(0, len(segments) + 1 - self.keep_segments)]:
+                    shutil.rmtree(self._segment_dir(old), ignore_errors=True)
+            os.makedirs(self._segment_dir(segment), exist_ok=True)
+
+            locations = []
+            symbol_offsets = {}
+            user_entries = {}
+            with open(path, "ab") as f:
+                # Смещение считаем сами: tell() в режиме дозаписи — системный вызов на каждый сигнал
+                offset = f.tell()
+                for symbol, side, entry, stop_loss, take_profit in signals:
+                    chat_ids = recipients.get(symbol, [])
+                    line = json.dumps({
+                        "seq": seq, "ts": ts, "symbol": symbol, "side": side,
+                        "entry": float(entry), "stop_loss": float(stop_loss), "take_profit": float(take_profit),
+                        "recipients": len(chat_ids),
+                    }, ensure_ascii=False).encode() + b"\n"
+                    locations.append(LOCATION.pack(seq, offset))
+                    symbol_offsets.setdefault(symbol, []).append(OFFSET.pack(offset))
+                    for chat_id in chat_ids:
+                        user_entries.setdefault(_user_bucket(chat_id), []).append(USER_ENTRY.pack(int(chat_id), offset))
+                    f.write(line)
+                    offset += len(line)
+                    seq += 1
+                f.flush()
+                os.fsync(f.fileno())
+
+            _append_entries(self._segment_file(segment, "records.idx"), locations, LOCATION)
+            for symbol, offsets in symbol_offsets.items():
+                _append_entries(self._symbol_index(segment, symbol), offsets, OFFSET)
+            for bucket, entries in user_entries.items():
+                _append_entries(self._segment_file(segment, f"users-{bucket:02d}.idx"), entries, USER_ENTRY)
+        return list(range(seq - len(signals), seq))
+
+    def _segment_offsets(self, segment, chat_id, symbol):
+        # Смещения записей сегмента (новые первыми) по фильтру
+        if chat_id is not None:
+            return (offset for owner, offset in _iter_from_end(self._user_index(segment, chat_id), USER_ENTRY)
+                    if owner == chat_id)
+        if symbol is not None:
+            return (offset for (offset,) in _iter_from_end(self._symbol_index(segment, symbol), OFFSET))
+        return (offset for _, offset in _iter_from_end(self._segment_file(segment, "records.idx"), LOCATION))
+
+    def tail(self, limit=10, chat_id=None, symbol=None):
+        # Последние limit записей в хронологическом порядке; фильтр по пользователю и/или монете.
+        # Сегменты читаются от новых к старым, поэтому редкий получатель просматривает только
+        # хранящуюся историю, а не всё, что когда-либо писалось.
+        if chat_id is not None:
+            chat_id = int(chat_id)
+        records = []
+        for segment in reversed(self._segments()):
+            try:
+                f = open(self._segment_file(segment, "signals.log"), "rb")
+            except FileNotFoundError:
+                # Ротация удалила сегмент во время чтения: старше истории нет
+                break
+            with f:
+                for offset in self._segment_offsets(segment, chat_id, symbol):
+                    f.seek(offset)
+                    record = json.loads(f.readline())
+                    if symbol is not None and record["symbol"] != symbol.upper():
+                        continue
+                    records.append(record)
+                    if len(records) == limit:
+                        return list(reversed(records))
+        return list(reversed(records))
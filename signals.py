@@ -0,0 +1,81 @@
+import numpy as np
+
+from config import SIGNAL_PARAMS
+
+# Векторная версия check_trade_signal_extended: решения по всем символам за один проход
+
+VOLUME_WINDOW = 20
+RESISTANCE_WINDOW = 20
+
+FEATURES = ("close", "volume", "SMA_50", "SMA_200", "RSI", "ATR", "volume_mean_20", "close_max_20")
+
+
+def signal_votes(close, volume, sma50, sma200, rsi, atr, volume_mean, close_max, params=None):
+    # Все аргументы — массивы одинаковой формы; NaN даёт False, как и в скалярной версии
+    params = {**SIGNAL_PARAMS, **(params or {})}
+    atr_condition = atr / close > params["atr_threshold"]
+    volume_spike = volume > params["volume_spike"] * volume_mean
+    resistance = params["resistance_factor"] * close_max
+    buy_votes = (
+        (rsi < params["rsi_buy"]).astype(np.int8)
+        + (close > sma50)
+        + (close > sma200)
+        + volume_spike
+        + (close < resistance)
+        + atr_condition
+    )
+    sell_votes = (
+        (rsi > params["rsi_sell"]).astype(np.int8)
+        + (close < sma50)
+        + (close < sma200)
+        + volume_spike
+        + (close > resistance)
+        + atr_condition
+    )
+    return buy_votes, sell_votes
+
+
+def decide_signals(close, volume, sma50, sma200, rsi, atr, volume_mean, close_max, params=None):
+    required_confirmations = {**SIGNAL_PARAMS, **(params or {})}["required_confirmations"]
+    buy_votes, sell_votes = signal_votes(close, volume, sma50, sma200, rsi, atr, volume_mean, close_max, params)
+    decisions = np.full(np.shape(close), None, dtype=object)
+    sell = sell_votes >= required_confirmations
+    buy = buy_votes >= required_confirmations
+    decisions[sell] = "SELL"
+    # BUY имеет приоритет, как в check_trade_signal_extended
+    decisions[buy] = "BUY"
+    return decisions
+
+
+def decide_signals_from_values(rows, params=None):
+    # rows — список словарей значений последней свечи (как у IndicatorEngine.update)
+    if not rows:
+        return np.empty(0, dtype=object)
+    matrix = np.array([[row[name] for name in FEATURES] for row in rows], dtype=np.float64)
+    return decide_signals(*matrix.T, params=params)
+
+
+def check_trade_signals_batch(close, volume, sma50, sma200, rsi, atr, params=None):
+    # Матрицы (symbols, bars) с выравниванием по последней свече; короткая история
+    # дополняется слева NaN. Возвращает решение по последней свече каждого символа.
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    # Окна без NaN, как rolling(20) в pandas: иначе NaN и голос не засчитывается
+    volume_mean = volume[:, -VOLUME_WINDOW:].mean(axis=1) if volume.shape[1] >= VOLUME_WINDOW else np.full(len(volume), np.nan)
+    close_max = close[:, -RESISTANCE_WINDOW:].max(axis=1) if close.shape[1] >= RESISTANCE_WINDOW else np.full(len(close), np.nan)
+    return decide_signals(
+        close[:, -1], volume[:, -1],
+        np.asarray(sma50)[:, -1], np.asarray(sma200)[:, -1],
+        np.asarray(rsi)[:, -1], np.asarray(atr)[:, -1],
+        volume_mean, close_max, params,
+    )
+
+
+def stack_aligned(series, width):
+    # Список одномерных массивов разной длины -> матрица (len(series), width), выровненная по концу
+    matrix = np.full((len(series), width), np.nan)
+    for i, values in enumerate(series):
+        values = np.asarray(values, dtype=np.float64)[-width:]
+        if len(values):
+            matrix[i, width - len(values):] = values
+    return matrix
@@ -0,0 +1,529 @@
+import fcntl
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import metrics
+from trade_ledger import make_trade, stats_from_trades, update_stats
+
+# Хранилища данных пользователей. Оба бэкенда реализуют один и тот же набор методов,
+# config.py выбирает нужный по STORAGE_BACKEND.
+
+SECTIONS = ("balances", "positions", "trades", "trading_modes", "trade_stats", "notify_state")
+DEFAULT_MODE = "long"
+
+
+def empty_user_data():
+    return {section: {} for section in SECTIONS}
+
+
+class JSONStorage:
+    # Весь user_data.json целиком; чтение-изменение-запись под межпроцессной блокировкой
+    # файла, запись атомарная через временный файл
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._thread_lock = threading.RLock()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                try:
+                    data = json.load(f)
+                except Exception:
+                    data = {}
+        for section in SECTIONS:
+            data.setdefault(section, {})
+        return data
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".user_data.", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def transaction(self):
+        with self._locked():
+            data = self._read()
+            yield data
+            self._write(data)
+
+    def load_user_data(self):
+        return self._read()
+
+    def load_cycle_data(self):
+        # Для торгового цикла: без истории сделок, которая ему не нужна и растёт без ограничений
+        data = self._read()
+        data["trades"] = {}
+        data["trade_stats"] = {}
+        return data
+
+    def save_user_data(self, data):
+        with self._locked():
+            self._write(data)
+
+    def list_chat_ids(self):
+        return list(self._read()["balances"].keys())
+
+    def get_balance(self, chat_id):
+        return self._read()["balances"].get(str(chat_id), 0)
+
+    def set_balance(self, chat_id, amount):
+        with self.transaction() as data:
+            data["balances"][str(chat_id)] = amount
+
+    def load_positions(self, chat_id):
+        return self._read()["positions"].get(str(chat_id), [])
+
+    def save_positions(self, chat_id, positions):
+        with self.transaction() as data:
+            data["positions"][str(chat_id)] = positions
+
+    def append_position(self, chat_id, position):
+        with self.transaction() as data:
+            data["positions"].setdefault(str(chat_id), []).append(position)
+
+    def remove_position(self, chat_id, index):
+        # index — номер с 1, как в списке у пользователя. None — такой позиции уже нет
+        with self.transaction() as data:
+            positions = data["positions"].get(str(chat_id), [])
+            if index < 1 or index > len(positions):
+                return None
+            return positions.pop(index - 1)
+
+    def load_trades(self, chat_id, limit=None):
+        trades = self._read()["trades"].get(str(chat_id), [])
+        return trades[-limit:] if limit else trades
+
+    def save_trade(self, chat_id, trade):
+        with self.transaction() as data:
+            data["trades"].setdefault(str(chat_id), []).append(trade)
+
+    @staticmethod
+    def _record_trade(data, chat_id, trade):
+        # Сделка и статистика в одной записи; баланс к этому моменту уже изменён на trade["pnl"]
+        balance = data["balances"].get(chat_id, 0)
+        trades = data["trades"].setdefault(chat_id, [])
+        stats = data["trade_stats"].get(chat_id) or stats_from_trades(trades, balance - trade["pnl"])
+        trades.append(trade)
+        data["trade_stats"][chat_id] = update_stats(stats, trade, balance)
+
+    def add_trade(self, chat_id, trade):
+        # Сделка, введённая вручную: баланс, история и статистика одной записью. Возвращает новый баланс
+        chat_id = str(chat_id)
+        with self.transaction() as data:
+            data["balances"][chat_id] = data["balances"].get(chat_id, 0) + trade["pnl"]
+            self._record_trade(data, chat_id, trade)
+            return data["balances"][chat_id]
+
+    def get_trade_stats(self, chat_id):
+        data = self._read()
+        stats = data["trade_stats"].get(str(chat_id))
+        if stats is None:
+            stats = stats_from_trades(data["trades"].get(str(chat_id), []), data["balances"].get(str(chat_id), 0))
+        return stats
+
+    def get_trading_mode(self, chat_id):
+        return self._read()["trading_modes"].get(str(chat_id), DEFAULT_MODE)
+
+    def set_trading_mode(self, chat_id, mode):
+        with self.transaction() as data:
+            data["trading_modes"][str(chat_id)] = mode
+
+    def save_notify_states(self, states):
+        # states — {chat_id: состояние уведомлений} изменившихся за цикл пользователей, одной записью
+        with self.transaction() as data:
+            for chat_id, state in states.items():
+                data["notify_state"][str(chat_id)] = state
+
+    def close_position(self, chat_id, coin, profit_loss, exit_price=None, reason="manual"):
+        # Удаление позиции, изменение баланса и запись сделки одной записью. None — позиции уже нет
+        # (например, пользователь удалил её сам), баланс тогда не меняется.
+        return self.apply_closes([(chat_id, coin, profit_loss, exit_price, reason)])[(str(chat_id), coin)]
+
+    def apply_closes(self, closes):
+        # closes — [(chat_id, coin, profit_loss, exit_price, reason)]; все закрытия цикла одной записью файла.
+        # Возвращает {(chat_id, coin): новый баланс или None, если позиции уже нет}
+        results = {}
+        with self.transaction() as data:
+            for chat_id, coin, profit_loss, exit_price, reason in closes:
+                chat_id = str(chat_id)
+                positions = data["positions"].get(chat_id, [])
+                remaining = [p for p in positions if p["coin"].upper() != coin.upper()]
+                if len(remaining) == len(positions):
+                    results[(chat_id, coin)] = None
+                    continue
+                closed = next(p for p in positions if p["coin"].upper() == coin.upper())
+                data["positions"][chat_id] = remaining
+                data["balances"][chat_id] = data["balances"].get(chat_id, 0) + profit_loss
+                self._record_trade(data, chat_id, make_trade(closed, exit_price, profit_loss, reason))
+                results[(chat_id, coin)] = data["balances"][chat_id]
+        return results
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    chat_id TEXT PRIMARY KEY,
+    balance REAL,
+    trading_mode TEXT
+);
+CREATE TABLE IF NOT EXISTS positions (
+    chat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    coin TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (chat_id, seq)
+);
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    trade TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trades_chat_id ON trades (chat_id, id);
+CREATE TABLE IF NOT EXISTS trade_stats (
+    chat_id TEXT PRIMARY KEY,
+    stats TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notify_state (
+    chat_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SQLiteStorage:
+    # SQLite в режиме WAL: строка на пользователя, позиции и сделки отдельными строками.
+    # Каждая операция — одна транзакция; записи из бота и из Telegram-процесса
+    # сериализуются блокировкой базы, а не перезаписью общего файла.
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._init_schema()
+        if json_path:
+            self.migrate_from_json(json_path)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _conn(self):
+        # Соединение на поток; после fork (multiprocessing) открываем новое
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        for statement in SCHEMA.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @contextmanager
+    def snapshot(self):
+        # Чтение нескольких таблиц одним снимком WAL: запись, закоммиченная Telegram-процессом
+        # между SELECT, не даст позиций, не согласованных с балансами
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    def migrate_from_json(self, json_path):
+        # Однократный перенос user_data.json; повторный запуск (в том числе из второго процесса) ничего не делает
+        if not os.path.exists(json_path):
+            return False
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone():
+                return False
+            data = JSONStorage(json_path).load_user_data()
+            self._replace_all(conn, data)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)", (json_path,))
+        return True
+
+    def _replace_all(self, conn, data):
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM positions")
+        conn.execute("DELETE FROM trades")
+        conn.execute("DELETE FROM trade_stats")
+        conn.execute("DELETE FROM notify_state")
+        chat_ids = set(data.get("balances", {})) | set(data.get("trading_modes", {}))
+        for chat_id in chat_ids:
+            conn.execute(
+                "INSERT INTO users (chat_id, balance, trading_mode) VALUES (?, ?, ?)",
+                (str(chat_id), data.get("balances", {}).get(chat_id), data.get("trading_modes", {}).get(chat_id)),
+            )
+        for chat_id, positions in data.get("positions", {}).items():
+            self._write_positions(conn, chat_id, positions)
+        for chat_id, trades in data.get("trades", {}).items():
+            conn.executemany(
+                "INSERT INTO trades (chat_id, trade) VALUES (?, ?)",
+                [(str(chat_id), json.dumps(trade, ensure_ascii=False)) for trade in trades],
+            )
+        conn.executemany(
+            "INSERT INTO trade_stats (chat_id, stats) VALUES (?, ?)",
+            [(str(chat_id), json.dumps(stats)) for chat_id, stats in data.get("trade_stats", {}).items()],
+        )
+        self._write_notify_states(conn, data.get("notify_state", {}))
+
+    @staticmethod
+    def _write_notify_states(conn, states):
+        conn.executemany(
+            "INSERT INTO notify_state (chat_id, state) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET state = excluded.state",
+            [(str(chat_id), json.dumps(state, separators=(",", ":"))) for chat_id, state in states.items()],
+        )
+
+    @staticmethod
+    def _write_positions(conn, chat_id, positions):
+        conn.execute("DELETE FROM positions WHERE chat_id = ?", (str(chat_id),))
+        conn.executemany(
+            "INSERT INTO positions (chat_id, seq, coin, data) VALUES (?, ?, ?, ?)",
+            [(str(chat_id), seq, p["coin"].upper(), json.dumps(p, ensure_ascii=False)) for seq, p in enumerate(positions)],
+        )
+
+    def load_user_data(self):
+        with self.snapshot() as conn:
+            data = self._read_cycle_data(conn)
+            for chat_id, raw in conn.execute("SELECT chat_id, trade FROM trades ORDER BY id"):
+                data["trades"].setdefault(chat_id, []).append(json.loads(raw))
+            for chat_id, raw in conn.execute("SELECT chat_id, stats FROM trade_stats"):
+                data["trade_stats"][chat_id] = json.loads(raw)
+        return data
+
+    def load_cycle_data(self):
+        # Для торгового цикла: балансы, режимы, позиции и notify_state без таблиц сделок
+        with self.snapshot() as conn:
+            return self._read_cycle_data(conn)
+
+    @staticmethod
+    def _read_cycle_data(conn):
+        data = empty_user_data()
+        for chat_id, balance, mode in conn.execute("SELECT chat_id, balance, trading_mode FROM users"):
+            if balance is not None:
+                data["balances"][chat_id] = balance
+            if mode is not None:
+                data["trading_modes"][chat_id] = mode
+        for chat_id, raw in conn.execute("SELECT chat_id, data FROM positions ORDER BY chat_id, seq"):
+            data["positions"].setdefault(chat_id, []).append(json.loads(raw))
+        for chat_id, raw in conn.execute("SELECT chat_id, state FROM notify_state"):
+            data["notify_state"][chat_id] = json.loads(raw)
+        return data
+
+    def save_user_data(self, data):
+        with self.transaction() as conn:
+            self._replace_all(conn, data)
+
+    def list_chat_ids(self):
+        rows = self._conn().execute("SELECT chat_id FROM users WHERE balance IS NOT NULL")
+        return [chat_id for (chat_id,) in rows]
+
+    def get_balance(self, chat_id):
+        row = self._conn().execute("SELECT balance FROM users WHERE chat_id = ?", (str(chat_id),)).fetchone()
+        if row is None or row[0] is None:
+            return 0
+        return row[0]
+
+    def set_balance(self, chat_id, amount):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO users (chat_id, balance) VALUES (?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET balance = excluded.balance",
+                (str(chat_id), amount),
+            )
+
+    def load_positions(self, chat_id):
+        rows = self._conn().execute("SELECT data FROM positions WHERE chat_id = ? ORDER BY seq", (str(chat_id),))
+        return [json.loads(raw) for (raw,) in rows]
+
+    def save_positions(self, chat_id, positions):
+        with self.transaction() as conn:
+            self._write_positions(conn, chat_id, positions)
+
+    def append_position(self, chat_id, position):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO positions (chat_id, seq, coin, data) "
+                "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ? FROM positions WHERE chat_id = ?",
+                (str(chat_id), position["coin"].upper(), json.dumps(position, ensure_ascii=False), str(chat_id)),
+            )
+
+    def remove_position(self, chat_id, index):
+        # index — номер с 1, как в списке у пользователя. None — такой позиции уже нет
+        if index < 1:
+            return None
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT seq, data FROM positions WHERE chat_id = ? ORDER BY seq LIMIT 1 OFFSET ?", (str(chat_id), index - 1)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM positions WHERE chat_id = ? AND seq = ?", (str(chat_id), row[0]))
+            return json.loads(row[1])
+
+    def load_trades(self, chat_id, limit=None):
+        if not limit:
+            rows = self._conn().execute("SELECT trade FROM trades WHERE chat_id = ? ORDER BY id", (str(chat_id),))
+            return [json.loads(raw) for (raw,) in rows]
+        rows = self._conn().execute(
+            "SELECT trade FROM trades WHERE chat_id = ? ORDER BY id DESC LIMIT ?", (str(chat_id), limit)
+        ).fetchall()
+        return [json.loads(raw) for (raw,) in reversed(rows)]
+
+    def save_trade(self, chat_id, trade):
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO trades (chat_id, trade) VALUES (?, ?)", (str(chat_id), json.dumps(trade, ensure_ascii=False)))
+
+    @staticmethod
+    def _balance(conn, chat_id):
+        row = conn.execute("SELECT balance FROM users WHERE chat_id = ?", (str(chat_id),)).fetchone()
+        return row[0] if row is not None and row[0] is not None else 0
+
+    def _stats(self, conn, chat_id, balance):
+        row = conn.execute("SELECT stats FROM trade_stats WHERE chat_id = ?", (str(chat_id),)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        # Статистики ещё нет — однократно считаем по уже записанным сделкам
+        rows = conn.execute("SELECT trade FROM trades WHERE chat_id = ? ORDER BY id", (str(chat_id),))
+        return stats_from_trades([json.loads(raw) for (raw,) in rows], balance)
+
+    def _record_trade(self, conn, chat_id, trade):
+        # Баланс к этому моменту уже изменён на trade["pnl"]
+        balance = self._balance(conn, chat_id)
+        stats = update_stats(self._stats(conn, chat_id, balance - trade["pnl"]), trade, balance)
+        conn.execute("INSERT INTO trades (chat_id, trade) VALUES (?, ?)", (str(chat_id), json.dumps(trade, ensure_ascii=False)))
+        conn.execute(
+            "INSERT INTO trade_stats (chat_id, stats) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET stats = excluded.stats",
+            (str(chat_id), json.dumps(stats)),
+        )
+
+    def add_trade(self, chat_id, trade):
+        # Сделка, введённая вручную: баланс, история и статистика в одной транзакции. Возвращает новый баланс
+        with self.transaction() as conn:
+            self._add_balance(conn, chat_id, trade["pnl"])
+            self._record_trade(conn, chat_id, trade)
+            return self._balance(conn, chat_id)
+
+    def get_trade_stats(self, chat_id):
+        conn = self._conn()
+        return self._stats(conn, chat_id, self._balance(conn, chat_id))
+
+    def get_trading_mode(self, chat_id):
+        row = self._conn().execute("SELECT trading_mode FROM users WHERE chat_id = ?", (str(chat_id),)).fetchone()
+        if row is None or row[0] is None:
+            return DEFAULT_MODE
+        return row[0]
+
+    def set_trading_mode(self, chat_id, mode):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO users (chat_id, trading_mode) VALUES (?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET trading_mode = excluded.trading_mode",
+                (str(chat_id), mode),
+            )
+
+    def save_notify_states(self, states):
+        # states — {chat_id: состояние уведомлений} изменившихся за цикл пользователей, одной транзакцией
+        with self.transaction() as conn:
+            self._write_notify_states(conn, states)
+
+    def close_position(self, chat_id, coin, profit_loss, exit_price=None, reason="manual"):
+        # Удаление позиции, изменение баланса и запись сделки в одной транзакции. None — позиции уже нет
+        # (например, пользователь удалил её сам), баланс тогда не меняется.
+        with self.transaction() as conn:
+            return self._close(conn, chat_id, coin, profit_loss, exit_price, reason)
+
+    def apply_closes(self, closes):
+        # closes — [(chat_id, coin, profit_loss, exit_price, reason)]; все закрытия цикла одной транзакцией.
+        # Возвращает {(chat_id, coin): новый баланс или None, если позиции уже нет}
+        with self.transaction() as conn:
+            return {(str(chat_id), coin): self._close(conn, chat_id, coin, *rest) for chat_id, coin, *rest in closes}
+
+    @staticmethod
+    def _add_balance(conn, chat_id, amount):
+        conn.execute(
+            "INSERT INTO users (chat_id, balance) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET balance = COALESCE(balance, 0) + ?",
+            (str(chat_id), amount, amount),
+        )
+
+    def _close(self, conn, chat_id, coin, profit_loss, exit_price, reason):
+        rows = conn.execute(
+            "SELECT data FROM positions WHERE chat_id = ? AND coin = ? ORDER BY seq", (str(chat_id), coin.upper())
+        ).fetchall()
+        if not rows:
+            return None
+        conn.execute("DELETE FROM positions WHERE chat_id = ? AND coin = ?", (str(chat_id), coin.upper()))
+        self._add_balance(conn, chat_id, profit_loss)
+        self._record_trade(conn, chat_id, make_trade(json.loads(rows[0][0]), exit_price, profit_loss, reason))
+        return self._balance(conn, chat_id)
+
+
+READ_METHODS = {"load_user_data", "load_cycle_data", "list_chat_ids", "get_balance", "load_positions", "load_trades",
+                "get_trading_mode", "get_trade_stats"}
+
+
+class InstrumentedStorage:
+    # Число и время чтений/записей для metrics; при выключенных метриках методы отдаются как есть
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if not metrics.enabled() or name.startswith("_") or not callable(attr) or name == "transaction":
+            return attr
+        op = "read" if name in READ_METHODS else "write"
+
+        def call(*args, **kwargs):
+            metrics.inc("storage_operations_total", op=op, method=name)
+            with metrics.span("storage_operation_seconds", op=op):
+                return attr(*args, **kwargs)
+        return call
+
+
+def create_storage(backend, json_path, db_path):
+    if backend == "sqlite":
+        return InstrumentedStorage(SQLiteStorage(db_path, json_path=json_path))
+    if backend == "json":
+        return InstrumentedStorage(JSONStorage(json_path))
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
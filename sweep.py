@@ -0,0 +1,173 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtest import backtest_symbol, entry_features, load_history, summarize
+from config import SYMBOLS, SIGNAL_PARAMS, STOP_LOSS_PERCENT, TAKE_PROFIT_PERCENT
+
+# Перебор порогов сигнала и SL/TP по истории на всех ядрах. Свечи и индикаторы
+# лежат в общей памяти и читаются процессами без копирования и pickle.
+# python sweep.py --data-dir data --mode scalp --param rsi_buy=25,30,35 --param stop_loss_percent=1,2,3
+# python sweep.py --data-dir data --random 200
+
+DEFAULT_GRID = {
+    "rsi_buy": [25, 30, 35],
+    "rsi_sell": [65, 70, 75],
+    "volume_spike": [1.2, 1.5, 2.0],
+    "resistance_factor": [0.97, 0.98, 0.99],
+    "atr_threshold": [0.005, 0.01],
+    "required_confirmations": [2, 3, 4],
+    "stop_loss_percent": [1, 2, 3],
+    "take_profit_percent": [3, 6, 9],
+}
+
+RISK_PARAMS = ("stop_loss_percent", "take_profit_percent")
+
+# Массивы текущего процесса-воркера: {symbol: (entry_candles, exit_candles, features)}
+_worker_arrays = None
+_worker_segments = []
+
+
+def share_array(array):
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    name, shape, dtype = spec
+    # Воркеры (fork) делят resource_tracker с главным процессом: повторная регистрация сегмента
+    # ничего не меняет, а удаляет его только run_sweep (или трекер, если родитель упал)
+    segment = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+    array.flags.writeable = False
+    return segment, array
+
+
+def init_worker(specs):
+    global _worker_arrays
+    _worker_arrays = {}
+    for symbol, symbol_specs in specs.items():
+        arrays = []
+        for spec in symbol_specs:
+            segment, array = attach_array(spec)
+            _worker_segments.append(segment)
+            arrays.append(array)
+        _worker_arrays[symbol] = tuple(arrays)
+
+
+def evaluate(combo, stake, leverage, balance):
+    params = {k: v for k, v in combo.items() if k not in RISK_PARAMS}
+    trades = []
+    for symbol, (entry_candles, exit_candles, features) in _worker_arrays.items():
+        trades.extend(backtest_symbol(
+            symbol, entry_candles, exit_candles, stake, leverage, params,
+            combo.get("stop_loss_percent", STOP_LOSS_PERCENT),
+            combo.get("take_profit_percent", TAKE_PROFIT_PERCENT),
+            features,
+        ))
+    return combo, summarize(trades, balance)
+
+
+def grid_combinations(grid):
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_combinations(grid, count, seed=0):
+    rnd = random.Random(seed)
+    seen = set()
+    total = int(np.prod([len(values) for values in grid.values()]))
+    while len(seen) < min(count, total):
+        combo = {name: rnd.choice(values) for name, values in grid.items()}
+        key = tuple(combo.values())
+        if key not in seen:
+            seen.add(key)
+            yield combo
+
+
+def parse_param(text):
+    name, _, values = text.partition("=")
+    if name not in SIGNAL_PARAMS and name not in RISK_PARAMS:
+        raise argparse.ArgumentTypeError(f"Неизвестный параметр: {name}")
+    return name, [float(v) if "." in v else int(v) for v in values.split(",")]
+
+
+def run_sweep(history, combos, workers=None, stake=100.0, leverage=1.0, balance=1000.0, sort_by="pnl"):
+    segments = []
+    specs = {}
+    try:
+        for symbol, (entry_candles, exit_candles) in history.items():
+            symbol_specs = []
+            for array in (entry_candles, exit_candles, entry_features(entry_candles)):
+                segment, spec = share_array(np.ascontiguousarray(array))
+                segments.append(segment)
+                symbol_specs.append(spec)
+            specs[symbol] = symbol_specs
+        results = []
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_worker, initargs=(specs,)) as pool:
+            futures = [pool.submit(evaluate, combo, stake, leverage, balance) for combo in combos]
+            for done, future in enumerate(as_completed(futures), start=1):
+                combo, summary = future.result()
+                results.append({**combo, **summary})
+                if done % 50 == 0:
+                    print(f"Готово {done}/{len(futures)}")
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    results.sort(key=lambda row: row[sort_by], reverse=sort_by != "max_drawdown")
+    return results
+
+
+def write_results(results, path):
+    if not results:
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["rank"] + list(results[0]))
+        writer.writeheader()
+        for rank, row in enumerate(results, start=1):
+            writer.writerow({"rank": rank, **row})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перебор параметров сигнала по истории")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--mode", choices=["long", "scalp"], default="long")
+    parser.add_argument("--symbols", nargs="*", default=SYMBOLS)
+    parser.add_argument("--param", action="append", type=parse_param, default=[],
+                        help="имя=значение1,значение2,... (заменяет сетку по умолчанию для этого параметра)")
+    parser.add_argument("--random", type=int, default=0, help="случайная выборка N комбинаций вместо полной сетки")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--stake", type=float, default=100.0)
+    parser.add_argument("--leverage", type=float, default=1.0)
+    parser.add_argument("--balance", type=float, default=1000.0)
+    parser.add_argument("--sort-by", choices=["pnl", "win_rate", "max_drawdown", "final_balance"], default="pnl")
+    parser.add_argument("--output", default="sweep_results.csv")
+    args = parser.parse_args()
+
+    grid = dict(DEFAULT_GRID)
+    grid.update(dict(args.param))
+    combos = list(random_combinations(grid, args.random, args.seed) if args.random else grid_combinations(grid))
+
+    started = time.perf_counter()
+    history = load_history(args.data_dir, args.symbols, args.mode)
+    print(f"Комбинаций: {len(combos)}, символов: {len(history)}")
+    results = run_sweep(history, combos, args.workers, args.stake, args.leverage, args.balance, args.sort_by)
+    write_results(results, args.output)
+    print(f"Результаты: {args.output} ({time.perf_counter() - started:.1f} c)")
+    for row in results[:5]:
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
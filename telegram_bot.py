@@ -1,10 +1,196 @@
+import queue
+import random
+import threading
+import time
+
 import requests
-from config import TELEGRAM_TOKEN
+from requests.adapters import HTTPAdapter
+
+import metrics
+from config import TELEGRAM_TOKEN, TELEGRAM_API_URL
+
+# Ограничения Telegram Bot API: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+
+_session = requests.Session()
 
 def send_telegram_message(message, chat_id):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
     payload = {"chat_id": chat_id, "text": message}
     try:
-        requests.post(url, data=payload)
+        response = _session.post(url, data=payload, timeout=10)
+        if response.status_code != 200:
+            print(f"Ошибка при отправке сообщения: HTTP {response.status_code} {response.text[:200]}")
     except Exception as e:
         print(f"Ошибка при отправке сообщения: {e}")
+
+
+class TokenBucket:
+    # rate токенов в секунду, не больше burst в запасе; acquire ждёт, пока токен не появится
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        # Никто не получает токен seconds секунд, запас после паузы копится заново
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class NotificationDispatcher:
+    # Отправка сообщений из торгового цикла в фоне: send() только кладёт сообщение в очередь.
+    # Рабочие потоки шлют через общий пул keep-alive соединений. Чат всегда обслуживает
+    # один и тот же поток, поэтому порядок сообщений в чате сохраняется.
+    def __init__(self, token=TELEGRAM_TOKEN, base_url=TELEGRAM_API_URL, workers=8,
+                 global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, max_retries=5):
+        self.url = f"{base_url}/bot{token}/sendMessage"
+        self.workers = workers
+        self.max_retries = max_retries
+        self.chat_rate = chat_rate
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "queued": 0, "sent": 0, "failed": 0, "retries": 0, "rate_limited": 0,
+            "latency_total": 0.0, "max_queue_depth": 0,
+        }
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.monotonic()
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(q,), name=f"telegram-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.flush(timeout)
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def send(self, message, chat_id):
+        q = self._queues[hash(str(chat_id)) % self.workers]
+        q.put((chat_id, message))
+        with self._stats_lock:
+            self._stats["queued"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self.queue_depth())
+        metrics.set_gauge("telegram_queue_depth", self.queue_depth())
+
+    def flush(self, timeout=None):
+        # Ждём, пока очередь опустеет (например, в конце цикла или перед остановкой)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for q in self._queues:
+            if deadline is None:
+                q.join()
+                continue
+            while q.unfinished_tasks and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        stats["queue_depth"] = self.queue_depth()
+        stats["throughput"] = stats["sent"] / elapsed if elapsed else 0.0
+        stats["avg_latency"] = stats["latency_total"] / stats["sent"] if stats["sent"] else 0.0
+        del stats["latency_total"]
+        return stats
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, burst=1))
+        return bucket
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    return
+                self._deliver(*item)
+            finally:
+                q.task_done()
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def _deliver(self, chat_id, message):
+        payload = {"chat_id": chat_id, "text": message}
+        for attempt in range(self.max_retries + 1):
+            self._chat_bucket(str(chat_id)).acquire()
+            self.global_bucket.acquire()
+            started = time.monotonic()
+            try:
+                response = self.session.post(self.url, data=payload, timeout=10)
+            except requests.RequestException as e:
+                delay = min(30, 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"Ошибка при отправке сообщения в {chat_id}: {e}. Повтор через {delay:.1f} c.")
+            else:
+                if response.status_code == 200:
+                    elapsed = time.monotonic() - started
+                    self._count("sent")
+                    self._count("latency_total", elapsed)
+                    metrics.inc("telegram_messages_total", status="sent")
+                    metrics.observe("telegram_send_seconds", elapsed)
+                    return True
+                if response.status_code == 429:
+                    self._count("rate_limited")
+                    metrics.inc("telegram_messages_total", status="rate_limited")
+                    try:
+                        retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                    except ValueError:
+                        retry_after = 1
+                    # Лимит общий для бота: паузу выдерживают все потоки, а не только этот.
+                    # Саму паузу выдержит global_bucket.acquire перед следующей попыткой
+                    self.global_bucket.pause(retry_after)
+                    delay = 0
+                elif response.status_code >= 500:
+                    delay = min(30, 2 ** attempt) * random.uniform(0.5, 1.5)
+                else:
+                    # 400/403 (чат не найден, бот заблокирован) повторять бессмысленно
+                    print(f"Ошибка при отправке сообщения в {chat_id}: HTTP {response.status_code} {response.text[:200]}")
+                    break
+            if attempt < self.max_retries:
+                self._count("retries")
+                metrics.inc("telegram_retries_total")
+                if delay:
+                    time.sleep(delay)
+        self._count("failed")
+        metrics.inc("telegram_messages_total", status="failed")
+        return False
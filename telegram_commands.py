@@ -1,31 +1,85 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CommandHandler, MessageHandler, TypeHandler, filters, CallbackContext
+)
 from config import (
-    TELEGRAM_TOKEN,
+    TELEGRAM_TOKEN, METRICS_PORT, TELEGRAM_CONCURRENT_UPDATES, TELEGRAM_IO_THREADS,
     get_balance, set_balance,
     get_signals_history, get_trades_history,
-    save_trade, enable_signals,
-    load_positions, save_positions, calc_sl_tp, set_trading_mode, get_trading_mode
+    add_trade, get_trade_stats_text, enable_signals,
+    load_positions, append_position, remove_position, calc_sl_tp, set_trading_mode, get_trading_mode
 )
-from binance.client import Client
-import pandas as pd
-import ta
+from binance_api import get_client
+from candle_store import CLOSE
+from kline_cache import get_kline_cache
+from price_cache import get_price_cache
+from portfolio import format_summary, get_portfolio
+from trade_ledger import manual_trade, now_ms
+from metrics import start_metrics_server, inc
 
 # Локальные словари для отслеживания состояний по chat_id
 user_trade_mode = {}
 position_creation = {}
 
+# Обработчики не вызывают хранилище и Binance напрямую: синхронные вызовы идут через
+# asyncio.to_thread (пул потоков цикла событий, TELEGRAM_IO_THREADS), чтобы медленная запись
+# или запрос к бирже одного пользователя не останавливали обработку остальных.
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Апдейты разных чатов обрабатываются параллельно (до max_concurrent_updates), а апдейты
+    # одного чата — строго по очереди: диалоги добавления позиции и сделки зависят от порядка.
+    # Семафор базового класса берётся до do_process_update и под нагрузкой может пропустить
+    # более поздний апдейт вперёд, поэтому он не ограничивает, а лимит действует уже после
+    # блокировки чата. Апдейты, ждущие свой чат, заодно не занимают места обработки.
+    def __init__(self, max_concurrent_updates):
+        super().__init__(2 ** 31 - 1)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._slots:
+                await coroutine
+            return
+        # [блокировка, сколько апдейтов чата в обработке или в очереди]
+        entry = self._locks.get(chat.id)
+        if entry is None:
+            entry = self._locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
 def get_rsi_for_coin(coin):
-    from config import API_KEY, API_SECRET
-    client = Client(API_KEY, API_SECRET)
-    candles = client.get_klines(symbol=coin, interval="1m", limit=100)
-    df = pd.DataFrame(candles, columns=[
-        'timestamp','open','high','low','close','volume','close_time',
-        'quote_asset_volume','number_of_trades','taker_buy_base_volume',
-        'taker_buy_quote_volume','ignore'
-    ])
-    df['close'] = pd.to_numeric(df['close'])
+    # Те же свечи, что у торгового цикла: из общего кэша, у Binance — только новые.
+    # Блокирующая: из обработчиков вызывать через asyncio.to_thread. pandas и ta импортируются
+    # при первом запросе RSI, а не при старте процесса
+    import pandas as pd
+    import ta
+    kline_cache = get_kline_cache()
+    if kline_cache is not None:
+        df = pd.DataFrame({'close': kline_cache.window(coin, "1m", 100)[CLOSE]})
+    else:
+        candles = get_client().get_klines(symbol=coin, interval="1m", limit=100)
+        df = pd.DataFrame(candles, columns=[
+            'timestamp','open','high','low','close','volume','close_time',
+            'quote_asset_volume','number_of_trades','taker_buy_base_volume',
+            'taker_buy_quote_volume','ignore'
+        ])
+        df['close'] = pd.to_numeric(df['close'])
     rsi = ta.momentum.RSIIndicator(df['close'], window=14).rsi().iloc[-1]
     return rsi
 
@@ -36,17 +90,17 @@ async def setmode_command(update: Update, context: CallbackContext):
 
 async def getmode_command(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
-    mode = get_trading_mode(chat_id)
+    mode = await asyncio.to_thread(get_trading_mode, chat_id)
     await update.message.reply_text(f"Текущий торговый режим: {mode}")
 
 async def choose_mode(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
     mode_text = update.message.text.strip().lower()
     if "скальп" in mode_text:
-        set_trading_mode(chat_id, "scalp")
+        await asyncio.to_thread(set_trading_mode, chat_id, "scalp")
         response = "Торговый режим установлен на скальпинг (20-30 минут)."
     else:
-        set_trading_mode(chat_id, "long")
+        await asyncio.to_thread(set_trading_mode, chat_id, "long")
         response = "Торговый режим установлен на дневной (1-2 дня)."
     main_keyboard = [
         ["🚀 Установить баланс", "💰 Посмотреть баланс"],
@@ -60,14 +114,14 @@ async def choose_mode(update: Update, context: CallbackContext):
     await update.message.reply_text(response, reply_markup=reply_markup)
 
 async def start(update: Update, context: CallbackContext):
-    enable_signals()
+    await asyncio.to_thread(enable_signals)
     instructions = (
         "Привет! Я криптобот для поиска торговых сигналов.\n\n"
         "Доступные действия:\n"
         " • 🚀 'Установить баланс' – введите сумму в USDT.\n"
         " • 💰 'Посмотреть баланс' – узнайте ваш текущий баланс.\n"
-        " • 📊 'История сигналов' – последние 10 сигналов.\n"
-        " • 📜 'История сделок' – последние 10 сделок.\n"
+        " • 📊 'История сигналов' – ваши последние 10 сигналов (/signals BTCUSDT — по монете).\n"
+        " • 📜 'История сделок' – последние 10 сделок, /stats – статистика по закрытым сделкам.\n"
         " • ✅ 'Добавить прибыльную сделку' / ❌ 'Добавить убыточную сделку' – внесите сделку для обновления баланса.\n"
         " • ➕ 'Добавить позицию' – введите монету, направление, плечо, сумму инвестиций и цену входа.\n"
         " • 📈 'Мои позиции' – список ваших позиций.\n"
@@ -94,27 +148,37 @@ async def ask_balance(update: Update, context: CallbackContext):
 async def set_user_balance(update: Update, context: CallbackContext):
     try:
         amount = float(update.message.text)
-        set_balance(update.message.chat_id, amount)
+        await asyncio.to_thread(set_balance, update.message.chat_id, amount)
         context.user_data["awaiting_balance"] = False
         await update.message.reply_text(f"✅ Баланс установлен: {amount:.2f} USDT")
     except ValueError:
         await update.message.reply_text("⚠️ Введите корректную сумму!")
 
 async def show_balance(update: Update, context: CallbackContext):
-    balance = get_balance(update.message.chat_id)
+    balance = await asyncio.to_thread(get_balance, update.message.chat_id)
     if balance is not None:
         await update.message.reply_text(f"💰 Ваш текущий баланс: {balance:.2f} USDT")
     else:
         await update.message.reply_text("⚠️ Баланс не установлен.")
 
 async def show_signals(update: Update, context: CallbackContext):
-    history = get_signals_history()
+    # Кнопка — сигналы, отправленные этому пользователю; /signals BTCUSDT — все сигналы по монете
+    if context.args:
+        symbol = context.args[0].upper()
+        history = await asyncio.to_thread(get_signals_history, symbol=symbol)
+        await update.message.reply_text(f"📊 История сигналов по {symbol}:\n{history}")
+        return
+    history = await asyncio.to_thread(get_signals_history, update.message.chat_id)
     await update.message.reply_text(f"📊 История сигналов:\n{history}")
 
 async def show_trades(update: Update, context: CallbackContext):
-    history = get_trades_history(update.message.chat_id)
+    history = await asyncio.to_thread(get_trades_history, update.message.chat_id)
     await update.message.reply_text(f"📜 История сделок:\n{history}")
 
+async def show_stats(update: Update, context: CallbackContext):
+    stats = await asyncio.to_thread(get_trade_stats_text, update.message.chat_id)
+    await update.message.reply_text(f"📈 Статистика сделок:\n{stats}")
+
 async def ask_trade(update: Update, context: CallbackContext):
     global user_trade_mode
     chat_id = update.message.chat_id
@@ -133,19 +197,19 @@ async def save_user_trade(update: Update, context: CallbackContext):
         return
     try:
         trade_amount = float(update.message.text.strip())
-        current_balance = get_balance(chat_id)
+        current_balance = await asyncio.to_thread(get_balance, chat_id)
         if current_balance is None:
             await update.message.reply_text("⚠️ Баланс не установлен!")
             del user_trade_mode[chat_id]
             return
         if user_trade_mode[chat_id] == "profit":
-            new_balance = current_balance + trade_amount
+            pnl = trade_amount
             trade_type = "ПРИБЫЛЬ"
         else:
-            new_balance = current_balance - trade_amount
+            pnl = -trade_amount
             trade_type = "УБЫТОК"
-        save_trade(chat_id, f"{trade_type}: {trade_amount:.2f} USDT")
-        set_balance(chat_id, new_balance)
+        # Баланс, история и статистика меняются одной записью
+        new_balance = await asyncio.to_thread(add_trade, chat_id, manual_trade(pnl))
         del user_trade_mode[chat_id]
         await update.message.reply_text(
             f"✅ Сделка записана: {trade_type} {trade_amount:.2f} USDT\nНовый баланс: {new_balance:.2f} USDT"
@@ -164,8 +228,7 @@ async def add_position(update: Update, context: CallbackContext):
 async def set_position_coin(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
     coin = update.message.text.strip().upper()
-    from config import load_positions
-    positions = load_positions(chat_id)
+    positions = await asyncio.to_thread(load_positions, chat_id)
     for pos in positions:
         if pos.get("coin", "").upper() == coin:
             await update.message.reply_text(f"По монете {coin} у вас уже открыта позиция.")
@@ -210,7 +273,6 @@ async def set_position_stake(update: Update, context: CallbackContext):
         await update.message.reply_text("⚠️ Введите корректную сумму инвестиций!")
 
 async def set_position_entry(update: Update, context: CallbackContext):
-    from config import load_positions, save_positions, calc_sl_tp
     chat_id = update.message.chat_id
     try:
         entry_price = float(update.message.text)
@@ -219,7 +281,6 @@ async def set_position_entry(update: Update, context: CallbackContext):
         leverage = position_creation[chat_id].get("leverage", 0)
         stake = position_creation[chat_id].get("stake", 0)
         stop_loss, take_profit = calc_sl_tp(side, entry_price)
-        positions = load_positions(chat_id)
         new_pos = {
             "coin": coin,
             "side": side,
@@ -227,10 +288,10 @@ async def set_position_entry(update: Update, context: CallbackContext):
             "stop_loss": stop_loss,
             "take_profit": take_profit,
             "leverage": leverage,
-            "stake": stake
+            "stake": stake,
+            "opened_at": now_ms()
         }
-        positions.append(new_pos)
-        save_positions(chat_id, positions)
+        await asyncio.to_thread(append_position, chat_id, new_pos)
         msg = (
             f"✅ Позиция добавлена:\nМонета: {coin}\nНаправление: {side}\nЦена входа: {entry_price:.2f}\n"
             f"Плечо: {leverage}x, Сумма: {stake:.2f} USDT\n"
@@ -244,42 +305,27 @@ async def set_position_entry(update: Update, context: CallbackContext):
 
 async def show_positions(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
-    positions = load_positions(chat_id)
+    positions = await asyncio.to_thread(load_positions, chat_id)
     if not positions:
         await update.message.reply_text("Нет открытых позиций.")
         return
-    from config import API_KEY, API_SECRET
-    from binance.client import Client
-    client = Client(API_KEY, API_SECRET)
-    msg = "📈 Ваши позиции:\n"
-    for i, pos in enumerate(positions, start=1):
-        coin = pos["coin"]
-        side = pos["side"].upper()
-        entry = pos["entry"]
-        stake = pos.get("stake", 0)
+    price_cache = get_price_cache()
+    if not price_cache.is_fresh():
+        # Кэш ещё не прогрет или фоновое обновление отстало: один bulk-запрос вне event loop
         try:
-            ticker = client.get_symbol_ticker(symbol=coin)
-            current_price = float(ticker["price"])
+            await asyncio.to_thread(price_cache.refresh)
         except Exception as e:
-            msg += f"{i}. {coin}: Ошибка получения цены\n"
-            continue
-        if side == "BUY":
-            percent_change = ((current_price - entry) / entry) * 100
-        else:
-            percent_change = ((entry - current_price) / entry) * 100
-        status = f"{percent_change:+.1f}%"
-        msg += (
-            f"{i}. {coin} ({side})\n"
-            f"   Цена входа: {entry:.2f}\n"
-            f"   Текущая цена: {current_price:.2f}\n"
-            f"   Изменение: {status}\n"
-            f"   (Плечо: {pos.get('leverage', 0)}x, Сумма: {stake:.2f} USDT, SL: {pos['stop_loss']:.2f}, TP: {pos['take_profit']:.2f})\n"
-        )
-    await update.message.reply_text(msg)
+            print(f"Ошибка обновления цен: {e}")
+    # Сводка — из портфеля по последним ценам PriceCache; позиции и баланс
+    # сверяются с хранилищем (их могли изменить торговый цикл или этот же пользователь)
+    balance = await asyncio.to_thread(get_balance, chat_id)
+    portfolio = get_portfolio()
+    await asyncio.to_thread(portfolio.set_user, chat_id, balance, positions)
+    await update.message.reply_text(format_summary(portfolio.summary(chat_id)))
 
 async def delete_position(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
-    positions = load_positions(chat_id)
+    positions = await asyncio.to_thread(load_positions, chat_id)
     if not positions:
         await update.message.reply_text("Нет открытых позиций для удаления.")
         return
@@ -296,12 +342,10 @@ async def confirm_delete_position(update: Update, context: CallbackContext):
     except ValueError:
         await update.message.reply_text("⚠️ Введите корректный номер позиции!")
         return
-    positions = load_positions(chat_id)
-    if index < 1 or index > len(positions):
+    pos = await asyncio.to_thread(remove_position, chat_id, index)
+    if pos is None:
         await update.message.reply_text("⚠️ Позиция с таким номером не найдена!")
     else:
-        pos = positions.pop(index - 1)
-        save_positions(chat_id, positions)
         await update.message.reply_text(f"✅ Позиция {pos['coin']} {pos['side']} по {pos['entry']:.2f} удалена.")
     context.user_data["awaiting_delete"] = False
 
@@ -328,13 +372,16 @@ async def handle_text(update: Update, context: CallbackContext):
     elif update.message.text.strip() in ["Дневной режим", "Скальпинг"]:
         await choose_mode(update, context)
 
-def run_telegram_bot():
-    from telegram.ext import Application
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+async def count_update(update: Update, context: CallbackContext):
+    # Группа -1: срабатывает до основных обработчиков и не мешает им
+    inc("telegram_updates_total", kind="command" if update.message and (update.message.text or "").startswith("/") else "message")
 
+def add_handlers(app):
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("setmode", setmode_command))
     app.add_handler(CommandHandler("getmode", getmode_command))
+    app.add_handler(CommandHandler("signals", show_signals))
+    app.add_handler(CommandHandler("stats", show_stats))
     app.add_handler(MessageHandler(filters.Regex("^(Дневной режим|Скальпинг)$"), choose_mode))
     app.add_handler(MessageHandler(filters.Regex("🚀 Установить баланс"), ask_balance))
     app.add_handler(MessageHandler(filters.Regex("💰 Посмотреть баланс"), show_balance))
@@ -347,9 +394,26 @@ def run_telegram_bot():
     app.add_handler(MessageHandler(filters.Regex("❌ Удалить позицию"), delete_position))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
 
+def run_telegram_bot():
+    from telegram.ext import Application
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(TELEGRAM_CONCURRENT_UPDATES))
+        .build()
+    )
+    add_handlers(app)
+
     import asyncio
     loop = asyncio.new_event_loop()
+    # Пул для asyncio.to_thread: хранилище, журнал сигналов и запросы к Binance из обработчиков
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=TELEGRAM_IO_THREADS, thread_name_prefix="telegram-io"))
     asyncio.set_event_loop(loop)
 
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + 1)
+        app.add_handler(TypeHandler(Update, count_update), group=-1)
+    get_price_cache()
+    get_portfolio()
     print("Telegram-бот запущен...")
     app.run_polling()
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+import kline_stream
+from candle_store import INTERVAL_MS, OPEN_TIME, CLOSE
+from fake_binance import FakeClient, FakeKlineServer
+from kline_stream import KlineStream
+
+START_MS = 1_700_002_800_000
+MINUTE = INTERVAL_MS["1m"]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def last_open(stream, symbol="BTCUSDT"):
+    return stream.store.buffer(symbol, "1m").last_open_time()
+
+
+@pytest.fixture
+def setup(monkeypatch):
+    monkeypatch.setattr(kline_stream, "RECONNECT_DELAY", 0.05)
+    server = FakeKlineServer()
+    server.start()
+    fake = FakeClient(START_MS, symbols=["BTCUSDT", "ETHUSDT"])
+    stream = KlineStream(fake, fake.symbols, ["1m"], window=50, url=server.url)
+    stream.start()
+    assert stream.wait_ready(timeout=10)
+    yield server, fake, stream
+    stream.stop()
+    server.stop()
+
+
+def test_initial_backfill_fills_window(setup):
+    _, fake, stream = setup
+    for symbol in fake.symbols:
+        window = stream.get_window(symbol, "1m", 50)
+        assert window.shape == (6, 50)
+        assert window[OPEN_TIME, -1] == START_MS
+        assert (window[OPEN_TIME, 1:] - window[OPEN_TIME, :-1] == MINUTE).all()
+    assert stream.get_window("BTCUSDT", "1m", 51) is None
+
+
+def test_stream_updates_last_candle(setup):
+    server, fake, stream = setup
+    row = fake._kline("BTCUSDT", "1m", START_MS + MINUTE)
+    server.push("BTCUSDT", "1m", row)
+    assert wait_for(lambda: last_open(stream) == START_MS + MINUTE)
+    # Обновление той же свечи перезаписывает её, а не добавляет новую
+    updated = list(row)
+    updated[4] = "123.45"
+    server.push("BTCUSDT", "1m", updated, closed=True)
+    assert wait_for(lambda: stream.get_window("BTCUSDT", "1m", 1)[CLOSE, -1] == 123.45)
+    window = stream.get_window("BTCUSDT", "1m", 50)
+    assert window[OPEN_TIME, -2] == START_MS
+    assert window[OPEN_TIME, -1] == START_MS + MINUTE
+
+
+def test_reconnect_backfills_missed_candles(setup):
+    server, fake, stream = setup
+    assert wait_for(lambda: server.connection_count() == 1)
+    # Связь обрывается, пока на бирже закрываются три свечи
+    fake.now_ms = START_MS + 3 * MINUTE
+    server.drop_connections()
+    assert wait_for(lambda: stream.reconnects >= 1)
+    assert wait_for(lambda: all(last_open(stream, symbol) == START_MS + 3 * MINUTE for symbol in fake.symbols))
+    assert wait_for(lambda: server.connection_count() == 1)
+
+    window = stream.get_window("BTCUSDT", "1m", 50)
+    assert (window[OPEN_TIME, 1:] - window[OPEN_TIME, :-1] == MINUTE).all()
+    expected = fake._kline("BTCUSDT", "1m", START_MS + 2 * MINUTE)
+    assert window[CLOSE, -2] == float(expected[4])
+    # Догрузка после переподключения — с последней известной свечи, а не всё окно заново
+    _, _, _, limit = fake.calls[-1]
+    assert limit == 1000
+
+    # После переподключения поток снова доставляет свечи
+    server.push("BTCUSDT", "1m", fake._kline("BTCUSDT", "1m", START_MS + 4 * MINUTE))
+    assert wait_for(lambda: last_open(stream) == START_MS + 4 * MINUTE)
@@ -0,0 +1,41 @@
+import os
+
+from signal_journal import SignalJournal
+
+
+def journal_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def fill(journal, batches, rare_chat_id=None):
+    for i in range(batches):
+        signals = [(f"S{k}USDT", "BUY", 100 + i, 99, 101) for k in range(10)]
+        recipients = {symbol: [1000 + (i + k) % 50] for k, (symbol, *_) in enumerate(signals)}
+        if rare_chat_id is not None and i == 0:
+            recipients["S0USDT"].append(rare_chat_id)
+        journal.append(signals, recipients, ts=i)
+
+
+def test_rotation_bounds_log_and_indexes(tmp_path):
+    journal = SignalJournal(str(tmp_path), segment_bytes=20_000, keep_segments=3)
+    # Индексы удаляются вместе со своими сегментами: объём журнала не растёт с историей
+    # (на запись ~100 байт JSON и 40 байт индексов)
+    for _ in range(4):
+        fill(journal, 500)
+        assert len(os.listdir(tmp_path)) == 3
+        assert journal_bytes(tmp_path) < 3 * 20_000 * 1.5
+
+
+def test_tail_filters_and_numbering(tmp_path):
+    journal = SignalJournal(str(tmp_path), segment_bytes=20_000, keep_segments=3)
+    fill(journal, 1000, rare_chat_id=777)
+    records = journal.tail(5)
+    assert [r["seq"] for r in records] == list(range(9995, 10000))
+    by_symbol = journal.tail(3, symbol="s3usdt")
+    assert [r["seq"] for r in by_symbol] == [9973, 9983, 9993]
+    by_user = journal.tail(4, chat_id=1000)
+    assert len(by_user) == 4 and by_user == sorted(by_user, key=lambda r: r["seq"])
+    # Сигнал редкому получателю ушёл вместе с ротацией сегмента
+    assert journal.tail(10, chat_id=777) == []
+    # Нумерация продолжается после перезапуска
+    assert SignalJournal(str(tmp_path)).append([("BTCUSDT", "SELL", 1, 2, 0.5)]) == [10000]
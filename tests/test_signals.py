@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import bot
+from candle_store import candles_to_frame, klines_to_array
+from fake_binance import FakeClient
+from indicators import IndicatorEngine
+from signals import FEATURES, check_trade_signals_batch, decide_signals_from_values, stack_aligned
+
+# Векторные решения signals.py должны совпадать с check_trade_signal_extended (pandas + ta)
+# на любых окнах, включая короткие, где часть индикаторов ещё NaN
+
+PARAMS = [
+    None,
+    {"required_confirmations": 2},
+    {"required_confirmations": 4, "rsi_buy": 40, "rsi_sell": 60},
+    {"volume_spike": 1.1, "resistance_factor": 0.995, "atr_threshold": 0.002},
+]
+
+
+def random_windows(count=540, seed=0):
+    # Случайное блуждание с трендом разного знака и всплесками объёма; длины от 15 свечей
+    # (на меньших ta не считает ATR) до 300
+    rng = np.random.default_rng(seed)
+    windows = []
+    for _ in range(count):
+        n = int(rng.choice([15, 19, 20, 49, 60, 199, 200, 250, 300]))
+        close = 100 * np.exp(np.cumsum(rng.normal(rng.uniform(-0.003, 0.003), 0.01, n)))
+        open_price = np.concatenate(([close[0]], close[:-1]))
+        high = np.maximum(open_price, close) * (1 + rng.uniform(0, 0.01, n))
+        low = np.minimum(open_price, close) * (1 - rng.uniform(0, 0.01, n))
+        volume = rng.uniform(10, 100, n) * np.where(rng.random(n) < 0.1, 5, 1)
+        open_time = np.arange(n) * 60_000.0
+        windows.append(np.vstack([open_time, open_price, high, low, close, volume]))
+    return windows
+
+
+@pytest.fixture(scope="module")
+def frames():
+    return [bot.apply_indicators(candles_to_frame(candles)) for candles in random_windows()]
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_batch_matches_scalar(frames, params):
+    expected = [bot.check_trade_signal_extended(df, params) for df in frames]
+    width = max(len(df) for df in frames)
+    columns = [stack_aligned([df[name].to_numpy() for df in frames], width)
+               for name in ("close", "volume", "SMA_50", "SMA_200", "RSI", "ATR")]
+    assert list(check_trade_signals_batch(*columns, params=params)) == expected
+    # Решение встречается каждого вида, иначе проверка ничего не доказывает
+    assert {"BUY", "SELL", None} <= set(expected)
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_values_match_scalar(frames, params):
+    expected = [bot.check_trade_signal_extended(df, params) for df in frames]
+    rows = []
+    for df in frames:
+        latest = df.iloc[-1]
+        rows.append({
+            "close": latest["close"], "volume": latest["volume"], "SMA_50": latest["SMA_50"],
+            "SMA_200": latest["SMA_200"], "RSI": latest["RSI"], "ATR": latest["ATR"],
+            "volume_mean_20": df["volume"].rolling(window=20).mean().iloc[-1],
+            "close_max_20": df["close"].rolling(window=20).max().iloc[-1],
+        })
+    assert list(decide_signals_from_values(rows, params)) == expected
+
+
+def test_engine_rows_match_scalar():
+    # Путь цикла: IndicatorEngine по окну свечей и решение одним проходом
+    fake = FakeClient(1_700_002_800_000, symbols=[f"S{i}USDT" for i in range(30)])
+    engine = IndicatorEngine()
+    rows, expected = [], []
+    for symbol in fake.symbols:
+        candles = klines_to_array(fake.get_klines(symbol=symbol, interval="1m", limit=250))
+        row = engine.update(symbol, "1m", candles)
+        assert set(FEATURES) <= set(row)
+        rows.append(row)
+        expected.append(bot.check_trade_signal_extended(bot.apply_indicators(candles_to_frame(candles))))
+    assert list(decide_signals_from_values(rows)) == expected
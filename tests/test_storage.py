@@ -0,0 +1,27 @@
+import threading
+
+from storage import SQLiteStorage
+
+
+def test_cycle_read_is_one_snapshot(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "user_data.db"))
+    storage.set_balance("1", 100)
+    storage.append_position("1", {"coin": "BTCUSDT", "side": "BUY", "entry": 100, "stake": 10})
+
+    def close_from_telegram():
+        # Другой поток — своё соединение, как у Telegram-процесса
+        storage.close_position("1", "BTCUSDT", 5, 110)
+
+    with storage.snapshot() as conn:
+        balance = conn.execute("SELECT balance FROM users WHERE chat_id = '1'").fetchone()[0]
+        writer = threading.Thread(target=close_from_telegram)
+        writer.start()
+        writer.join()
+        data = storage._read_cycle_data(conn)
+    # Закрытие закоммичено между чтениями, но снимок видит состояние до него целиком
+    assert balance == data["balances"]["1"] == 100
+    assert [p["coin"] for p in data["positions"]["1"]] == ["BTCUSDT"]
+
+    data = storage.load_cycle_data()
+    assert data["balances"]["1"] == 105
+    assert data["positions"] == {}
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from fake_telegram import FakeTelegramServer
+from telegram_bot import NotificationDispatcher
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(**kwargs):
+        fake = FakeTelegramServer(**kwargs)
+        fake.start()
+        servers.append(fake)
+        return fake
+    yield start
+    for fake in servers:
+        fake.stop()
+
+
+def make_dispatcher(server, workers=4):
+    # Лимиты Telegram не нужны: проверяем повторы и порядок, а не 30 сообщений/с
+    dispatcher = NotificationDispatcher(token="test", base_url=server.url, workers=workers,
+                                        global_rate=1e9, chat_rate=1e9)
+    dispatcher.start()
+    return dispatcher
+
+
+def test_retry_after_pauses_all_workers(server):
+    fake = server(latency=0.02, rate_limit_every=15, retry_after=1)
+    dispatcher = make_dispatcher(fake)
+    for i in range(40):
+        dispatcher.send(f"сообщение {i}", 1000 + i)
+    dispatcher.stop(timeout=30)
+
+    stats = dispatcher.stats()
+    assert stats["sent"] == 40
+    assert stats["failed"] == 0
+    assert stats["rate_limited"] >= 1
+    # После 429 ни один поток не отправляет, пока не пройдёт retry_after (запросы, уже
+    # отправленные другими потоками в тот же момент, успевают дойти за 0.1 с)
+    for limited_at in fake.rate_limited_at:
+        assert not [t for t in fake.received_at if limited_at + 0.1 < t < limited_at + 0.9]
+
+
+def test_forbidden_is_not_retried(server):
+    fake = server(fail_chat_ids=[42])
+    dispatcher = make_dispatcher(fake)
+    dispatcher.send("заблокирован", 42)
+    dispatcher.send("доставлено", 43)
+    dispatcher.stop(timeout=10)
+
+    stats = dispatcher.stats()
+    assert stats["sent"] == 1
+    assert stats["failed"] == 1
+    assert stats["retries"] == 0
+    assert fake.requests == 2
+    assert fake.messages == [("43", "доставлено")]
+
+
+def test_messages_keep_order_per_chat(server):
+    fake = server(latency=0.002)
+    dispatcher = make_dispatcher(fake)
+    chats = [f"{500 + i}" for i in range(6)]
+    for n in range(20):
+        for chat_id in chats:
+            dispatcher.send(f"{chat_id}:{n}", chat_id)
+    started = time.monotonic()
+    dispatcher.stop(timeout=30)
+    assert time.monotonic() - started < 30
+
+    for chat_id in chats:
+        texts = [text for chat, text in fake.messages if chat == chat_id]
+        assert texts == [f"{chat_id}:{n}" for n in range(20)]
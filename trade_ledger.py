@@ -0,0 +1,115 @@
+import re
+import time
+
+# Журнал сделок: структурированные записи вместо строк "ПРИБЫЛЬ: 50.00 USDT" и сводная
+# статистика, которая обновляется на каждой сделке за O(1) и хранится рядом со сделками.
+
+LEGACY_TRADE = re.compile(r"(ПРИБЫЛЬ|УБЫТОК):\s*([\d.]+)")
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def make_trade(position, exit_price, pnl, reason, closed_at=None):
+    # Сделка из закрытой позиции (словарь из positions)
+    return {
+        "coin": position["coin"].upper(),
+        "side": position["side"].upper(),
+        "entry": position["entry"],
+        "exit": exit_price,
+        "leverage": position.get("leverage", 1),
+        "stake": position.get("stake", 0),
+        "pnl": pnl,
+        "opened_at": position.get("opened_at"),
+        "closed_at": closed_at or now_ms(),
+        "reason": reason,
+    }
+
+
+def manual_trade(pnl, closed_at=None):
+    # Прибыль/убыток, введённые вручную кнопками в Telegram
+    return {
+        "coin": None, "side": None, "entry": None, "exit": None, "leverage": None, "stake": None,
+        "pnl": pnl, "opened_at": None, "closed_at": closed_at or now_ms(), "reason": "manual",
+    }
+
+
+def parse_legacy_trade(trade):
+    # Старые записи — строки; для статистики из них берём только сумму
+    if isinstance(trade, dict):
+        return trade
+    match = LEGACY_TRADE.search(str(trade))
+    if match is None:
+        return None
+    amount = float(match.group(2))
+    return manual_trade(amount if match.group(1) == "ПРИБЫЛЬ" else -amount, closed_at=0)
+
+
+def empty_stats():
+    return {
+        "trades": 0, "wins": 0, "total_pnl": 0.0, "best": None, "worst": None,
+        "peak_balance": None, "max_drawdown": 0.0, "by_symbol": {},
+    }
+
+
+def update_stats(stats, trade, balance):
+    # balance — баланс после сделки; просадка считается от максимума баланса
+    pnl = trade["pnl"]
+    stats["trades"] += 1
+    stats["wins"] += pnl > 0
+    stats["total_pnl"] += pnl
+    stats["best"] = pnl if stats["best"] is None else max(stats["best"], pnl)
+    stats["worst"] = pnl if stats["worst"] is None else min(stats["worst"], pnl)
+    peak = max(v for v in (stats["peak_balance"], balance - pnl, balance) if v is not None)
+    stats["peak_balance"] = peak
+    if peak > 0:
+        stats["max_drawdown"] = max(stats["max_drawdown"], (peak - balance) / peak)
+    coin = trade.get("coin") or "manual"
+    symbol = stats["by_symbol"].setdefault(coin, {"trades": 0, "wins": 0, "pnl": 0.0})
+    symbol["trades"] += 1
+    symbol["wins"] += pnl > 0
+    symbol["pnl"] += pnl
+    return stats
+
+
+def stats_from_trades(trades, balance):
+    # Однократный пересчёт для истории, записанной до появления статистики
+    parsed = [t for t in map(parse_legacy_trade, trades) if t is not None]
+    running = balance - sum(t["pnl"] for t in parsed)
+    stats = empty_stats()
+    for trade in parsed:
+        running += trade["pnl"]
+        update_stats(stats, trade, running)
+    return stats
+
+
+def format_trade(trade):
+    if not isinstance(trade, dict):
+        return str(trade)
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(trade["closed_at"] / 1000)) if trade.get("closed_at") else ""
+    if trade.get("coin") is None:
+        kind = "ПРИБЫЛЬ" if trade["pnl"] > 0 else "УБЫТОК"
+        return f"{when} {kind}: {abs(trade['pnl']):.2f} USDT".strip()
+    exit_price = f"{trade['exit']:.2f}" if trade.get("exit") is not None else "?"
+    return (f"{when} {trade['coin']} {trade['side']} x{trade['leverage']}: {trade['entry']:.2f} → {exit_price}, "
+            f"{trade['pnl']:+.2f} USDT ({trade['reason']})").strip()
+
+
+def format_stats(stats):
+    if not stats["trades"]:
+        return "Сделок пока нет."
+    lines = [
+        f"Сделок: {stats['trades']}, прибыльных: {stats['wins']} ({stats['wins'] / stats['trades']:.0%})",
+        f"Итого PnL: {stats['total_pnl']:+.2f} USDT",
+        f"Лучшая: {stats['best']:+.2f} USDT, худшая: {stats['worst']:+.2f} USDT",
+        f"Макс. просадка баланса: {stats['max_drawdown']:.1%}",
+    ]
+    by_symbol = sorted(stats["by_symbol"].items(), key=lambda item: item[1]["pnl"], reverse=True)
+    if by_symbol:
+        lines.append("По монетам:")
+        for coin, symbol in by_symbol:
+            name = "вручную" if coin == "manual" else coin
+            lines.append(f"  {name}: {symbol['trades']} сделок, {symbol['wins'] / symbol['trades']:.0%} прибыльных, "
+                         f"{symbol['pnl']:+.2f} USDT")
+    return "\n".join(lines)
@@ -0,0 +1,83 @@
+import time
+
+import metrics
+from config import (
+    SYMBOLS, UNIVERSE_QUOTE, UNIVERSE_MIN_QUOTE_VOLUME, UNIVERSE_MIN_RANGE, UNIVERSE_MAX_SPREAD,
+    UNIVERSE_MAX_SYMBOLS, UNIVERSE_EXCHANGE_INFO_HOURS
+)
+
+# Динамический список монет для цикла анализа. Торгуемые пары к UNIVERSE_QUOTE берутся из
+# exchangeInfo (раз в несколько часов), а каждый цикл один запрос 24h-тикеров по всем парам
+# отсекает неликвидные, спокойные и с широким спредом. Свечи и индикаторы считаются только для
+# прошедших отбор — сотни пар стоят один запрос плюс по одному get_klines на выжившую монету.
+
+
+def tradable_symbols(exchange_info, quote=UNIVERSE_QUOTE):
+    return {
+        s["symbol"] for s in exchange_info["symbols"]
+        if s["status"] == "TRADING" and s["quoteAsset"] == quote and s.get("isSpotTradingAllowed", True)
+    }
+
+
+def prefilter(tickers, tradable, min_quote_volume=UNIVERSE_MIN_QUOTE_VOLUME, min_range=UNIVERSE_MIN_RANGE,
+              max_spread=UNIVERSE_MAX_SPREAD, limit=UNIVERSE_MAX_SYMBOLS):
+    # 24h-тикеры -> монеты, прошедшие пороги, по убыванию оборота (не больше limit)
+    passed = []
+    for ticker in tickers:
+        symbol = ticker["symbol"]
+        if symbol not in tradable:
+            continue
+        last, bid, ask = float(ticker["lastPrice"]), float(ticker["bidPrice"]), float(ticker["askPrice"])
+        if last <= 0 or bid <= 0 or ask < bid:
+            continue
+        quote_volume = float(ticker["quoteVolume"])
+        price_range = (float(ticker["highPrice"]) - float(ticker["lowPrice"])) / last
+        spread = (ask - bid) / ((ask + bid) / 2)
+        if quote_volume >= min_quote_volume and price_range >= min_range and spread <= max_spread:
+            passed.append((quote_volume, symbol))
+    passed.sort(reverse=True)
+    return [symbol for _, symbol in passed[:limit]]
+
+
+class SymbolUniverse:
+    # pinned — монеты, которые анализируются всегда (SYMBOLS из config)
+    def __init__(self, client, pinned=SYMBOLS, exchange_info_hours=UNIVERSE_EXCHANGE_INFO_HOURS, clock=time.time,
+                 **thresholds):
+        self.client = client
+        self.pinned = list(pinned)
+        self.exchange_info_ttl = exchange_info_hours * 3600
+        self.clock = clock
+        self.thresholds = thresholds
+        self._tradable = None
+        self._tradable_at = 0.0
+        self._survivors = []
+
+    def tradable(self):
+        if self._tradable is None or self.clock() - self._tradable_at >= self.exchange_info_ttl:
+            try:
+                self._tradable = tradable_symbols(self.client.get_exchange_info())
+                self._tradable_at = self.clock()
+                print(f"DEBUG: торгуемых пар к {UNIVERSE_QUOTE}: {len(self._tradable)}.")
+            except Exception as e:
+                if self._tradable is None:
+                    raise
+                # Пары меняются редко: работаем со старым списком до следующей попытки
+                print(f"Ошибка exchangeInfo: {e}. Используем список пар от прошлого обновления.")
+        return self._tradable
+
+    def refresh(self, required=()):
+        # Монеты этого цикла: pinned, прошедшие отбор, затем required (открытые позиции и
+        # активные сигналы пользователей — их выход и исчезновение сигнала нужно проверять
+        # и после выпадения монеты из отбора)
+        try:
+            tickers = self.client.get_ticker()
+            self._survivors = prefilter(tickers, self.tradable(), **self.thresholds)
+            metrics.set_gauge("universe_candidates", len(tickers))
+        except Exception as e:
+            # Отбор не обновился — оставляем прошлый, цикл анализа продолжается
+            print(f"Ошибка обновления списка монет: {e}")
+        # Монеты позиций вводятся в Telegram вручную: несуществующая пара сломала бы запрос свечей
+        required = sorted(set(required) & self._tradable) if self._tradable else []
+        symbols = list(dict.fromkeys([*self.pinned, *self._survivors, *required]))
+        metrics.set_gauge("universe_symbols", len(symbols))
+        return symbols
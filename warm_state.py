@@ -0,0 +1,46 @@
+import os
+import time
+
+import numpy as np
+
+# Снимок «тёплого» состояния бота для быстрого перезапуска: состояние инкрементальных
+# индикаторов, отметки отправленных предупреждений портфеля и последний список монет. Один файл
+# np.savez (массивы numpy, без pickle), пишется при остановке через временный файл и os.replace.
+# Закрытые свечи kline_cache.py и notify_state в хранилище переживают перезапуск сами и в снимок
+# не входят; буферы CandleStore тоже: без кэша свечей окно всё равно целиком приходит из REST.
+
+VERSION = 1
+
+
+def save(path, indicator_engine=None, portfolio=None, symbols=None):
+    arrays = {"version": np.array(VERSION), "saved_at": np.array(int(time.time() * 1000))}
+    if indicator_engine is not None:
+        arrays.update(indicator_engine.export_state())
+    if portfolio is not None:
+        arrays.update(portfolio.export_alerts())
+    if symbols is not None:
+        arrays["symbols"] = np.array(symbols, dtype=str)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def load(path):
+    # {имя: массив} или None, если снимка нет, он другой версии или повреждён — тогда бот
+    # стартует как раньше, с прогревом по истории
+    try:
+        with np.load(path, allow_pickle=False) as f:
+            arrays = {name: f[name] for name in f.files}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Снимок состояния {path} не прочитан: {e}")
+        return None
+    if int(arrays.get("version", -1)) != VERSION:
+        print(f"Снимок состояния {path} другой версии, пропускаем.")
+        return None
+    return arrays